@@ -0,0 +1,4 @@
+"""
+Performance benchmarks, they are not part of the unit tests and are run explicitly i.e.
+python -m benchmarks.draft_decode
+"""
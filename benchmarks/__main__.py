@@ -0,0 +1,58 @@
+"""
+Runs the benchmark suite or compares two runs
+python -m benchmarks run [--output results.json] [--repeat N] [--history-rows N] [--only PREFIX]
+python -m benchmarks compare baseline.json results.json [--threshold 0.2]
+"""
+import argparse
+import sys
+
+from benchmarks import suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as json")
+    run_parser.add_argument("--output", default="bench_results.json")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--history-rows", type=int, default=100000)
+    run_parser.add_argument("--only", help="only run the benchmarks starting with this prefix")
+
+    compare_parser = subparsers.add_parser("compare", help="flag regressions of a run against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return _run(args)
+    if args.command == "compare":
+        return _compare(args)
+    parser.print_help()
+    return 2
+
+
+def _run(args):
+    results = suite.run(args.repeat, args.history_rows, args.only)
+    suite.save(results, args.output)
+    for name, result in sorted(results["results"].items()):
+        print("{:<45} {:>10.2f} ms".format(name, result["median_ms"]))
+    print("results written to {}".format(args.output))
+    return 0
+
+
+def _compare(args):
+    rows = suite.compare(suite.load(args.baseline), suite.load(args.current), args.threshold)
+    regressions = 0
+    for name, baseline_ms, current_ms, ratio, regressed in rows:
+        regressions += regressed
+        print("{:<45} {:>10.2f} {:>10.2f} {:>7.2f}x {}".format(
+            name, baseline_ms, current_ms, ratio, "REGRESSION" if regressed else ""
+        ))
+    print("{} regression(s) above {:.0%}".format(regressions, args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Compares the latency and the error of average_pixel on a full decode against reduced (JPEG draft) decodes.
+python -m benchmarks.draft_decode [--repeat N]
+"""
+import argparse
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from svc.processors import average_pixel
+from svc.utils.image_context import ImageContext
+
+SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+SCALES = [1, 2, 4, 8]
+
+
+def create_jpeg(size, seed=0):
+    """A smooth gradient with noise, closer to a photo than a flat or random image"""
+    width, height = size
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width)[None, :, None]
+    y = np.linspace(0, 255, height)[:, None, None]
+    pixels = (x * 0.6 + y * 0.4) * np.array([1.0, 0.8, 0.5]) + rng.normal(0, 20, (height, width, 3))
+    stream = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(stream, format="jpeg", quality=90)
+    return stream.getvalue()
+
+
+def measure(content, scale, repeat):
+    timings = []
+    value = None
+    for i in range(repeat):
+        started = time.perf_counter()
+        value = average_pixel.execute(ImageContext(BytesIO(content), max_decode_scale=scale))
+        timings.append(time.perf_counter() - started)
+    return value, min(timings)
+
+
+def run(repeat):
+    rows = []
+    for size in SIZES:
+        content = create_jpeg(size)
+        measures = [(scale, measure(content, scale, repeat)) for scale in SCALES]
+        exact, full_time = measures[0][1]
+        for scale, (value, elapsed) in measures:
+            rows.append({
+                "size": "{}x{}".format(*size),
+                "scale": "1/{}".format(scale),
+                "ms": elapsed * 1000,
+                "speedup": full_time / elapsed,
+                "relative_error": abs(value - exact) / exact,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print("{:>10} {:>6} {:>10} {:>8} {:>12}".format("size", "scale", "ms", "speedup", "rel. error"))
+    for row in run(args.repeat):
+        print("{size:>10} {scale:>6} {ms:>10.2f} {speedup:>7.1f}x {relative_error:>12.2e}".format(**row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Load test of the whole app over http: a weighted mix of uploads, history pages and image views sent by concurrent clients,
+at a fixed concurrency (closed loop) or a fixed arrival rate (open loop), reporting the throughput, latency percentiles and
+error rate of every endpoint. Runs offline against an in process app on a temporary database and storage, or --url.
+python -m benchmarks.load [--mix upload=1,history=3,view=6] [--concurrency N] [--rate R] [--duration S]
+    [--database URL] [--storage lcl|s3] [--set KEY=VALUE] [--output load.json]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.s3_standin import S3StandIn
+from benchmarks.suite import IMAGE_FORMATS, IMAGE_SIZES, create_image
+from svc.app import create_app, init_db
+from svc.config import common_config
+from svc.utils import storage_clients
+
+_ENDPOINTS = ("upload", "history", "view", "thumbnail")
+DEFAULT_MIX = "upload=1,history=3,view=6"
+HISTORY_PAGE_SIZE = 20
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(value):
+    """
+    :param value: comma separated `<endpoint>=<weight>`, i.e. upload=1,history=3,view=6
+    :return: dict of endpoint name to weight
+    """
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in _ENDPOINTS:
+            raise ValueError("unknown endpoint {!r}, expected one of {}".format(name, ", ".join(_ENDPOINTS)))
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("the mix has no endpoint with a positive weight")
+    return mix
+
+
+def percentile(sorted_values, rank):
+    """:return: the nearest rank percentile of an ascending list, None if it is empty"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(rank / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    """
+    :param elapsed: seconds of the measured run
+    :return: dict of endpoint name (and `all`) to its requests, errors, throughput and latencies in ms
+    """
+    report = {}
+    samples = recorder.get_samples()
+    samples["all"] = [sample for name in sorted(samples) for sample in samples[name]]
+    for name, rows in samples.items():
+        if not rows:
+            continue
+        latencies = sorted(latency for latency, status in rows)
+        errors = sum(1 for latency, status in rows if not _is_success(status))
+        report[name] = {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": errors / len(rows),
+            "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+            **{"p{}_ms".format(rank): percentile(latencies, rank) * 1000 for rank in PERCENTILES},
+            "max_ms": latencies[-1] * 1000,
+            "statuses": dict(Counter(str(status) for latency, status in rows)),
+        }
+    return report
+
+
+def run(url, mix, concurrency, rate=None, duration=30, max_requests=None, seed_images=20, image_size="small", seed=0):
+    """
+    Seeds the app with uploads then sends the mix for `duration` seconds or `max_requests` requests
+    :param url: base url of the app, i.e. http://127.0.0.1:8080
+    :param concurrency: number of clients, in open loop the most requests in flight
+    :param rate: requests per second arriving as a poisson process, None to run closed loop clients back to back
+    :return: the summary of the measured requests (see summarize) and the run parameters
+    """
+    traffic = _Traffic(url, image_size, seed)
+    for i in range(seed_images):
+        traffic.send("upload", random.Random(seed - i))
+    if not traffic.image_names:
+        raise RuntimeError("no image could be uploaded to {}".format(url))
+    recorder = _Recorder()
+    deadline = time.perf_counter() + duration
+    budget = itertools.count() if max_requests is None else iter(range(max_requests))
+    started = time.perf_counter()
+    if rate:
+        _run_open_loop(traffic, recorder, mix, concurrency, rate, deadline, budget, seed)
+    else:
+        _run_closed_loop(traffic, recorder, mix, concurrency, deadline, budget, seed)
+    elapsed = time.perf_counter() - started
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "url": url,
+            "mix": mix,
+            "concurrency": concurrency,
+            "rate": rate,
+            "elapsed_s": elapsed,
+            "image_size": image_size,
+        },
+        "endpoints": summarize(recorder, elapsed),
+    }
+
+
+@contextmanager
+def local_app(database=None, storage="lcl", overrides=None):
+    """
+    Serves create_app on a free local port with a threaded server, on a temporary sqlite database (or `database`)
+    and a temporary upload directory or an in memory s3 stand-in
+    :return: the base url of the app
+    """
+    directory = tempfile.mkdtemp(prefix="img-process-load-")
+    config = {
+        **common_config,
+        "SQLALCHEMY_DATABASE_URI": database or "sqlite:///" + os.path.join(directory, "load.db"),
+        "ALLOWED_IMAGES_EXTENSIONS": list(IMAGE_FORMATS),
+        "UPLOAD_TYPE": storage,
+        "UPLOAD_PATH": directory,
+        "S3_BUCKET_NAME": "load",
+        "PROCESSING_MODE": "sync",
+        # the uploaded images are reused, every upload must still be stored and processed
+        "DEDUPLICATE_UPLOADS": False,
+        **(overrides or {}),
+    }
+    s3 = S3StandIn()
+    storage_clients.reset()
+    server = None
+    try:
+        with mock.patch.object(storage_clients, "_create_client", lambda config: s3):
+            app = create_app(config)
+            init_db(app)
+            server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=_QuietRequestHandler)
+            thread = threading.Thread(target=server.serve_forever, name="load-server", daemon=True)
+            thread.start()
+            yield "http://127.0.0.1:{}".format(server.server_port)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        storage_clients.reset()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log(self, type, message, *args):
+        pass
+
+
+class _Recorder:
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, name, latency, status):
+        with self._lock:
+            self._samples[name].append((latency, status))
+
+    def get_samples(self):
+        with self._lock:
+            return {name: list(rows) for name, rows in self._samples.items()}
+
+
+class _Traffic:
+    """Builds and sends the requests of every endpoint, the uploaded image names are reused by the views"""
+
+    def __init__(self, url, image_size, seed):
+        parts = urlsplit(url)
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._prefix = parts.path.rstrip("/")
+        # distinct contents so the uploads look like different images to the perceptual hash too
+        self._images = [
+            ("load_{}.{}".format(i, image_format), create_image(IMAGE_SIZES[image_size], image_format, seed + i), mimetype)
+            for i, (image_format, mimetype) in enumerate(list(IMAGE_FORMATS.items()) * 4)
+        ]
+        self._next_image = itertools.count()
+        self._names_lock = threading.Lock()
+        self.image_names = []
+
+    def send(self, name, rng):
+        """:return: the status code, 0 if the request failed without a response"""
+        return getattr(self, "_" + name)(rng)
+
+    def _upload(self, rng):
+        filename, content, mimetype = self._images[next(self._next_image) % len(self._images)]
+        body, content_type = _encode_multipart("image", filename, content, mimetype)
+        status, response = self._request("POST", "/images", body, {"Content-Type": content_type})
+        if _is_success(status):
+            with self._names_lock:
+                self.image_names.append(json.loads(response)["image"])
+        return status
+
+    def _history(self, rng):
+        pages = max(1, len(self.image_names) // HISTORY_PAGE_SIZE)
+        query = urlencode({"page": rng.randint(1, pages), "count": HISTORY_PAGE_SIZE})
+        return self._request("GET", "/images?" + query)[0]
+
+    def _view(self, rng):
+        return self._request("GET", "/images/view/" + self._pick_name(rng))[0]
+
+    def _thumbnail(self, rng):
+        query = urlencode({"width": 128, "height": 128, "fit": "cover"})
+        return self._request("GET", "/images/view/{}?{}".format(self._pick_name(rng), query))[0]
+
+    def _pick_name(self, rng):
+        with self._names_lock:
+            return rng.choice(self.image_names)
+
+    def _request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(self._host, self._port, timeout=60)
+        try:
+            connection.request(method, self._prefix + path, body, headers or {})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            return 0, b""
+        finally:
+            connection.close()
+
+
+def _run_closed_loop(traffic, recorder, mix, concurrency, deadline, budget, seed):
+    # every client sends its next request as soon as the previous one returns
+    def client(index):
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline and next(budget, None) is not None:
+            _send(traffic, recorder, _pick(mix, rng), rng)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _run_open_loop(traffic, recorder, mix, concurrency, rate, deadline, budget, seed):
+    # requests arrive on schedule whatever the latency, the time waiting for a free client is part of the latency
+    rng = random.Random(seed)
+    arrival = time.perf_counter()
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="load-client") as pool:
+        while next(budget, None) is not None:
+            arrival += rng.expovariate(rate)
+            if arrival >= deadline:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_send, traffic, recorder, _pick(mix, rng), random.Random(rng.random()), arrival)
+
+
+def _send(traffic, recorder, name, rng, scheduled=None):
+    started = scheduled if scheduled is not None else time.perf_counter()
+    status = traffic.send(name, rng)
+    recorder.add(name, time.perf_counter() - started, status)
+
+
+def _pick(mix, rng):
+    names = list(mix)
+    return rng.choices(names, [mix[name] for name in names])[0]
+
+
+def _is_success(status):
+    return 200 <= status < 400
+
+
+def _encode_multipart(field, filename, content, mimetype):
+    boundary = "load-{}".format(random.getrandbits(64))
+    body = b"".join([
+        "--{}\r\n".format(boundary).encode(),
+        'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'.format(field, filename).encode(),
+        "Content-Type: {}\r\n\r\n".format(mimetype).encode(),
+        content,
+        "\r\n--{}--\r\n".format(boundary).encode(),
+    ])
+    return body, "multipart/form-data; boundary={}".format(boundary)
+
+
+def _parse_overrides(items):
+    overrides = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="load an already running app instead of an in process one")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of {}".format(", ".join(_ENDPOINTS)))
+    parser.add_argument("--concurrency", type=int, default=8, help="clients, or the most requests in flight with --rate")
+    parser.add_argument("--rate", type=float, help="requests per second (open loop), default: clients back to back")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--seed-images", type=int, default=20, help="images uploaded before the measured run")
+    parser.add_argument("--image-size", choices=sorted(IMAGE_SIZES), default="small")
+    parser.add_argument("--database", help="SQLALCHEMY_DATABASE_URI of the in process app, default: temporary sqlite")
+    parser.add_argument("--storage", choices=["lcl", "s3"], default="lcl", help="s3 uses an in memory stand-in")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="config of the in process app, values are parsed as json, i.e. PROCESSING_EXECUTOR=process")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as json")
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    def load(url):
+        return run(url, mix, args.concurrency, args.rate, args.duration, args.requests, args.seed_images,
+                   args.image_size, args.seed)
+
+    if args.url:
+        report = load(args.url)
+    else:
+        with local_app(args.database, args.storage, _parse_overrides(args.set)) as url:
+            report = load(url)
+        report["meta"].update(database=args.database or "sqlite", storage=args.storage)
+    print("{:<10} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "endpoint", "requests", "error %", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"
+    ))
+    for name, row in report["endpoints"].items():
+        print("{:<10} {requests:>8} {error_rate:>8.1%} {throughput_rps:>8.1f} {p50_ms:>9.1f} {p95_ms:>9.1f} "
+              "{p99_ms:>9.1f} {max_ms:>9.1f}".format(name, **row))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("report written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
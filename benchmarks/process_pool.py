@@ -0,0 +1,74 @@
+"""
+Compares the latency of CPU bound tasks run on the thread and the process executors.
+This module is also the benchmarked task: a python level loop over the pixels holding the GIL, as a filter written
+without numpy would. python -m benchmarks.process_pool [--repeat N] [--tasks N] [--size WxH]
+"""
+import argparse
+import importlib
+import time
+from io import BytesIO
+
+from svc.processors import average_pixel, channel_statistics
+from svc.utils.image_context import ImageContext
+from svc.utils.process_executor import ProcessTaskExecutor, warm_up
+from svc.utils.task_executor import SyncTaskExecutor, ThreadTaskExecutor
+
+NAME = "Python Loop"
+ACCEPTS_CONTEXT = True
+
+
+def execute(img_obj):
+    context = ImageContext.wrap(img_obj)
+    total = 0
+    for row in context.grayscale.tolist():
+        for value in row:
+            total += value * value % 7
+    return total
+
+
+def measure(executor_class, config, tasks, content, repeat):
+    timings = []
+    for i in range(repeat):
+        context = ImageContext(BytesIO(content))
+        started = time.perf_counter()
+        results, errors = executor_class(config).run(tasks, lambda task: context)
+        timings.append(time.perf_counter() - started)
+        if errors:
+            raise RuntimeError(errors)
+    return min(timings)
+
+
+def run(repeat, task_count, size):
+    from benchmarks.draft_decode import create_jpeg
+    # imported by name so the workers can import it too
+    python_loop = importlib.import_module("benchmarks.process_pool")
+    content = create_jpeg(size)
+    config = {"PROCESSING_MAX_WORKERS": task_count, "PROCESSING_TASK_TIMEOUT": None, "PROCESSING_DEADLINE": None}
+    for future in warm_up(config):
+        future.result()
+    rows = []
+    for label, tasks in [("numpy", [average_pixel, channel_statistics]), ("python loop", [python_loop] * task_count)]:
+        timings = {
+            name: measure(executor_class, config, tasks, content, repeat)
+            for name, executor_class in [
+                ("sync", SyncTaskExecutor), ("thread", ThreadTaskExecutor), ("process", ProcessTaskExecutor)
+            ]
+        }
+        rows.append(dict(tasks=label, count=len(tasks), **{name: seconds * 1000 for name, seconds in timings.items()}))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tasks", type=int, default=4, help="number of concurrent python loop tasks")
+    parser.add_argument("--size", default="1024x768")
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.split("x"))
+    print("{:>12} {:>6} {:>10} {:>10} {:>10}".format("tasks", "count", "sync ms", "thread ms", "process ms"))
+    for row in run(args.repeat, args.tasks, size):
+        print("{tasks:>12} {count:>6} {sync:>10.1f} {thread:>10.1f} {process:>10.1f}".format(**row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Reports the cold start cost of the service entry point (main.py): import time per package and the duration of each
+create_app init step, measured in fresh interpreters with `python -X importtime`.
+python -m benchmarks.startup [--repeat N] [--top N] [--output startup.json] [--baseline startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks import suite
+
+# modules that should only be imported on first use, see svc.utils.lazy
+HEAVY_MODULES = ["numpy", "PIL.Image", "boto3", "botocore"]
+
+_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+from svc import cmdline
+imported = time.perf_counter()
+app = cmdline.get_app()
+print(json.dumps({
+    "import_s": imported - started,
+    "get_app_s": time.perf_counter() - imported,
+    "init": app.init_timings,
+    "heavy_imported": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def measure(repeat=5):
+    """
+    Starts the entry point in `repeat` fresh interpreters
+    :return: dict ready to be dumped as json with the median timings in milliseconds
+    """
+    runs = [_measure_once() for i in range(repeat)]
+    packages = {}
+    for run in runs:
+        for name, seconds in run["packages"].items():
+            packages.setdefault(name, []).append(seconds)
+    init_steps = {}
+    for run in runs:
+        for name, seconds in run["init"].items():
+            init_steps.setdefault(name, []).append(seconds)
+    return {
+        "repeat": repeat,
+        "total_ms": _median_ms([run["import_s"] + run["get_app_s"] for run in runs]),
+        "import_ms": _median_ms([run["import_s"] for run in runs]),
+        "get_app_ms": _median_ms([run["get_app_s"] for run in runs]),
+        "packages_ms": {name: _median_ms(values) for name, values in packages.items()},
+        "init_ms": {name: _median_ms(values) for name, values in init_steps.items()},
+        "heavy_imported": sorted(set().union(*(run["heavy_imported"] for run in runs))),
+    }
+
+
+def parse_importtime(output):
+    """
+    Sums the self import time of every top level package (svc modules are kept apart)
+    :param output: the stderr of `python -X importtime`
+    :return: dict of package name to seconds
+    """
+    packages = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        package = name if name.startswith("svc.") else name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1e6
+    return packages
+
+
+def _measure_once():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SNIPPET % HEAVY_MODULES],
+        cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["packages"] = parse_importtime(process.stderr)
+    return result
+
+
+def _median_ms(values):
+    return statistics.median(values) * 1000
+
+
+def _print_report(result, top, baseline=None):
+    baseline = baseline or {}
+    for key in ("total_ms", "import_ms", "get_app_ms"):
+        _print_row(key[:-3], result[key], baseline.get(key))
+    print("\nslowest imports (self time per package)")
+    for name, value in sorted(result["packages_ms"].items(), key=lambda item: -item[1])[:top]:
+        _print_row("  " + name, value, baseline.get("packages_ms", {}).get(name))
+    print("\ninit steps")
+    for name, value in result["init_ms"].items():
+        _print_row("  " + name, value, baseline.get("init_ms", {}).get(name))
+    if result["heavy_imported"]:
+        print("\nheavy modules imported at startup: {}".format(", ".join(result["heavy_imported"])))
+
+
+def _print_row(name, value, base):
+    delta = "" if base is None else "{:+10.1f} ms".format(value - base)
+    print("{:<40} {:>10.1f} ms {}".format(name, value, delta))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of packages to list")
+    parser.add_argument("--output", help="write the report as json")
+    parser.add_argument("--baseline", help="show the differences with a previous json report")
+    args = parser.parse_args(argv)
+
+    result = measure(args.repeat)
+    _print_report(result, args.top, suite.load(args.baseline) if args.baseline else None)
+    if args.output:
+        suite.save(result, args.output)
+    # eager heavy imports are a regression on their own
+    return 1 if result["heavy_imported"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Benchmarks of the upload, processing, history and storage paths on synthetic images.
+Results are written as json so they can be compared against a stored baseline.
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from benchmarks.s3_standin import S3StandIn
+from svc import processors
+from svc.config import common_config
+from svc.app import create_app, init_db
+from svc.controllers.images import ImagesController
+from svc.models.entities import db, Images
+from svc.utils.file_reader import S3FileReader
+from svc.utils.file_writer import S3FileWriter
+from svc.utils.image_context import ImageContext
+
+IMAGE_SIZES = {
+    "small": (256, 256),
+    "medium": (1024, 768),
+    "large": (3000, 2000),
+}
+IMAGE_FORMATS = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+}
+HISTORY_PAGE_SIZE = 20
+
+
+def create_image(size, image_format, seed=0):
+    width, height = size
+    rng = np.random.RandomState(seed)
+    gradient = np.linspace(0, 255, width)[None, :, None] * np.ones((height, 1, 3))
+    pixels = np.clip(gradient + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+    stream = BytesIO()
+    Image.fromarray(pixels).save(stream, format=image_format)
+    return stream.getvalue()
+
+
+def run(repeat=5, history_rows=100000, only=None):
+    """
+    Runs the benchmarks
+    :param repeat: number of timed runs per benchmark
+    :param history_rows: number of rows seeded in the images table for the history benchmarks
+    :param only: optional prefix selecting the benchmarks to run
+    :return: dict ready to be dumped as json
+    """
+    results = {}
+    with _Environment(history_rows) as env:
+        for name, case in env.iter_cases():
+            if only and not name.startswith(only):
+                continue
+            results[name] = _measure(case, repeat)
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "history_rows": history_rows,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Compares the median timings of two runs
+    :param threshold: relative slowdown above which a benchmark is flagged, i.e. 0.2 for 20%
+    :return: list of (name, baseline_ms, current_ms, ratio, regressed) for the benchmarks found in both runs
+    """
+    rows = []
+    for name, result in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        rows.append((name, base["median_ms"], result["median_ms"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _measure(case, repeat):
+    case()  # warm up caches, imports and connections
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        case()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.mean(timings),
+    }
+
+
+class _Environment:
+    """An app on a temporary sqlite database and upload directory, with an in memory s3 stand-in"""
+
+    def __init__(self, history_rows):
+        self._history_rows = history_rows
+        self._images = {
+            "{}.{}".format(size_name, image_format): (create_image(size, image_format), mimetype)
+            for size_name, size in IMAGE_SIZES.items()
+            for image_format, mimetype in IMAGE_FORMATS.items()
+        }
+
+    def __enter__(self):
+        self._directory = tempfile.mkdtemp(prefix="img-process-bench-")
+        self._config = {
+            **common_config,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(self._directory, "bench.db"),
+            "ALLOWED_IMAGES_EXTENSIONS": list(IMAGE_FORMATS),
+            "UPLOAD_TYPE": "lcl",
+            "UPLOAD_PATH": self._directory,
+            "S3_BUCKET_NAME": "benchmarks",
+            "PROCESSING_MODE": "sync",
+            # every run must store and process the image instead of returning the cached result
+            "DEDUPLICATE_UPLOADS": False,
+        }
+        self._app = create_app(self._config)
+        init_db(self._app)
+        self._context = self._app.test_request_context()
+        self._context.push()
+        self._s3 = S3StandIn()
+        self._seed_history()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._context.pop()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def iter_cases(self):
+        for image_name, (content, mimetype) in self._images.items():
+            yield "post_image/{}".format(image_name), self._post_image_case(image_name, content, mimetype)
+        for task in processors.REGISTERED_TASKS:
+            for image_name, (content, mimetype) in self._images.items():
+                yield "processor/{}/{}".format(task.__name__.split(".")[-1], image_name), \
+                    self._processor_case(task, image_name, content, mimetype)
+        yield from self._history_cases()
+        for image_name, (content, mimetype) in self._images.items():
+            yield "s3_writer/{}".format(image_name), self._s3_writer_case(image_name, content, mimetype)
+            yield "s3_reader/{}".format(image_name), self._s3_reader_case(image_name, content, mimetype)
+
+    def _post_image_case(self, image_name, content, mimetype):
+        controller = ImagesController(self._config, "http://localhost/images")
+        return lambda: controller.post_image(_to_file_storage(image_name, content, mimetype))
+
+    @staticmethod
+    def _processor_case(task, image_name, content, mimetype):
+        if getattr(task, "ACCEPTS_CONTEXT", False):
+            return lambda: task.execute(ImageContext(BytesIO(content)))
+        return lambda: task.execute(_to_file_storage(image_name, content, mimetype))
+
+    def _history_cases(self):
+        deep_page = max(1, self._history_rows // HISTORY_PAGE_SIZE - 1)
+        deep_item = Images.get_history(deep_page - 1, HISTORY_PAGE_SIZE)[-1] if deep_page > 1 else None
+        position = (deep_item.uploaded_at, deep_item.id) if deep_item else None
+        yield "history/offset_first_page", lambda: Images.get_history(1, HISTORY_PAGE_SIZE)
+        yield "history/offset_deep_page", lambda: Images.get_history(deep_page, HISTORY_PAGE_SIZE)
+        yield "history/cursor_first_page", lambda: Images.get_history_after(None, HISTORY_PAGE_SIZE)
+        yield "history/cursor_deep_page", lambda: Images.get_history_after(position, HISTORY_PAGE_SIZE)
+
+    def _s3_writer_case(self, image_name, content, mimetype):
+        writer = S3FileWriter(self._config)
+        writer._s3_client = self._s3
+        return lambda: writer.save(_to_file_storage(image_name, content, mimetype), image_name)
+
+    def _s3_reader_case(self, image_name, content, mimetype):
+        reader = S3FileReader(self._config)
+        reader._s3_client = self._s3
+        self._s3.put_object(Bucket="benchmarks", Key=image_name, Body=content, ContentType=mimetype)
+
+        def case():
+            response = reader.get_response(image_name)
+            for chunk in response.response:
+                pass
+        return case
+
+    def _seed_history(self, chunk_size=10000):
+        started = datetime(2020, 1, 1)
+        for offset in range(0, self._history_rows, chunk_size):
+            rows = [
+                {
+                    "path": "image_{}.png".format(i),
+                    "result": {"Average Pixel Value": i % 256, "errors": {}},
+                    "uploaded_at": started + timedelta(seconds=i),
+                }
+                for i in range(offset, min(offset + chunk_size, self._history_rows))
+            ]
+            db.session.bulk_insert_mappings(Images, rows)
+            db.session.commit()
+
+
+def _to_file_storage(image_name, content, mimetype):
+    return FileStorage(stream=BytesIO(content), filename=image_name, content_type=mimetype)
@@ -1,18 +1,39 @@
-from flask import Blueprint, jsonify, current_app, request
-from werkzeug.exceptions import BadRequest
+from flask import Blueprint, jsonify, current_app, request, url_for
+from werkzeug.exceptions import BadRequest, ServiceUnavailable
 
 from svc.controllers.images import ImagesController
 
 bp = Blueprint('images', __name__)
 
+_SEARCH_ARGS = ("filter", "sort", "uploaded_after", "uploaded_before")
+
 
 @bp.route('', methods=['GET'])
 def get_history():
     page = request.args.get("page")
     per_page = request.args.get("count")
+    cursor = request.args.get("cursor")
     controller = ImagesController(current_app.config, request.base_url)
-    result = controller.get_history(page, per_page)
-    return jsonify(result)
+    try:
+        if any(key in request.args for key in _SEARCH_ARGS):
+            return jsonify(controller.search_history(
+                request.args.getlist("filter"),
+                request.args.get("sort"),
+                request.args.get("uploaded_after"),
+                request.args.get("uploaded_before"),
+                page,
+                per_page,
+            ))
+        if cursor is not None:
+            return jsonify(controller.get_history_page(cursor, per_page))
+        result = controller.get_history(page, per_page)
+        return jsonify(result)
+    except BadRequest as e:
+        response = jsonify({
+            "error": e.description,
+            "details": e.details
+        })
+        return response, 400
 
 
 @bp.route('', methods=['POST'])
@@ -20,6 +41,8 @@ def post_image():
     controller = ImagesController(current_app.config, request.base_url)
     image_obj = request.files.get("image")
     try:
+        if controller.is_async():
+            return jsonify(controller.submit_image(image_obj)), 202
         result = controller.post_image(image_obj)
         return jsonify(result)
     except BadRequest as e:
@@ -28,12 +51,74 @@ def post_image():
             "details": e.details
         })
         return response, 400
+    except ServiceUnavailable as e:
+        response = jsonify({
+            "error": e.description,
+            "details": e.details
+        })
+        return response, 503
 
 
-@bp.route('/view/<filename>')
+@bp.route('/batch', methods=['POST'])
+def post_batch():
+    controller = ImagesController(current_app.config, url_for('.get_history', _external=True))
+    try:
+        results = controller.post_batch(request.files.getlist("images"), request.files.get("archive"))
+        return jsonify({"results": results})
+    except BadRequest as e:
+        response = jsonify({
+            "error": e.description,
+            "details": e.details
+        })
+        return response, 400
+
+
+@bp.route('/uploads', methods=['POST'])
+def create_upload():
+    controller = ImagesController(current_app.config, url_for('.get_history', _external=True))
+    body = request.get_json(silent=True) or {}
+    try:
+        return jsonify(controller.create_upload(body.get("filename"), body.get("content_type"))), 201
+    except BadRequest as e:
+        response = jsonify({
+            "error": e.description,
+            "details": e.details
+        })
+        return response, 400
+
+
+@bp.route('/view/<path:filename>')
 def view_image(filename):
     controller = ImagesController(current_app.config, request.base_url)
-    return controller.view_image(filename)
+    try:
+        return controller.view_image(filename, request.args)
+    except BadRequest as e:
+        response = jsonify({
+            "error": e.description,
+            "details": e.details
+        })
+        return response, 400
+
+
+@bp.route('/<path:image_name>/similar', methods=['GET'])
+def get_similar_images(image_name):
+    controller = ImagesController(current_app.config, url_for('.get_history', _external=True))
+    try:
+        return jsonify(controller.get_similar_images(
+            image_name, request.args.get("distance"), request.args.get("count")
+        ))
+    except BadRequest as e:
+        response = jsonify({
+            "error": e.description,
+            "details": e.details
+        })
+        return response, 400
+
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    controller = ImagesController(current_app.config, url_for('.get_history', _external=True))
+    return jsonify(controller.get_job(job_id))
 
 
 def register_blueprint(app):
@@ -0,0 +1,34 @@
+import time
+
+from flask import Blueprint, Response, g, request
+
+from svc.utils import metrics
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@bp.after_app_request
+def add_server_timing(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    metrics.record_request(request.endpoint or "unknown", response.status_code, seconds)
+    server_timing = metrics.get_server_timing()
+    total = "total;dur={:.2f}".format(seconds * 1000)
+    response.headers["Server-Timing"] = "{}, {}".format(server_timing, total) if server_timing else total
+    return response
+
+
+@bp.route('', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def register_blueprint(app):
+    app.register_blueprint(bp, url_prefix='/metrics')
@@ -0,0 +1,14 @@
+from flask import Blueprint, jsonify
+
+from svc.utils import storage_clients
+
+bp = Blueprint('storage', __name__)
+
+
+@bp.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify(storage_clients.get_stats())
+
+
+def register_blueprint(app):
+    app.register_blueprint(bp, url_prefix='/storage')
@@ -1,23 +1,76 @@
-from flask import Flask
+import time
+from contextlib import contextmanager
 
-from svc.api import images
-from svc.models.entities import db
+from flask import Flask, current_app
+
+from svc.api import images, metrics, storage
+from svc.models import group_commit, sqlite
+from svc.models.entities import db, add_missing_columns, ImageResults
+from svc.utils import task_executor
+from svc.utils.hashing import HashingRequest
+from svc.workers import ingest, jobs
 
 _blueprints = [
-    images
+    images,
+    storage,
+    metrics,
 ]
 
 
+class Request(HashingRequest):
+    @property
+    def max_content_length(self):
+        # batch uploads carry many images so they have their own limit
+        if self.endpoint == "images.post_batch":
+            return current_app.config.get("BATCH_MAX_CONTENT_LENGTH")
+        return super().max_content_length
+
+
 class Application(Flask):
+    request_class = Request
+
     def __init__(self, config, **kwargs):
         super().__init__(__name__, **kwargs)
         self.config.from_mapping(config)
 
 
 def create_app(config):
+    """
+    Builds the app without touching the database, the schema is created by init_db (`python -m svc.cmdline init-db`)
+    so cold starts don't pay for it. The duration of each init step is kept in app.init_timings.
+    """
+    started = time.perf_counter()
     app = Application(config)
-    db.init_app(app)
-    db.create_all(app=app)
+    app.init_timings = {"application": time.perf_counter() - started}
+    with _timed_init(app, "database"):
+        db.init_app(app)
+        sqlite.apply_pragmas(app)
     for bp in _blueprints:
-        bp.register_blueprint(app)
+        with _timed_init(app, "blueprint.{}".format(bp.__name__.split(".")[-1])):
+            bp.register_blueprint(app)
+    with _timed_init(app, "workers"):
+        jobs.start_workers(app)
+        ingest.start_poller(app)
+        group_commit.start_writer(app)
+        task_executor.start_process_pool(app.config)
     return app
+
+
+def init_db(app):
+    """
+    Creates the missing tables, columns and indexes and indexes the results saved before the results table existed
+    """
+    db.create_all(app=app)
+    with app.app_context():
+        for name in add_missing_columns():
+            app.logger.info("added %s", name)
+        ImageResults.backfill()
+
+
+@contextmanager
+def _timed_init(app, step):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        app.init_timings[step] = time.perf_counter() - started
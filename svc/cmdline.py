@@ -1,5 +1,19 @@
+"""
+Entry points of the service
+python -m svc.cmdline run
+python -m svc.cmdline init-db
+python -m svc.cmdline reprocess [--processor NAME] [--filter EXPRESSION] [--uploaded-after ISO] [--workers N] ...
+"""
+import argparse
+import sys
+
+from werkzeug.exceptions import BadRequest
+
 import svc.app as application
 import svc.config as configuration
+from svc import processors
+from svc.controllers.images import parse_datetime, parse_filter
+from svc.workers import reprocess as reprocessing
 
 
 def get_app():
@@ -10,23 +24,112 @@ def start_app():
     _Bootstrapper().start_app()
 
 
+def init_db():
+    """Creates the database schema, run once per deployment i.e. `zappa invoke <stage> svc.cmdline.init_db`"""
+    _Bootstrapper().init_db()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m svc.cmdline")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="create the database schema and run the development server")
+    subparsers.add_parser("init-db", help="create the database schema")
+    _add_reprocess_parser(subparsers)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        start_app()
+        return 0
+    if args.command == "init-db":
+        init_db()
+        return 0
+    if args.command == "reprocess":
+        return reprocess(args, parser)
+    parser.print_help()
+    return 2
+
+
+def reprocess(args, parser):
+    """Runs the missing or outdated processors of the stored images, see svc.workers.reprocess"""
+    tasks = processors.REGISTERED_TASKS
+    if args.processor:
+        names = {task.NAME: task for task in tasks}
+        unknown = [name for name in args.processor if name not in names]
+        if unknown:
+            parser.error("unknown processors {}, registered: {}".format(", ".join(unknown), ", ".join(names)))
+        tasks = [names[name] for name in args.processor]
+    try:
+        filters = [parse_filter(expression) for expression in args.filter]
+        uploaded_after = parse_datetime("--uploaded-after", args.uploaded_after)
+        uploaded_before = parse_datetime("--uploaded-before", args.uploaded_before)
+    except BadRequest as e:
+        parser.error(e.details)
+
+    reprocessor = reprocessing.Reprocessor(
+        get_app(), tasks, filters, uploaded_after, uploaded_before, args.name,
+        workers=args.workers, prefetch=args.prefetch, batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint or None, log=print,
+    )
+    try:
+        stats = reprocessor.run(restart=args.restart, dry_run=args.dry_run)
+    except reprocessing.CheckpointMismatch as e:
+        parser.error(str(e))
+    return 1 if stats["failed"] else 0
+
+
+def _add_reprocess_parser(subparsers):
+    reprocess_parser = subparsers.add_parser(
+        "reprocess", help="run the processors added or updated since the stored images were processed"
+    )
+    reprocess_parser.add_argument(
+        "--processor", action="append", default=[], help="processor NAME to bring up to date, defaults to all"
+    )
+    reprocess_parser.add_argument(
+        "--filter", action="append", default=[], help="result filter as in GET /images, i.e. 'Average Pixel Value>100'"
+    )
+    reprocess_parser.add_argument("--uploaded-after", help="ISO 8601 datetime, inclusive")
+    reprocess_parser.add_argument("--uploaded-before", help="ISO 8601 datetime, exclusive")
+    reprocess_parser.add_argument("--name", help="sql LIKE pattern of the image names, i.e. 'abc%%'")
+    reprocess_parser.add_argument("--workers", type=int, default=reprocessing.DEFAULT_WORKERS)
+    reprocess_parser.add_argument("--prefetch", type=int, help="images read ahead of the writes, defaults to 2 * workers")
+    reprocess_parser.add_argument("--batch-size", type=int, default=reprocessing.DEFAULT_BATCH_SIZE, help="results per write")
+    reprocess_parser.add_argument(
+        "--checkpoint", default=reprocessing.DEFAULT_CHECKPOINT, help="progress file resumed by the next run, empty to disable"
+    )
+    reprocess_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+    reprocess_parser.add_argument("--dry-run", action="store_true", help="only count the images to update")
+
+
 class _Bootstrapper(object):
 
     def start_app(self):
         self._create_application()
+        # the local server owns its database, the deployed app gets its schema from init_db
+        self._init_db()
         self._run_app()
 
     def get_app(self):
         self._create_application()
         return self._application
 
+    def init_db(self):
+        self._create_application()
+        self._init_db()
+
     def _create_application(self):
         self._config = configuration.get_config()
         self._application = application.create_app(self._config)
 
+    def _init_db(self):
+        application.init_db(self._application)
+
     def _run_app(self):
         self._application.run(
             host=self._config.get("HOST", "0.0.0.0"),
             port=self._config.get("PORT", 8080),
             debug=self._config.get('DEBUG', False),
         )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,7 +12,52 @@ common_config = {
     'SQLALCHEMY_DATABASE_URI': os.environ.get("SQLALCHEMY_DATABASE_URI", LOCAL_SQLALCHEMY_URL),
     'SQLALCHEMY_TRACK_MODIFICATIONS': False,
     'ALLOWED_IMAGES_EXTENSIONS': ['png', 'jpg', 'jpeg', 'tiff'],
-    'MAX_CONTENT_LENGTH': 2 * 1024 * 1024  # 2MB
+    'MAX_CONTENT_LENGTH': 2 * 1024 * 1024,  # 2MB
+    'MAX_IMAGE_PIXELS': 40 * 1000 * 1000,  # uploads are rejected from their header, before a 2MB file decodes to GBs
+    'MAX_IMAGE_DIMENSION': 12000,  # pixels, for the width and the height
+    'PROCESSING_EXECUTOR': 'thread',  # sync, thread or process (python 3.8+, CPU bound tasks on worker processes)
+    'PROCESSING_START_METHOD': 'spawn',  # multiprocessing start method of the process executor workers
+    'PROCESSING_MAX_WORKERS': 4,
+    'PROCESSING_TASK_TIMEOUT': 10,  # seconds, tasks can override it with a TIMEOUT attribute
+    'PROCESSING_DEADLINE': 20,  # seconds for all tasks of a request, below the API Gateway 29s limit
+    'PROCESSING_STRIP_ROWS': 256,  # rows per strip for tasks reducing the image strip by strip
+    'PROCESSING_DRAFT_DECODE': True,  # decode at reduced scale (JPEG) when all tasks accept it, see MAX_DECODE_SCALE
+    'PROCESSING_MODE': os.environ.get("PROCESSING_MODE", 'sync'),  # sync or async (returns 202 with a job id)
+    'JOB_WORKERS': 2,
+    'JOB_POLL_INTERVAL': 1,  # seconds to wait when the jobs queue is empty
+    'JOB_LEASE_SECONDS': 300,  # processing jobs not finished within this time are picked again
+    'DEDUPLICATE_UPLOADS': True,  # identical uploads (same sha256) reuse the stored image and results
+    'BATCH_MAX_CONTENT_LENGTH': 64 * 1024 * 1024,  # 64MB for the whole /images/batch request
+    'BATCH_MAX_FILES': 1000,
+    'BATCH_MAX_EXTRACTED_LENGTH': 256 * 1024 * 1024,  # decompressed size of all the files of a batch archive
+    'BATCH_MAX_WORKERS': 4,
+    'VIEW_CACHE_MAX_AGE': 24 * 60 * 60,  # uploaded images never change, let clients cache them
+    'VIEW_STREAM_CHUNK_SIZE': 64 * 1024,
+    'DERIVATIVE_CACHE_MAX_BYTES': 64 * 1024 * 1024,  # in memory LRU cache of resized images
+    'DERIVATIVE_MAX_DIMENSION': 4096,
+    'SIMILARITY_REFRESH_INTERVAL': 5,  # seconds between two reads of the images saved by other processes
+    'S3_MAX_POOL_CONNECTIONS': 10,  # s3 clients are created once per process and shared by all requests
+    'S3_MAX_RETRIES': 3,
+    'S3_CONNECT_TIMEOUT': 5,  # seconds
+    'S3_READ_TIMEOUT': 30,  # seconds
+    'S3_MULTIPART_THRESHOLD': 8 * 1024 * 1024,  # larger uploads are sent to s3 in concurrent parts
+    'S3_MULTIPART_CHUNK_SIZE': 8 * 1024 * 1024,
+    'S3_MULTIPART_CONCURRENCY': 4,  # parts uploaded at the same time, within S3_MAX_POOL_CONNECTIONS
+    'STORAGE_MAX_WORKERS': 8,  # uploads written to storage while they are processed
+    'UPLOAD_URL_EXPIRES': 15 * 60,  # seconds the presigned direct upload forms stay valid
+    'DIRECT_UPLOAD_PREFIX': 'uploads/',  # key prefix of the direct uploads, the s3 notifications only watch it
+    'INGEST_POLLING': os.environ.get("INGEST_POLLING") == "1",  # poll the direct uploads instead of s3 notifications
+    'INGEST_POLL_INTERVAL': 2,  # seconds
+    'RESULTS_GROUP_COMMIT': False,  # buffer the results of concurrent uploads and insert them in one transaction
+    'RESULTS_GROUP_COMMIT_MAX_ROWS': 100,  # flush when this many rows are waiting
+    'RESULTS_GROUP_COMMIT_MAX_DELAY': 0.01,  # seconds, flush at most this long after the first buffered row
+    'RESULTS_GROUP_COMMIT_ACK_TIMEOUT': 10,  # seconds a request waits for the commit of its results
+    'SQLITE_PRAGMAS': {  # applied on every connection when the database is SQLite
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # milliseconds
+        'temp_store': 'MEMORY',
+    },
 }
 
 prd_config = {
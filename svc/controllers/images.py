@@ -1,66 +1,511 @@
+import base64
+import binascii
+import itertools
+import logging
+import mimetypes
+import re
+import tarfile
+import time
 import uuid
+from datetime import datetime, timezone
+import zipfile
+from concurrent.futures import TimeoutError
+from io import BytesIO
 
-from werkzeug.exceptions import BadRequest
+from flask import Response, current_app, request
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import BadRequest, NotFound, ServiceUnavailable
 from werkzeug.utils import secure_filename
 
-from svc.models import entities
+from svc.models import entities, group_commit, similarity
 from svc.utils.file_reader import get_file_reader
+from svc.utils.archive import ArchiveTooLarge, iter_archive
+from svc.utils.derivatives import DerivativeSpec, get_derivative_cache
 from svc.utils.file_writer import get_file_writer
+from svc.utils.hashing import get_content_hash
+from svc.utils.image_context import ImageContext, DEFAULT_STRIP_ROWS
+from svc.utils.image_header import InvalidImage, normalize_format, read_header
+from svc.utils.metrics import timed, record_stage
+from svc.utils.task_executor import get_task_executor, get_thread_pool, EXECUTOR_TYPE_KEY, MAX_WORKERS_KEY, \
+    PROCESS_EXECUTOR, THREAD_EXECUTOR, TASK_TIMEOUT_KEY, DEADLINE_KEY
+from svc.utils.task_graph import TaskGraph
 from svc import processors
+from svc.processors import get_version, perceptual_hash
+
+PROCESSING_MODE_KEY = "PROCESSING_MODE"
+ASYNC_MODE = "async"
+DEDUPLICATE_KEY = "DEDUPLICATE_UPLOADS"
+VIEW_CACHE_MAX_AGE_KEY = "VIEW_CACHE_MAX_AGE"
+STRIP_ROWS_KEY = "PROCESSING_STRIP_ROWS"
+DRAFT_DECODE_KEY = "PROCESSING_DRAFT_DECODE"
+BATCH_MAX_FILES_KEY = "BATCH_MAX_FILES"
+BATCH_MAX_EXTRACTED_LENGTH_KEY = "BATCH_MAX_EXTRACTED_LENGTH"
+BATCH_MAX_WORKERS_KEY = "BATCH_MAX_WORKERS"
+STORAGE_MAX_WORKERS_KEY = "STORAGE_MAX_WORKERS"
+UPLOAD_URL_EXPIRES_KEY = "UPLOAD_URL_EXPIRES"
+DIRECT_UPLOAD_PREFIX_KEY = "DIRECT_UPLOAD_PREFIX"
+MAX_IMAGE_PIXELS_KEY = "MAX_IMAGE_PIXELS"
+MAX_IMAGE_DIMENSION_KEY = "MAX_IMAGE_DIMENSION"
+MAX_HISTORY_FILTERS = 5
+DEFAULT_SIMILAR_DISTANCE = 10
+DEFAULT_SIMILAR_COUNT = 20
+MAX_SIMILAR_COUNT = 100
+# `<result name><operator><number>`, i.e. `Average Pixel Value>=100`
+_FILTER_PATTERN = re.compile(r"^(.+?)\s*(<=|>=|!=|=|<|>)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)$")
+# batch uploads are stored and processed on pool threads without an app context, so current_app.logger can't be used
+_logger = logging.getLogger(__name__)
 
 
 class ImagesController:
     def __init__(self, config, base_url):
         self._config = config
         self._base_url = "{}/view".format(base_url)
+        self._jobs_url = "{}/jobs".format(base_url)
+
+    def is_async(self):
+        return self._config.get(PROCESSING_MODE_KEY) == ASYNC_MODE
 
-    def view_image(self, image_name):
+    def view_image(self, image_name, options=None):
+        """
+        Returns the uploaded image, or a resized variant of it when derivative options are given
+        :param options: optional dict of width, height, fit (contain, cover or fill), quality and format
+        """
         reader = self._get_reader()
-        return reader.get_response(image_name)
+        spec = DerivativeSpec.from_options(options or {}, self._config)
+        if spec is None:
+            with timed("storage"):
+                return reader.get_response(image_name)
+        image_name = _secure_path(image_name)
+        # named without the folders, derivatives of direct uploads stay out of the prefix watched by the s3 notifications
+        derivative_name = spec.get_name(secure_filename(image_name))
+        cache = get_derivative_cache(self._config)
+        with timed("derivative"):
+            content = cache.get_or_create(
+                derivative_name,
+                lambda: self._get_derivative(reader, image_name, derivative_name, spec)
+            )
+        response = Response(content, mimetype=spec.mimetype)
+        response.set_etag(derivative_name)
+        response.cache_control.public = True
+        response.cache_control.max_age = self._config.get(VIEW_CACHE_MAX_AGE_KEY, 0)
+        return response.make_conditional(request)
 
     def post_image(self, image_obj):
+        with timed("validate"):
+            self._validate_image(image_obj)
+        with timed("hash"):
+            content_hash = get_content_hash(image_obj)
+        with timed("dedupe"):
+            duplicate = self._find_duplicate(content_hash, (entities.DONE,))
+        if duplicate is not None:
+            return self._get_upload_response(duplicate.path, duplicate.result, cached=True)
+        image_name, result = self._store_and_process(image_obj)
+        with timed("save_results"):
+            image_id = self._save_results(image_name, result, content_hash)
+        similarity.add_result(current_app, image_id, result)
+        return self._get_upload_response(image_name, result, cached=False)
+
+    def submit_image(self, image_obj):
         self._validate_image(image_obj)
-        image_name = self._save_image(image_obj)
-        result = self._process_image(image_obj)
-        entities.Images.save_results(image_name, result)
+        content_hash = get_content_hash(image_obj)
+        job = self._find_duplicate(content_hash, (entities.DONE, entities.PENDING, entities.PROCESSING))
+        cached = job is not None
+        if not cached:
+            image_name = self._save_image(image_obj)
+            job = entities.Images.create_job(image_name, content_hash)
+        return self._get_job_response(job, cached)
+
+    def create_upload(self, filename, content_type):
+        """
+        Registers an image the client uploads directly to storage, it is processed once the object lands there
+        (see svc.workers.ingest)
+        :return: the job response with the presigned `upload` url and form fields
+        """
+        # the content is uploaded later, its header is validated when it is ingested
+        self._validate_image(FileStorage(filename=filename, content_type=content_type), check_content=False)
+        image_name = self._config.get(DIRECT_UPLOAD_PREFIX_KEY, "uploads/") + self._get_storage_name(filename)
+        try:
+            form = self._get_writer().get_upload_form(
+                image_name, content_type, self._config.get("MAX_CONTENT_LENGTH"),
+                self._config.get(UPLOAD_URL_EXPIRES_KEY, 900)
+            )
+        except NotImplementedError as e:
+            _raise_bad_request(str(e))
+        job = entities.Images.create_job(image_name, status=entities.UPLOADING)
+        return {**self._get_job_response(job, cached=False), "upload": form}
+
+    def ingest_uploaded_image(self, image_name):
+        """
+        Processes an image uploaded directly to storage, reading the object once, duplicated notifications are ignored
+        :return: the claimed job or None if no upload of this image is waiting
+        """
+        job = entities.Images.claim_upload(image_name)
+        if job is None:
+            return None
+        try:
+            content = self._get_reader().read(image_name)
+            image_obj = FileStorage(
+                stream=BytesIO(content), filename=image_name, content_type=mimetypes.guess_type(image_name)[0]
+            )
+            self._validate_image(image_obj)
+            content_hash = get_content_hash(image_obj)
+            result = self._process_image(image_obj)
+        except BadRequest as e:
+            entities.Images.complete_job(job.id, {"errors": {"validation": e.details}}, status=entities.FAILED)
+            return job
+        except Exception as e:
+            current_app.logger.error(e)
+            entities.Images.complete_job(job.id, {"errors": {"ingest": str(e)}}, status=entities.FAILED)
+            return job
+        entities.Images.complete_job(job.id, result, content_hash=content_hash)
+        similarity.add_result(current_app, job.id, result)
+        return job
+
+    def post_batch(self, image_objs, archive_obj=None):
+        """
+        Stores and processes many uploads in parallel and saves all results in a single transaction
+        :param image_objs: list of uploaded files
+        :param archive_obj: optional uploaded zip/tar archive whose files are added to the batch
+        :return: list of per file results (or errors) in the same order of the uploaded files
+        """
+        image_objs = self._get_batch_files(image_objs, archive_obj)
+        responses = [None] * len(image_objs)
+        hashes = {}
+        for index, image_obj in enumerate(image_objs):
+            try:
+                self._validate_image(image_obj)
+            except BadRequest as e:
+                responses[index] = self._get_batch_error(image_obj, e.description, e.details)
+                continue
+            hashes[index] = get_content_hash(image_obj)
+
+        duplicates = self._find_duplicates(hashes.values())
+        pool = get_thread_pool("batch", self._config.get(BATCH_MAX_WORKERS_KEY))
+        futures = {}
+        first_index = {}
+        for index, content_hash in hashes.items():
+            if content_hash in duplicates:
+                duplicate = duplicates[content_hash]
+                responses[index] = self._get_upload_response(duplicate.path, duplicate.result, cached=True)
+            elif content_hash in first_index:
+                continue
+            else:
+                first_index[content_hash] = index
+                futures[index] = pool.submit(self._store_and_process, image_objs[index])
+
+        rows = []
+        for index, future in futures.items():
+            try:
+                image_name, result = future.result()
+            except ServiceUnavailable as e:
+                responses[index] = self._get_batch_error(image_objs[index], e.description, e.details)
+                continue
+            except Exception as e:
+                responses[index] = self._get_batch_error(image_objs[index], "Processing failed", str(e))
+                continue
+            rows.append({"path": image_name, "result": result, "content_hash": hashes[index]})
+            responses[index] = self._get_upload_response(image_name, result, cached=False)
+        for image_id, row in zip(entities.Images.save_many(rows), rows):
+            similarity.add_result(current_app, image_id, row["result"])
+
+        # identical files within the batch share the results of the first one
+        for index, content_hash in hashes.items():
+            if responses[index] is None:
+                responses[index] = {**responses[first_index[content_hash]], "cached": True}
+        return responses
+
+    def get_job(self, job_id):
+        job = entities.Images.get_job(job_id)
+        if job is None:
+            raise NotFound()
+        return {"job_id": job.id, **job.serialize(self._base_url)}
+
+    def process_stored_image(self, image_name, tasks=None):
+        """:param tasks: the processors modules to run, defaults to all the registered ones"""
+        reader = self._get_reader()
+        image_obj = FileStorage(stream=BytesIO(reader.read(image_name)), filename=image_name)
+        return self._process_image(image_obj, tasks)
+
+    def get_history(self, page, count):
+        count = count or 20
+        page = page or 1
+        with timed("query"):
+            results = entities.Images.get_history(int(page), int(count))
+        with timed("serialize"):
+            return [result.serialize(self._base_url) for result in results]
+
+    def search_history(self, filters, sort=None, uploaded_after=None, uploaded_before=None, page=None, count=None):
+        """
+        Gets a page of the history filtered and sorted on the numeric processing results and the upload time
+        :param filters: list of `<result name><operator><number>` expressions, nested results are named by their path
+        i.e. `Channel Statistics.channels.R.mean<50`
+        :param sort: uploaded_at or a result name, prefixed with - for a descending order
+        :param uploaded_after: optional ISO 8601 datetime, inclusive
+        :param uploaded_before: optional ISO 8601 datetime, exclusive
+        """
+        if len(filters) > MAX_HISTORY_FILTERS:
+            _raise_bad_request("At most {} filters are allowed".format(MAX_HISTORY_FILTERS))
+        filters = [parse_filter(expression) for expression in filters]
+        uploaded_after = parse_datetime("uploaded_after", uploaded_after)
+        uploaded_before = parse_datetime("uploaded_before", uploaded_before)
+        with timed("query"):
+            results = entities.Images.search(
+                filters, sort, uploaded_after, uploaded_before, int(page or 1), int(count or 20)
+            )
+        with timed("serialize"):
+            return [result.serialize(self._base_url) for result in results]
+
+    def get_history_page(self, cursor, count):
+        """
+        Gets a page of the history after an opaque cursor
+        :param cursor: the `next` value returned with the previous page, empty for the first page
+        :return: dict with the page items and the `next` cursor (None on the last page)
+        """
+        count = int(count or 20)
+        position = self._decode_cursor(cursor) if cursor else None
+        with timed("query"):
+            results = entities.Images.get_history_after(position, count + 1)
+        next_cursor = None
+        if len(results) > count:
+            results = results[:count]
+            next_cursor = self._encode_cursor(results[-1])
+        return {
+            "items": [result.serialize(self._base_url) for result in results],
+            "next": next_cursor,
+        }
+
+    def get_similar_images(self, image_name, distance=None, count=None):
+        """
+        Gets the processed images whose perceptual hash is within `distance` bits of the given image one
+        :param distance: the maximum Hamming distance between 0 and 64, defaults to DEFAULT_SIMILAR_DISTANCE
+        :return: list of serialized images with their `distance`, closest first
+        """
+        distance = _parse_int("distance", distance, DEFAULT_SIMILAR_DISTANCE, 0, 8 * perceptual_hash.HASH_SIZE)
+        count = _parse_int("count", count, DEFAULT_SIMILAR_COUNT, 1, MAX_SIMILAR_COUNT)
+        image = entities.Images.find_by_path(image_name)
+        if image is None:
+            raise NotFound()
+        value = perceptual_hash.get_hash(image.result)
+        if value is None:
+            _raise_bad_request("The image has no {} result".format(perceptual_hash.NAME))
+        with timed("similarity"):
+            # the image itself is found at distance 0
+            matches = similarity.get_index(current_app).search(value, distance, count + 1)
+        matches = [(image_id, match_distance) for image_id, match_distance in matches if image_id != image.id]
+        with timed("query"):
+            images = entities.Images.get_many(image_id for image_id, match_distance in matches[:count])
+        with timed("serialize"):
+            return [
+                {**images[image_id].serialize(self._base_url), "distance": match_distance}
+                for image_id, match_distance in matches[:count] if image_id in images
+            ]
+
+    @staticmethod
+    def _encode_cursor(image):
+        position = "{}|{}".format(image.uploaded_at.isoformat(), image.id)
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            uploaded_at, image_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(uploaded_at), int(image_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            exc = BadRequest()
+            exc.details = "Invalid pagination cursor"
+            raise exc
+
+    def _get_job_response(self, job, cached):
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": "{}/{}".format(self._jobs_url, job.id),
+            "image": job.path,
+            "image_url": "{}/{}".format(self._base_url, job.path),
+            "cached": cached,
+        }
+
+    def _get_upload_response(self, image_name, result, cached):
         response = {
             "image": image_name,
             "image_url": "{}/{}".format(self._base_url, image_name),
             "result": result,
+            "cached": cached,
         }
         return response
 
-    def get_history(self, page, count):
-        count = count or 20
-        page = page or 1
-        results = entities.Images.get_history(int(page), int(count))
-        return [result.serialize(self._base_url) for result in results]
+    def _get_batch_files(self, image_objs, archive_obj):
+        image_objs = [image_obj for image_obj in image_objs if image_obj.filename]
+        max_files = self._config.get(BATCH_MAX_FILES_KEY)
+        if archive_obj is not None and archive_obj.filename:
+            members = iter_archive(
+                archive_obj,
+                self._config.get("MAX_CONTENT_LENGTH"),
+                self._config.get(BATCH_MAX_EXTRACTED_LENGTH_KEY),
+            )
+            if max_files:
+                # one file past the limit is enough to reject the batch, the rest of the archive is never extracted
+                members = itertools.islice(members, max(max_files - len(image_objs), 0) + 1)
+            try:
+                image_objs.extend(members)
+            except ArchiveTooLarge as e:
+                _raise_bad_request(str(e))
+            except (tarfile.TarError, zipfile.BadZipFile) as e:
+                _raise_bad_request("The uploaded archive can't be read: {}".format(e))
+        if not image_objs or (max_files and len(image_objs) > max_files):
+            exc = BadRequest()
+            exc.details = "The request should contain between 1 and {} files".format(max_files)
+            raise exc
+        return image_objs
 
-    def _validate_image(self, image_obj):
+    @staticmethod
+    def _get_batch_error(image_obj, error, details):
+        return {"image": image_obj.filename, "error": error, "details": details}
+
+    def _store_and_process(self, image_obj):
+        """
+        Writes the upload to storage while it is being processed, each one reads its own stream over the upload bytes.
+        A storage failure fails the upload once the processing is done, before any results row is saved.
+        :return: tuple of (stored image name, processing result)
+        """
+        image_obj.stream.seek(0)
+        content = image_obj.stream.read()
+        pool = get_thread_pool("storage", self._config.get(STORAGE_MAX_WORKERS_KEY))
+        storage_future = pool.submit(self._timed_save_image, _copy_upload(image_obj, content))
+        with timed("process"):
+            result = self._process_image(_copy_upload(image_obj, content))
+        try:
+            image_name, seconds = storage_future.result()
+        except Exception as e:
+            _logger.error(e)
+            exc = ServiceUnavailable("The image could not be stored")
+            exc.details = str(e)
+            raise exc
+        record_stage("storage", seconds)
+        return image_name, result
+
+    def _timed_save_image(self, image_obj):
+        # runs on the storage pool, the stage is recorded by the request thread
+        started = time.perf_counter()
+        image_name = self._save_image(image_obj)
+        return image_name, time.perf_counter() - started
+
+    def _save_results(self, image_name, result, content_hash):
+        # apps built without create_app have no writer started even with group commit enabled
+        writer = group_commit.get_writer(current_app) if self._config.get(group_commit.ENABLED_KEY) else None
+        if writer is None:
+            return entities.Images.save_results(image_name, result, content_hash)
+        # waits for the group transaction holding this row to be committed
+        try:
+            return writer.save({"path": image_name, "result": result, "content_hash": content_hash})
+        except TimeoutError:
+            exc = ServiceUnavailable("The results could not be saved in time")
+            exc.details = "Not committed after {}s, they may still be saved".format(
+                self._config.get(group_commit.ACK_TIMEOUT_KEY)
+            )
+            raise exc
+
+    def _find_duplicates(self, content_hashes):
+        if not self._config.get(DEDUPLICATE_KEY):
+            return {}
+        return entities.Images.find_by_hashes(content_hashes)
+
+    def _find_duplicate(self, content_hash, statuses):
+        # identical uploads reuse the stored object and its results
+        if not self._config.get(DEDUPLICATE_KEY):
+            return None
+        return entities.Images.find_by_hash(content_hash, statuses)
+
+    def _validate_image(self, image_obj, check_content=True):
         image_validator = _ImageValidator(image_obj, self._config)
-        image_validator.validate()
+        image_validator.validate(check_content)
 
     def _save_image(self, image_obj):
-        file_name = secure_filename(image_obj.filename)
-        random_key = str(uuid.uuid4())[:5]
-        file_name = "{}_{}".format(random_key, file_name)
+        file_name = self._get_storage_name(image_obj.filename)
         writer = self._get_writer()
         writer.save(image_obj, file_name)
         return file_name
 
-    def _process_image(self, image_obj):
-        results = {}
-        errors = {}
-        for task in processors.REGISTERED_TASKS:
-            image_obj.stream.seek(0)
-            try:
-                value = task.execute(image_obj)
-                # the execution may be done through a queue, so the results may not be immediate
-                if value:
-                    results[task.NAME] = value
-            except Exception as e:
-                errors[task.NAME] = str(e)
-        return {**results, "errors": errors}
+    @staticmethod
+    def _get_storage_name(filename):
+        file_name = secure_filename(filename)
+        random_key = str(uuid.uuid4())[:5]
+        return "{}_{}".format(random_key, file_name)
+
+    def _process_image(self, image_obj, tasks=None):
+        """
+        Runs the processing tasks over an upload
+        :param tasks: the processors modules to run, defaults to all the registered ones
+        :return: result dict keyed by task NAME, with the `errors` and the `meta` of the run (the `versions` of the
+        tasks that ran and the `decode_scale` of a reduced decode)
+        """
+        tasks = processors.REGISTERED_TASKS if tasks is None else tasks
+        context = ImageContext(
+            image_obj.stream,
+            self._config.get(STRIP_ROWS_KEY, DEFAULT_STRIP_ROWS),
+            self._get_decode_scale(tasks),
+        )
+        # the request deadline covers the intermediates and the tasks
+        started = time.monotonic()
+        graph = TaskGraph(tasks)
+        errors = graph.prepare(
+            context,
+            self._get_intermediates_pool(),
+            self._config.get(TASK_TIMEOUT_KEY),
+            self._config.get(DEADLINE_KEY),
+            started,
+        )
+        # tasks missing an intermediate are reported as failed instead of recomputing it
+        tasks = [task for task in tasks if task.NAME not in errors]
+        executor = self._get_task_executor()
+        results, task_errors = executor.run(
+            tasks, lambda task: self._get_task_input(task, image_obj, context), started
+        )
+        errors.update(task_errors)
+        if context.is_decoded:
+            record_stage("decode", context.decode_seconds)
+        # timed out intermediates and tasks still running on the pools may add their timings meanwhile
+        for name, seconds in list(graph.timings.items()):
+            record_stage("intermediate.{}".format(name), seconds)
+        for name, seconds in list(executor.timings.items()):
+            record_stage("task.{}".format(name), seconds)
+        # nested so it never collides with a task NAME
+        meta = {"versions": {task.NAME: get_version(task) for task in tasks if task.NAME not in errors}}
+        decode_scale = self._get_used_decode_scale(context)
+        if decode_scale is not None:
+            meta["decode_scale"] = decode_scale
+        return {**results, "errors": errors, "meta": meta}
+
+    def _get_decode_scale(self, tasks):
+        # a reduced decode is only used when every task reading the shared context accepts it
+        if not self._config.get(DRAFT_DECODE_KEY):
+            return 1
+        scales = [getattr(task, "MAX_DECODE_SCALE", 1) for task in tasks if getattr(task, "ACCEPTS_CONTEXT", False)]
+        return min(scales) if scales else 1
+
+    @staticmethod
+    def _get_used_decode_scale(context):
+        if not context.is_decoded or context.decode_scale == 1:
+            return None
+        return context.decode_scale
+
+    @staticmethod
+    def _get_task_input(task, image_obj, context):
+        if getattr(task, "ACCEPTS_CONTEXT", False):
+            return context
+        # old-style tasks decode the raw upload themselves, each one gets its own stream as tasks may run concurrently
+        return FileStorage(stream=context.stream(), filename=image_obj.filename, content_type=image_obj.mimetype)
+
+    def _get_derivative(self, reader, image_name, derivative_name, spec):
+        # derivatives are stored like uploads so they are encoded once even across processes
+        try:
+            return reader.read(derivative_name)
+        except NotFound:
+            pass
+        content = spec.render(reader.read(image_name))
+        derivative_obj = FileStorage(stream=BytesIO(content), filename=derivative_name, content_type=spec.mimetype)
+        self._get_writer().save(derivative_obj, derivative_name)
+        return content
 
     def _get_reader(self):
         return get_file_reader(self._config)
@@ -68,15 +513,82 @@ class ImagesController:
     def _get_writer(self):
         return get_file_writer(self._config)
 
+    def _get_task_executor(self):
+        return get_task_executor(self._config)
+
+    def _get_intermediates_pool(self):
+        # intermediates follow the tasks executor, computed in order unless tasks run concurrently,
+        # the process executor shares the intermediates computed here with its workers
+        if self._config.get(EXECUTOR_TYPE_KEY) not in (THREAD_EXECUTOR, PROCESS_EXECUTOR):
+            return None
+        return get_thread_pool("intermediate", self._config.get(MAX_WORKERS_KEY))
+
+
+def parse_filter(expression):
+    """:return: (result name, operator, value) of a `<result name><operator><number>` expression"""
+    match = _FILTER_PATTERN.match(expression.strip())
+    if match is None:
+        _raise_bad_request("Invalid filter {}, expected <result name><operator><number>".format(expression))
+    name, operator_name, value = match.groups()
+    return name, operator_name, float(value)
+
+
+def parse_datetime(name, value):
+    """:return: the naive utc datetime of an ISO 8601 value, None for an empty value"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        _raise_bad_request("{} should be an ISO 8601 datetime".format(name))
+    if parsed.tzinfo is not None:
+        # upload times are stored as naive utc
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _parse_int(name, value, default, minimum, maximum):
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or not minimum <= value <= maximum:
+        _raise_bad_request("{} should be an integer between {} and {}".format(name, minimum, maximum))
+    return value
+
+
+def _copy_upload(image_obj, content):
+    return FileStorage(stream=BytesIO(content), filename=image_obj.filename, content_type=image_obj.mimetype)
+
+
+def _secure_path(name):
+    # direct uploads are stored under a folder, every part of their name is made safe like the uploaded file names
+    return "/".join(secure_filename(part) for part in name.split("/") if secure_filename(part))
+
+
+def _raise_bad_request(details):
+    exc = BadRequest()
+    exc.details = details
+    raise exc
+
 
 class _ImageValidator:
     def __init__(self, image_obj, config):
         self._image_obj = image_obj
         self._config = config
 
-    def validate(self):
+    def validate(self, check_content=True):
+        """
+        :param check_content: also check the image header, the dimensions and that the content matches the mimetype
+        :return: the image header (type:svc.utils.image_header.ImageHeader) if the content was checked
+        """
         self._validate_not_none()
         self._validate_allowed_types()
+        if check_content:
+            return self._validate_content()
+        return None
 
     def _validate_not_none(self):
         if self._image_obj is None or not self._image_obj.filename:
@@ -95,3 +607,26 @@ class _ImageValidator:
         image_extension = self._image_obj.mimetype.split("/")[1]
         if image_extension.lower() not in allowed_extensions:
             raise exc
+
+    def _validate_content(self):
+        # only the header is parsed, the pixels are decoded by the processing after the upload is accepted
+        try:
+            header = read_header(self._image_obj.stream)
+        except InvalidImage as e:
+            _raise_bad_request(str(e))
+        declared_format = normalize_format(self._image_obj.mimetype.split("/")[1])
+        if header.format != declared_format:
+            _raise_bad_request("The uploaded file is a {} image but was sent as {}".format(
+                header.format, self._image_obj.mimetype
+            ))
+        max_dimension = self._config.get(MAX_IMAGE_DIMENSION_KEY)
+        if max_dimension and max(header.width, header.height) > max_dimension:
+            _raise_bad_request("The image is {}x{}, its width and height should be at most {} pixels".format(
+                header.width, header.height, max_dimension
+            ))
+        max_pixels = self._config.get(MAX_IMAGE_PIXELS_KEY)
+        if max_pixels and header.width * header.height > max_pixels:
+            _raise_bad_request("The image is {}x{}, it should have at most {} pixels".format(
+                header.width, header.height, max_pixels
+            ))
+        return header
@@ -1,33 +1,419 @@
-from datetime import datetime
+import math
+import operator
+import uuid
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import types, text
+from sqlalchemy import types, text, or_, and_, tuple_, literal, inspect
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import CreateColumn
+
+from svc.processors import perceptual_hash
 
 db = SQLAlchemy()
 
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+# registered direct upload whose object hasn't landed in storage yet
+UPLOADING = "uploading"
+
+# comparison operators of the results filters
+FILTER_OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+UPLOADED_AT = "uploaded_at"
+
 
 class Images(db.Model):
     __tablename__ = 'images'
+    __table_args__ = (
+        db.Index('ix_images_uploaded_at_id', 'uploaded_at', 'id'),
+    )
     id = db.Column(types.Integer, primary_key=True, autoincrement=True)
-    path = db.Column(types.String(128), nullable=False)
+    path = db.Column(types.String(128), nullable=False, index=True)
     result = db.Column(types.JSON, nullable=True)
     uploaded_at = db.Column(types.DateTime, nullable=False, default=datetime.utcnow)
+    # the server default fills the rows saved before the column was added, see add_missing_columns
+    status = db.Column(types.String(16), nullable=False, default=DONE, server_default=DONE, index=True)
+    claimed_at = db.Column(types.DateTime, nullable=True)
+    content_hash = db.Column(types.String(64), nullable=True, index=True)
+    # hex digits of the perceptual hash result, see svc.models.similarity
+    perceptual_hash = db.Column(types.String(16), nullable=True, index=True)
+    # set whenever perceptual_hash is written, so the similarity indexes also read the hashes of updated rows
+    hash_updated_at = db.Column(types.DateTime, nullable=True, index=True)
+    # unique per row inserted by save_many, its generated id is read back by this token
+    insert_token = db.Column(types.String(32), nullable=True, index=True)
 
     @classmethod
-    def save_results(cls, path, result):
-        obj = cls(path=path, result=result)
+    def save_results(cls, path, result, content_hash=None):
+        """:return: the id of the saved image"""
+        obj = cls(path=path, result=result, content_hash=content_hash, **_get_hash_values(result))
         db.session.add(obj)
+        db.session.flush()
+        ImageResults.add(obj.id, result)
+        db.session.commit()
+        return obj.id
+
+    @classmethod
+    def save_many(cls, rows):
+        """
+        Inserts many results rows with a single bulk insert in one transaction
+        :param rows: list of dicts having path, result and content_hash keys
+        :return: the ids of the saved images in the rows order
+        """
+        if not rows:
+            return []
+        rows = [dict(row, insert_token=uuid.uuid4().hex, **_get_hash_values(row.get("result"))) for row in rows]
+        # return_defaults would insert the rows one by one, the generated ids are read back by token instead
+        db.session.bulk_insert_mappings(cls, rows)
+        image_ids = cls._get_inserted_ids([row["insert_token"] for row in rows])
+        ImageResults.add_many(zip(image_ids, (row.get("result") for row in rows)))
         db.session.commit()
+        return image_ids
+
+    @classmethod
+    def _get_inserted_ids(cls, tokens, chunk_size=500):
+        found = {}
+        for i in range(0, len(tokens), chunk_size):
+            found.update(db.session.query(cls.insert_token, cls.id).filter(
+                cls.insert_token.in_(tokens[i:i + chunk_size])
+            ))
+        return [found[token] for token in tokens]
+
+    @classmethod
+    def find_by_hashes(cls, content_hashes, statuses=(DONE,), chunk_size=500):
+        found = {}
+        content_hashes = list(content_hashes)
+        for i in range(0, len(content_hashes), chunk_size):
+            query = cls.query.filter(cls.content_hash.in_(content_hashes[i:i + chunk_size]), cls.status.in_(statuses))
+            for obj in query.order_by(cls.id):
+                found[obj.content_hash] = obj
+        return found
+
+    @classmethod
+    def find_by_hash(cls, content_hash, statuses=(DONE,)):
+        query = cls.query.filter(cls.content_hash == content_hash, cls.status.in_(statuses))
+        return query.order_by(cls.id.desc()).first()
+
+    @classmethod
+    def find_by_path(cls, path):
+        """:return: the latest processed image stored under this name"""
+        return cls.query.filter(cls.path == path, cls.status == DONE).order_by(cls.id.desc()).first()
+
+    @classmethod
+    def get_many(cls, image_ids):
+        """:return: dict of id to image"""
+        image_ids = list(image_ids)
+        if not image_ids:
+            return {}
+        return {obj.id: obj for obj in cls.query.filter(cls.id.in_(image_ids))}
+
+    @classmethod
+    def iter_perceptual_hashes(cls, batch_size, after_id=0, updated_after=None):
+        """
+        Yields lists of (id, perceptual hash hex) of the processed images having a hash after an id, in id order
+        :param updated_after: optional time, only the hashes written since then are read
+        """
+        last_id = after_id
+        query = db.session.query(cls.id, cls.perceptual_hash).filter(
+            cls.perceptual_hash.isnot(None), cls.status == DONE
+        )
+        if updated_after is not None:
+            query = query.filter(cls.hash_updated_at >= updated_after)
+        while True:
+            rows = query.filter(cls.id > last_id).order_by(cls.id).limit(batch_size).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
 
     @classmethod
     def get_history(cls, page, per_page):
-        query = cls.query.order_by(cls.uploaded_at.desc())
-        pagination_result = query.paginate(page, per_page, error_out=False)
-        return pagination_result.items
+        # plain offset pagination without the COUNT(*) issued by paginate()
+        query = cls.query.order_by(cls.uploaded_at.desc(), cls.id.desc())
+        return query.limit(per_page).offset((max(page, 1) - 1) * per_page).all()
+
+    @classmethod
+    def get_history_after(cls, position, limit):
+        """
+        Keyset pagination over the (uploaded_at, id) index, its cost doesn't depend on how deep the page is
+        :param position: (uploaded_at, id) of the last item of the previous page or None for the first page
+        """
+        query = cls.query
+        if position is not None:
+            uploaded_at, image_id = position
+            bound = tuple_(literal(uploaded_at, cls.uploaded_at.type), literal(image_id, cls.id.type))
+            query = query.filter(tuple_(cls.uploaded_at, cls.id) < bound)
+        return query.order_by(cls.uploaded_at.desc(), cls.id.desc()).limit(limit).all()
+
+    @classmethod
+    def search(cls, filters=(), sort=None, uploaded_after=None, uploaded_before=None, page=1, per_page=20):
+        """
+        Filters and sorts the images on their indexed results (see ImageResults) and upload time
+        :param filters: list of (result name, operator, value), operator is a FILTER_OPERATORS key
+        :param sort: uploaded_at or a result name, prefixed with - for a descending order, defaults to -uploaded_at
+        images without the sorted result are excluded
+        """
+        return cls._search_query(filters, sort, uploaded_after, uploaded_before, page, per_page).all()
+
+    @classmethod
+    def _search_query(cls, filters, sort, uploaded_after, uploaded_before, page, per_page):
+        joined = {}
+        query = cls._filter(cls.query, joined, filters, uploaded_after, uploaded_before)
+        sort = sort or "-" + UPLOADED_AT
+        descending = sort.startswith("-")
+        sort_name = sort.lstrip("-")
+        if sort_name == UPLOADED_AT:
+            sort_column, tie_column = cls.uploaded_at, cls.id
+        else:
+            if sort_name not in joined:
+                joined[sort_name] = aliased(ImageResults)
+                query = query.join(
+                    joined[sort_name], and_(joined[sort_name].image_id == cls.id, joined[sort_name].name == sort_name)
+                )
+            # ordered like the (name, value, image_id) index so no sort step is needed
+            sort_column, tie_column = joined[sort_name].value, joined[sort_name].image_id
+        order = (sort_column.desc(), tie_column.desc()) if descending else (sort_column.asc(), tie_column.asc())
+        return query.order_by(*order).limit(per_page).offset((max(page, 1) - 1) * per_page)
+
+    @classmethod
+    def get_processed_after(cls, last_id, limit, filters=(), uploaded_after=None, uploaded_before=None, path_pattern=None):
+        """
+        Gets the processed images in id order, filtered as in search
+        :param last_id: id of the last image of the previous batch, 0 for the first batch
+        :param path_pattern: optional sql LIKE pattern of the image names
+        """
+        query = cls._filter(
+            cls.query.filter(cls.status == DONE, cls.id > last_id), {}, filters, uploaded_after, uploaded_before
+        )
+        if path_pattern is not None:
+            query = query.filter(cls.path.like(path_pattern, escape="\\"))
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def _filter(cls, query, joined, filters, uploaded_after, uploaded_before):
+        # joined keeps the results aliases by name so a sort can reuse them
+        for name, operator_name, value in filters:
+            if name not in joined:
+                joined[name] = aliased(ImageResults)
+                query = query.join(joined[name], and_(joined[name].image_id == cls.id, joined[name].name == name))
+            query = query.filter(FILTER_OPERATORS[operator_name](joined[name].value, value))
+        if uploaded_after is not None:
+            query = query.filter(cls.uploaded_at >= uploaded_after)
+        if uploaded_before is not None:
+            query = query.filter(cls.uploaded_at < uploaded_before)
+        return query
+
+    @classmethod
+    def update_results(cls, rows):
+        """
+        Replaces the results of many images in one transaction
+        :param rows: list of dicts having id and result keys
+        """
+        if not rows:
+            return
+        rows = [dict(row, **_get_hash_values(row["result"])) for row in rows]
+        db.session.bulk_update_mappings(cls, rows)
+        ImageResults.query.filter(ImageResults.image_id.in_([row["id"] for row in rows])).delete(
+            synchronize_session=False
+        )
+        ImageResults.add_many((row["id"], row["result"]) for row in rows)
+        db.session.commit()
+
+    @classmethod
+    def create_job(cls, path, content_hash=None, status=PENDING):
+        obj = cls(path=path, status=status, content_hash=content_hash)
+        db.session.add(obj)
+        db.session.commit()
+        return obj
+
+    @classmethod
+    def get_job(cls, job_id):
+        return cls.query.get(job_id)
+
+    @classmethod
+    def claim_next_job(cls, lease_seconds):
+        """
+        Atomically marks the oldest pending job (or a processing one whose lease expired) as processing
+        so concurrent workers, even in different processes, never pick the same job
+        :return: the claimed job or None if the queue is empty
+        """
+        expired = datetime.utcnow() - timedelta(seconds=lease_seconds)
+        candidate = cls.query.filter(or_(
+            cls.status == PENDING,
+            and_(cls.status == PROCESSING, cls.claimed_at < expired)
+        )).order_by(cls.id).first()
+        if candidate is None:
+            return None
+        claimed = cls.query.filter(
+            cls.id == candidate.id,
+            cls.status == candidate.status,
+            cls.claimed_at.is_(None) if candidate.claimed_at is None else cls.claimed_at == candidate.claimed_at
+        ).update({cls.status: PROCESSING, cls.claimed_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return None
+        db.session.refresh(candidate)
+        return candidate
+
+    @classmethod
+    def get_uploads(cls, limit):
+        """:return: the oldest direct uploads still waiting for their object"""
+        return cls.query.filter(cls.status == UPLOADING).order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def claim_upload(cls, path):
+        """
+        Atomically marks the waiting direct upload of this image as processing, so duplicated storage notifications
+        and pollers never process it twice
+        :return: the claimed upload or None if no upload of this image is waiting
+        """
+        upload = cls.query.filter(cls.path == path, cls.status == UPLOADING).first()
+        if upload is None:
+            return None
+        claimed = cls.query.filter(cls.id == upload.id, cls.status == UPLOADING).update(
+            {cls.status: PROCESSING, cls.claimed_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return None
+        db.session.refresh(upload)
+        return upload
+
+    @classmethod
+    def complete_job(cls, job_id, result, status=DONE, content_hash=None):
+        values = {cls.status: status, cls.result: result}
+        values.update((getattr(cls, key), value) for key, value in _get_hash_values(result).items())
+        if content_hash is not None:
+            values[cls.content_hash] = content_hash
+        cls.query.filter(cls.id == job_id).update(values, synchronize_session=False)
+        ImageResults.query.filter(ImageResults.image_id == job_id).delete(synchronize_session=False)
+        ImageResults.add(job_id, result)
+        db.session.commit()
 
     def serialize(self, base_url):
         return {
             "image_name": self.path,
             "image_url": "{}/{}".format(base_url, self.path),
             "results": self.result,
+            "status": self.status,
             "uploaded_at": self.uploaded_at.isoformat()
         }
+
+
+class ImageResults(db.Model):
+    """
+    Numeric outputs of the processors, one row per output so the history can be filtered and sorted on an index.
+    Nested outputs are named by their path in the result, i.e. `Channel Statistics.channels.R.mean`.
+    """
+    __tablename__ = 'image_results'
+    __table_args__ = (
+        db.Index('ix_image_results_name_value', 'name', 'value', 'image_id'),
+    )
+    image_id = db.Column(types.Integer, db.ForeignKey('images.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(types.String(128), primary_key=True)
+    value = db.Column(types.Float, nullable=False)
+
+    @classmethod
+    def add(cls, image_id, result):
+        cls.add_many([(image_id, result)])
+
+    @classmethod
+    def add_many(cls, results):
+        """
+        Adds the numeric outputs rows to the current transaction
+        :param results: iterable of (image id, result dict)
+        """
+        rows = [
+            {"image_id": image_id, "name": name, "value": value}
+            for image_id, result in results
+            for name, value in get_numeric_outputs(result).items()
+        ]
+        if rows:
+            db.session.bulk_insert_mappings(cls, rows)
+
+    @classmethod
+    def backfill(cls, batch_size=1000):
+        """
+        Indexes the results of the images saved before the results table existed
+        :return: the number of indexed images
+        """
+        indexed = 0
+        last_id = 0
+        while True:
+            images = Images.query.filter(
+                Images.id > last_id,
+                Images.result.isnot(None),
+                ~db.session.query(cls.image_id).filter(cls.image_id == Images.id).exists()
+            ).order_by(Images.id).limit(batch_size).all()
+            if not images:
+                return indexed
+            cls.add_many((image.id, image.result) for image in images)
+            db.session.commit()
+            indexed += len(images)
+            last_id = images[-1].id
+
+
+def add_missing_columns():
+    """
+    Adds the columns and the indexes declared after their table was created, create_all only creates the missing tables.
+    Non nullable columns without a server_default can't be added to a table having rows and are skipped.
+    :return: the names of the added columns and indexes
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns or not (column.nullable or column.server_default is not None):
+                continue
+            engine.execute(text("ALTER TABLE {} ADD COLUMN {}".format(
+                table.name, CreateColumn(column).compile(dialect=engine.dialect)
+            )))
+            added.append("{}.{}".format(table.name, column.name))
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+                added.append(index.name)
+    return added
+
+
+def _get_perceptual_hash(result):
+    value = perceptual_hash.get_hash(result)
+    return None if value is None else "{:016x}".format(value)
+
+
+def _get_hash_values(result):
+    return {"perceptual_hash": _get_perceptual_hash(result), "hash_updated_at": datetime.utcnow()}
+
+
+def get_numeric_outputs(result, prefix=""):
+    """
+    Flattens the finite numbers of a processing result, the errors and the meta of the run are skipped
+    :return: dict of output path to value
+    """
+    outputs = {}
+    if not isinstance(result, dict):
+        return outputs
+    for key, value in result.items():
+        name = "{}{}".format(prefix, key)
+        # versions were stored at the top level before meta
+        if not prefix and key in ("errors", "meta", "versions"):
+            continue
+        if isinstance(value, dict):
+            outputs.update(get_numeric_outputs(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value) \
+                and len(name) <= 128:
+            outputs[name] = float(value)
+    return outputs
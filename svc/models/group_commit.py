@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from svc.models import entities
+
+ENABLED_KEY = "RESULTS_GROUP_COMMIT"
+MAX_ROWS_KEY = "RESULTS_GROUP_COMMIT_MAX_ROWS"
+MAX_DELAY_KEY = "RESULTS_GROUP_COMMIT_MAX_DELAY"
+ACK_TIMEOUT_KEY = "RESULTS_GROUP_COMMIT_ACK_TIMEOUT"
+_EXTENSION_KEY = "results_group_commit"
+
+
+def start_writer(app):
+    """Starts the app results writer when group commit is enabled"""
+    if not app.config.get(ENABLED_KEY):
+        return None
+    writer = GroupCommitWriter(app)
+    writer.start()
+    app.extensions[_EXTENSION_KEY] = writer
+    return writer
+
+
+def get_writer(app):
+    return app.extensions.get(_EXTENSION_KEY)
+
+
+class GroupCommitWriter:
+    """
+    Buffers the results rows of concurrent requests and inserts them in one transaction, when MAX_ROWS rows are
+    waiting or MAX_DELAY seconds after the first one. Every request still waits for the commit of its own row.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._max_rows = app.config.get(MAX_ROWS_KEY, 100)
+        self._max_delay = app.config.get(MAX_DELAY_KEY, 0.01)
+        self._ack_timeout = app.config.get(ACK_TIMEOUT_KEY, 10)
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # sizes of the last committed groups
+        self.group_sizes = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="results-group-commit", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Flushes the buffered rows and stops the writer"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, row):
+        """
+        Buffers a results row
+        :param row: dict having path, result and content_hash keys, as Images.save_many rows
+        :return: a future resolved with the image id once the row is committed
+        """
+        future = Future()
+        if self._stop_event.is_set():
+            future.set_exception(RuntimeError("The results writer is stopped"))
+            return future
+        self._queue.put((row, future))
+        return future
+
+    def save(self, row):
+        """
+        Buffers a results row and waits for its commit, raises the commit error if any, returns the image id.
+        Raises concurrent.futures.TimeoutError after ACK_TIMEOUT seconds, the row stays buffered and may still be committed
+        """
+        return self.submit(row).result(self._ack_timeout)
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            group = self._collect()
+            if group:
+                self._flush(group)
+
+    def _collect(self):
+        try:
+            group = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self._max_delay
+        while len(group) < self._max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return group
+
+    def _flush(self, group):
+        with self._app.app_context():
+            try:
+                image_ids = entities.Images.save_many([row for row, future in group])
+            except Exception as e:
+                entities.db.session.rollback()
+                self._app.logger.error(e)
+                # a single bad row must not fail the other requests of the group
+                for row, future in group:
+                    self._flush_one(row, future)
+                return
+        self.group_sizes = (self.group_sizes + [len(group)])[-100:]
+        for (row, future), image_id in zip(group, image_ids):
+            future.set_result(image_id)
+
+    def _flush_one(self, row, future):
+        try:
+            future.set_result(entities.Images.save_many([row])[0])
+        except Exception as e:
+            entities.db.session.rollback()
+            future.set_exception(e)
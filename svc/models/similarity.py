@@ -0,0 +1,81 @@
+"""
+Near duplicate search over the perceptual hashes of the processed images (see svc.processors.perceptual_hash).
+Every process keeps the hashes in a HammingIndex, loaded from the images table on its first search. The images saved
+by this process are added right away, searches then read the hashes written since the last read (new rows and the
+rows updated by other workers, the ingest, the direct uploads or the reprocess command) at most every
+SIMILARITY_REFRESH_INTERVAL seconds.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from svc.models import entities
+from svc.processors import perceptual_hash
+from svc.utils.hamming import HammingIndex
+
+REFRESH_INTERVAL_KEY = "SIMILARITY_REFRESH_INTERVAL"
+LOAD_BATCH_SIZE = 10000
+# the hashes written since the last read minus this margin are read again, it covers the transactions still running
+# during the last read and the clock differences between the hosts, reading a hash twice just replaces it
+REFRESH_OVERLAP = timedelta(seconds=60)
+_EXTENSION_KEY = "similarity_index"
+_extension_lock = threading.Lock()
+
+
+def get_index(app):
+    with _extension_lock:
+        index = app.extensions.get(_EXTENSION_KEY)
+        if index is None:
+            index = app.extensions[_EXTENSION_KEY] = SimilarityIndex(app.config.get(REFRESH_INTERVAL_KEY, 5))
+        return index
+
+
+def add_result(app, image_id, result):
+    """Adds (or replaces) the perceptual hash of a saved result in the app index, if any"""
+    value = perceptual_hash.get_hash(result)
+    if value is not None:
+        get_index(app).add(image_id, value)
+
+
+class SimilarityIndex:
+    def __init__(self, refresh_interval=5):
+        self._refresh_interval = refresh_interval
+        self._index = None
+        self._updated_after = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._index is not None
+
+    def add(self, image_id, value):
+        # the rows saved before the first search are read by it, the next refresh still reads the hashes written
+        # meanwhile by other processes
+        index = self._index
+        if index is not None:
+            index.add(image_id, value)
+
+    def search(self, value, max_distance, limit=None):
+        """
+        Loads the index on first use and the rows saved since then, an app context is needed
+        :return: list of (image id, distance) within max_distance, closest first
+        """
+        if self._needs_refresh():
+            self._refresh()
+        return self._index.search(value, max_distance, limit)
+
+    def _needs_refresh(self):
+        return self._index is None or time.monotonic() - self._refreshed_at >= self._refresh_interval
+
+    def _refresh(self):
+        with self._lock:
+            if not self._needs_refresh():
+                return
+            index = self._index or HammingIndex()
+            read_at = datetime.utcnow()
+            for rows in entities.Images.iter_perceptual_hashes(LOAD_BATCH_SIZE, updated_after=self._updated_after):
+                index.add_many([image_id for image_id, value in rows], [int(value, 16) for image_id, value in rows])
+            self._index = index
+            self._updated_after = read_at - REFRESH_OVERLAP
+            self._refreshed_at = time.monotonic()
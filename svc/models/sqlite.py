@@ -0,0 +1,24 @@
+from sqlalchemy import event
+
+from svc.models.entities import db
+
+PRAGMAS_KEY = "SQLITE_PRAGMAS"
+
+
+def apply_pragmas(app):
+    """
+    Sets the configured pragmas on every new connection when the database is SQLite, i.e. WAL journaling lets
+    readers run during writes and busy_timeout makes concurrent writers wait instead of failing with "database is locked"
+    """
+    pragmas = app.config.get(PRAGMAS_KEY)
+    if not pragmas or not app.config.get("SQLALCHEMY_DATABASE_URI", "").startswith("sqlite"):
+        return
+    with app.app_context():
+        engine = db.get_engine()
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA {}={}".format(name, value))
+        cursor.close()
@@ -1,9 +1,19 @@
 """
 The processors package contains all image processing tasks that will be executed on the uploaded images
-you can import tasks modules and add them to REGISTERED_TASKS list
+you can import tasks modules and add them to REGISTERED_TASKS list.
+A task module may define a VERSION (default 1), bump it when its results change so `python -m svc.cmdline reprocess`
+recomputes them for the images processed before.
 """
-from svc.processors import average_pixel
+from svc.processors import average_pixel, channel_statistics, perceptual_hash
 
 REGISTERED_TASKS = [
     average_pixel,
+    channel_statistics,
+    perceptual_hash,
 ]
+
+DEFAULT_VERSION = 1
+
+
+def get_version(task):
+    return getattr(task, "VERSION", DEFAULT_VERSION)
@@ -1,16 +1,31 @@
-from PIL import Image
-import numpy as np
+from svc.utils.image_context import ImageContext
+from svc.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
 
 # This name will be added as a key to processing results dict
 NAME = "Average Pixel Value"
 
+# The controller passes the shared ImageContext instead of the raw upload
+ACCEPTS_CONTEXT = True
+
+# The mean is preserved by the JPEG DCT downscaling, so a 1/8 scale decode is accurate enough
+MAX_DECODE_SCALE = 8
+
 
 def execute(img_obj):
     """
     Gets the mean pixel value for an image
     This method is being called from Image Controller
-    :param img_obj: holds the stream of uploaded image (type:werkzeug.datastructures.FileStorage)
+    :param img_obj: the shared decoded image (type:svc.utils.image_context.ImageContext)
+    or a raw image stream which will be wrapped in a context
     :return: result which will be serialized and added to the response of upload endpoint
     """
-    image = Image.open(img_obj)
-    return np.mean(image)
+    context = ImageContext.wrap(img_obj)
+    total = 0.0
+    count = 0
+    # accumulate strip by strip, peak memory is bounded by the strip size instead of a float copy of the image
+    for strip in context.iter_strips():
+        total += float(strip.sum(dtype=np.float64))
+        count += strip.size
+    return total / count
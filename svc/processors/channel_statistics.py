@@ -0,0 +1,108 @@
+from svc.utils.image_context import ImageContext
+from svc.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# This name will be added as a key to processing results dict
+NAME = "Channel Statistics"
+
+# The controller passes the shared ImageContext instead of the raw upload
+ACCEPTS_CONTEXT = True
+
+# Integer modes are reduced from the shared per-band histograms, a single pass over the pixels for all statistics
+REQUIRES = ("histogram",)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# ITU-R 601-2 luma weights, the same ones PIL uses to convert to L
+LUMA_WEIGHTS = {"R": 0.299, "G": 0.587, "B": 0.114}
+
+DECIMALS = 3
+
+
+def execute(img_obj):
+    """
+    Gets mean, std, min, max and percentiles of every channel and the mean luminance
+    This method is being called from Image Controller
+    :param img_obj: the shared decoded image (type:svc.utils.image_context.ImageContext)
+    or a raw image stream which will be wrapped in a context
+    :return: dict with the image mode, the statistics keyed by band name and the luminance
+    """
+    context = ImageContext.wrap(img_obj)
+    image = context.image
+    histograms = context.intermediate("histogram")
+    if histograms is None:
+        channels = {band: _get_array_statistics(values) for band, values in context.channels.items()}
+    else:
+        if image.mode in ("P", "PA"):
+            histograms = _get_palette_histograms(image, histograms)
+        channels = {band: _get_histogram_statistics(counts) for band, counts in histograms.items()}
+    return {
+        "mode": image.mode,
+        "channels": channels,
+        "luminance": _get_luminance(channels),
+    }
+
+
+def _get_histogram_statistics(counts):
+    """Reduces a histogram whose index is the pixel value, O(bins) whatever the image size"""
+    count = int(counts.sum())
+    if not count:
+        return None
+    values = np.arange(len(counts), dtype=np.float64)
+    mean = float(np.dot(counts, values)) / count
+    variance = float(np.dot(counts, values * values)) / count - mean * mean
+    non_empty = np.flatnonzero(counts)
+    cumulative = np.cumsum(counts)
+    # the lower nearest rank, as numpy.percentile(interpolation="lower")
+    ranks = [int(percentile / 100 * (count - 1)) for percentile in PERCENTILES]
+    indexes = np.searchsorted(cumulative, ranks, side="right")
+    return _to_statistics(mean, max(variance, 0.0) ** 0.5, non_empty[0], non_empty[-1], indexes)
+
+
+def _get_array_statistics(values):
+    """Fallback for modes without an integer histogram (1, I, F)"""
+    values = values.astype(np.float64).ravel()
+    if not values.size:
+        return None
+    ranks = [int(percentile / 100 * (values.size - 1)) for percentile in PERCENTILES]
+    percentiles = np.partition(values, ranks)[ranks]
+    return _to_statistics(values.mean(), values.std(), values.min(), values.max(), percentiles)
+
+
+def _get_palette_histograms(image, histograms):
+    """Maps the palette indexes histogram to per color band histograms"""
+    index_counts = histograms["P"]
+    palette = np.zeros(768, dtype=np.int64)
+    colors = image.getpalette() or []
+    palette[:len(colors)] = colors[:768]
+    palette = palette.reshape(256, 3)
+    mapped = {
+        band: np.bincount(palette[:, i], weights=index_counts, minlength=256).astype(np.int64)
+        for i, band in enumerate("RGB")
+    }
+    if "A" in histograms:
+        mapped["A"] = histograms["A"]
+    return mapped
+
+
+def _get_luminance(channels):
+    if len(channels) == 1 or "L" in channels:
+        # grayscale modes (L, LA, I;16, I, F) are their own luminance
+        statistics = channels.get("L") or next(iter(channels.values()))
+        return statistics and {"mean": statistics["mean"]}
+    if not all(channels.get(band) for band in LUMA_WEIGHTS):
+        return None
+    # the luma is linear in the channels so its mean is derived from the channel means
+    mean = sum(weight * channels[band]["mean"] for band, weight in LUMA_WEIGHTS.items())
+    return {"mean": round(mean, DECIMALS)}
+
+
+def _to_statistics(mean, std, minimum, maximum, percentiles):
+    return {
+        "mean": round(float(mean), DECIMALS),
+        "std": round(float(std), DECIMALS),
+        "min": float(minimum),
+        "max": float(maximum),
+        "percentiles": {str(p): float(value) for p, value in zip(PERCENTILES, percentiles)},
+    }
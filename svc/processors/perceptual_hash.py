@@ -0,0 +1,44 @@
+"""
+64-bit difference hash (dHash) of the image: the grayscale image is shrunk to 9x8 pixels and every pair of horizontally
+adjacent pixels gives one bit, set when the left pixel is brighter. Resized, recompressed or slightly edited copies of
+an image have hashes within a small Hamming distance, see `GET /images/<name>/similar`.
+"""
+from svc.utils.image_context import ImageContext
+from svc.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+NAME = "Perceptual Hash"
+
+ACCEPTS_CONTEXT = True
+
+# the image is shrunk to 9x8 pixels, a 1/8 scale decode gives the same hash for all but tiny images
+MAX_DECODE_SCALE = 8
+
+HASH_SIZE = 8
+# modes whose values don't fit in 8 bits are shrunk as floats instead of being clipped
+_WIDE_MODES = ("I", "I;16", "I;16B", "I;16L", "I;16N", "F")
+
+
+def execute(img_obj):
+    """
+    :param img_obj: the shared decoded image (type:svc.utils.image_context.ImageContext) or a raw image stream
+    :return: the hash as 16 hexadecimal digits
+    """
+    image = ImageContext.wrap(img_obj).image
+    image = image.convert("F") if image.mode in _WIDE_MODES else image.convert("L")
+    pixels = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX), dtype=np.float32)
+    bits = pixels[:, :-1] > pixels[:, 1:]
+    return "{:016x}".format(int.from_bytes(np.packbits(bits).tobytes(), "big"))
+
+
+def get_hash(result):
+    """:return: the hash of a processing result as an int, None if the result has no valid hash"""
+    value = (result or {}).get(NAME)
+    if not isinstance(value, str) or len(value) != 2 * HASH_SIZE:
+        return None
+    try:
+        return int(value, 16)
+    except ValueError:
+        return None
@@ -0,0 +1,76 @@
+import mimetypes
+import os
+import tarfile
+import zipfile
+from io import BytesIO
+
+from werkzeug.datastructures import FileStorage
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+def iter_archive(archive_obj, max_file_size=None, max_total_size=None):
+    """
+    Yields the regular files of an uploaded zip or tar (optionally compressed) archive.
+    Tar archives are read as a stream, members are yielded as soon as they are read, so callers can stop early.
+    :param archive_obj: the uploaded archive (type:werkzeug.datastructures.FileStorage)
+    :param max_file_size: optional limit of the decompressed size of every file
+    :param max_total_size: optional limit of the decompressed size of all the files
+    :raise ArchiveTooLarge: as soon as a file or all the files read so far exceed their limit (i.e. a zip bomb)
+    :return: generator of werkzeug.datastructures.FileStorage
+    """
+    stream = archive_obj.stream
+    stream.seek(0)
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        members = _iter_zip(stream, max_file_size)
+    else:
+        stream.seek(0)
+        members = _iter_tar(stream, max_file_size)
+    total_size = 0
+    for name, content in members:
+        total_size += len(content)
+        if max_total_size is not None and total_size > max_total_size:
+            raise ArchiveTooLarge("The archive files are larger than {} bytes once extracted".format(max_total_size))
+        yield _to_file_storage(name, content)
+
+
+def _iter_zip(stream, max_file_size):
+    with zipfile.ZipFile(stream) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            _check_file_size(info.filename, info.file_size, max_file_size)
+            with archive.open(info) as member:
+                yield info.filename, _read_member(info.filename, member, max_file_size)
+
+
+def _iter_tar(stream, max_file_size):
+    with tarfile.open(fileobj=stream, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            _check_file_size(member.name, member.size, max_file_size)
+            yield member.name, _read_member(member.name, archive.extractfile(member), max_file_size)
+
+
+def _read_member(name, member, max_file_size):
+    # the declared size is checked first, the read is bounded too in case the header lies
+    if max_file_size is None:
+        return member.read()
+    content = member.read(max_file_size + 1)
+    _check_file_size(name, len(content), max_file_size)
+    return content
+
+
+def _check_file_size(name, size, max_file_size):
+    if max_file_size is not None and size > max_file_size:
+        raise ArchiveTooLarge("{} is larger than {} bytes once extracted".format(os.path.basename(name), max_file_size))
+
+
+def _to_file_storage(name, content):
+    filename = os.path.basename(name)
+    content_type = mimetypes.guess_type(filename)[0]
+    return FileStorage(stream=BytesIO(content), filename=filename, content_type=content_type)
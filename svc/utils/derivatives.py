@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from werkzeug.exceptions import BadRequest
+
+from svc.utils.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+
+CACHE_MAX_BYTES_KEY = "DERIVATIVE_CACHE_MAX_BYTES"
+MAX_DIMENSION_KEY = "DERIVATIVE_MAX_DIMENSION"
+
+FIT_CONTAIN = "contain"
+FIT_COVER = "cover"
+FIT_FILL = "fill"
+_FITS = [FIT_CONTAIN, FIT_COVER, FIT_FILL]
+_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_derivative_cache(config):
+    """Returns the process wide derivatives cache"""
+    max_bytes = config.get(CACHE_MAX_BYTES_KEY, 64 * 1024 * 1024)
+    with _caches_lock:
+        if max_bytes not in _caches:
+            _caches[max_bytes] = DerivativeCache(max_bytes)
+        return _caches[max_bytes]
+
+
+class DerivativeSpec:
+    """Describes a resized/re-encoded variant of an uploaded image"""
+
+    def __init__(self, width=None, height=None, fit=FIT_CONTAIN, quality=85, image_format="jpeg"):
+        self.width = width
+        self.height = height
+        self.fit = fit
+        self.quality = quality
+        self.format, self.mimetype = _FORMATS[image_format]
+        self.extension = image_format if image_format != "jpg" else "jpeg"
+
+    @classmethod
+    def from_options(cls, options, config):
+        """
+        Builds the spec from the view query parameters (width, height, fit, quality and format)
+        :return: the spec or None if no derivative parameter was given
+        """
+        if not any(options.get(key) for key in ("width", "height", "fit", "quality", "format")):
+            return None
+        max_dimension = config.get(MAX_DIMENSION_KEY, 4096)
+        width = _get_int(options, "width", 1, max_dimension)
+        height = _get_int(options, "height", 1, max_dimension)
+        quality = _get_int(options, "quality", 1, 95) or 85
+        fit = options.get("fit") or FIT_CONTAIN
+        image_format = (options.get("format") or "jpeg").lower()
+        if fit not in _FITS:
+            _raise_bad_request("fit should be one of {}".format(",".join(_FITS)))
+        if image_format not in _FORMATS:
+            _raise_bad_request("format should be one of {}".format(",".join(_FORMATS)))
+        if fit != FIT_CONTAIN and not (width and height):
+            _raise_bad_request("width and height are required for {} fit".format(fit))
+        return cls(width, height, fit, quality, image_format)
+
+    def get_name(self, image_name):
+        return "{}__{}x{}_{}_q{}.{}".format(
+            image_name, self.width or "", self.height or "", self.fit, self.quality, self.extension
+        )
+
+    def render(self, content):
+        """
+        Resizes and encodes the original image
+        :param content: the original image bytes
+        :return: the derivative image bytes
+        """
+        image = Image.open(BytesIO(content))
+        # let the jpeg decoder downscale while decoding when the target is much smaller
+        image.draft("RGB", (self.width or image.width, self.height or image.height))
+        image = self._resize(image)
+        if self.format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = BytesIO()
+        image.save(output, format=self.format, quality=self.quality)
+        return output.getvalue()
+
+    def _resize(self, image):
+        if self.fit == FIT_COVER:
+            return ImageOps.fit(image, (self.width, self.height), Image.LANCZOS)
+        if self.fit == FIT_FILL:
+            return image.resize((self.width, self.height), Image.LANCZOS)
+        scales = [1.0]
+        if self.width:
+            scales.append(self.width / image.width)
+        if self.height:
+            scales.append(self.height / image.height)
+        scale = min(scales)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        return image.resize(size, Image.LANCZOS) if size != image.size else image
+
+
+class DerivativeCache:
+    """
+    In memory LRU cache of encoded derivatives bounded by their total size.
+    Concurrent requests for a missing key wait for a single generation instead of each generating it.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    def get_or_create(self, key, factory):
+        while True:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    return self._items[key]
+                event = self._in_flight.get(key)
+                if event is None:
+                    self._in_flight[key] = threading.Event()
+                    break
+            # another request is generating this key, if it fails the next loop generates it again
+            event.wait()
+
+        try:
+            value = factory()
+            self._put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+    def _put(self, key, value):
+        if len(value) > self._max_bytes:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self._max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def _get_int(options, key, minimum, maximum):
+    value = options.get(key)
+    if not value:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        _raise_bad_request("{} should be an integer".format(key))
+    if not minimum <= value <= maximum:
+        _raise_bad_request("{} should be between {} and {}".format(key, minimum, maximum))
+    return value
+
+
+def _raise_bad_request(details):
+    exc = BadRequest()
+    exc.details = details
+    raise exc
@@ -1,10 +1,18 @@
-import boto3
-from botocore.exceptions import ClientError, BotoCoreError
-from flask import send_from_directory, make_response, current_app
+import os
+
+from flask import send_from_directory, current_app, request, Response
 from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date
+
+from svc.utils.lazy import lazy_import
+from svc.utils.storage_clients import get_s3_client
+
+botocore_exceptions = lazy_import("botocore.exceptions")
 
 UPLOAD_TYPE_KEY = "UPLOAD_TYPE"
 S3_BUCKET_KEY = "S3_BUCKET_NAME"
+CACHE_MAX_AGE_KEY = "VIEW_CACHE_MAX_AGE"
+STREAM_CHUNK_SIZE_KEY = "VIEW_STREAM_CHUNK_SIZE"
 LOCAL_UPLOAD = "lcl"
 S3_UPLOAD = "s3"
 
@@ -21,34 +29,125 @@ def get_file_reader(config):
 class BaseFileReader:
     def __init__(self, config):
         self._config = config
+        self._max_age = config.get(CACHE_MAX_AGE_KEY, 0)
 
     def get_response(self, file_name):
         raise NotImplementedError("get_response should be implemented in the derived classes")
 
+    def read(self, file_name):
+        raise NotImplementedError("read should be implemented in the derived classes")
+
+    def exists(self, file_name):
+        raise NotImplementedError("exists should be implemented in the derived classes")
+
 
 class LocalFileReader(BaseFileReader):
     def get_response(self, file_name):
         upload_path = self._config.get("UPLOAD_PATH")
-        return send_from_directory(upload_path, file_name)
+        # conditional responses handle Range, If-None-Match and If-Modified-Since against the file etag and mtime
+        return send_from_directory(upload_path, file_name, conditional=True, cache_timeout=self._max_age)
+
+    def read(self, file_name):
+        upload_path = self._config.get("UPLOAD_PATH")
+        try:
+            with open(os.path.join(upload_path, file_name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise NotFound()
+
+    def exists(self, file_name):
+        return os.path.isfile(os.path.join(self._config.get("UPLOAD_PATH"), file_name))
 
 
 class S3FileReader(BaseFileReader):
     def __init__(self, config):
         super().__init__(config)
         self._bucket_name = config.get(S3_BUCKET_KEY)
-        self._s3_client = boto3.resource('s3')
+        self._chunk_size = config.get(STREAM_CHUNK_SIZE_KEY, 64 * 1024)
+        self._s3_client = get_s3_client(config)
 
     def get_response(self, file_name):
+        """
+        Streams the object from s3 in chunks, Range and conditional request headers are passed through to s3
+        """
         try:
-            body, content_type = self._get_file(file_name)
-        except (BotoCoreError, ClientError) as e:
+            obj = self._get_file(file_name, **self._get_request_params())
+        except botocore_exceptions.ClientError as e:
+            response = self._get_error_response(e)
+            if response is not None:
+                return response
+            current_app.logger.error(e)
+            raise NotFound()
+        except botocore_exceptions.BotoCoreError as e:
             current_app.logger.error(e)
             raise NotFound()
 
-        response = make_response(body.read())
-        response.headers['Content-Type'] = content_type
+        status = 206 if obj.get('ContentRange') else 200
+        response = Response(self._iter_body(obj['Body']), status=status, direct_passthrough=True)
+        response.headers['Content-Type'] = obj['ContentType']
+        if obj.get('ContentLength') is not None:
+            response.headers['Content-Length'] = obj['ContentLength']
+        if obj.get('ContentRange'):
+            response.headers['Content-Range'] = obj['ContentRange']
+        self._set_cache_headers(response, obj.get('ETag'), obj.get('LastModified'))
         return response
 
-    def _get_file(self, file_name):
-        obj = self._s3_client.Object(self._bucket_name, file_name).get()
-        return obj['Body'], obj['ContentType']
+    def read(self, file_name):
+        try:
+            return self._get_file(file_name)['Body'].read()
+        except botocore_exceptions.ClientError as e:
+            if str(e.response.get('Error', {}).get('Code')) in ('NoSuchKey', '404'):
+                raise NotFound()
+            raise
+
+    def exists(self, file_name):
+        try:
+            self._s3_client.head_object(Bucket=self._bucket_name, Key=file_name)
+            return True
+        except botocore_exceptions.ClientError as e:
+            if str(e.response.get('Error', {}).get('Code')) in ('NoSuchKey', 'NotFound', '404'):
+                return False
+            raise
+
+    def _get_file(self, file_name, **params):
+        return self._s3_client.get_object(Bucket=self._bucket_name, Key=file_name, **params)
+
+    def _iter_body(self, body):
+        try:
+            for chunk in iter(lambda: body.read(self._chunk_size), b""):
+                yield chunk
+        finally:
+            body.close()
+
+    @staticmethod
+    def _get_request_params():
+        params = {}
+        if request.headers.get('Range'):
+            params['Range'] = request.headers['Range']
+        if request.headers.get('If-None-Match'):
+            params['IfNoneMatch'] = request.headers['If-None-Match']
+        if request.if_modified_since:
+            params['IfModifiedSince'] = request.if_modified_since
+        return params
+
+    def _get_error_response(self, error):
+        """Maps s3 not modified and invalid range errors to their http responses"""
+        code = str(error.response.get('Error', {}).get('Code'))
+        if code in ('304', 'NotModified'):
+            headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+            response = Response(status=304)
+            self._set_cache_headers(response, headers.get('etag'), headers.get('last-modified'))
+            return response
+        if code == 'InvalidRange':
+            return Response(status=416)
+        return None
+
+    def _set_cache_headers(self, response, etag, last_modified):
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Cache-Control'] = 'public, max-age={}'.format(self._max_age)
+        if etag:
+            response.headers['ETag'] = etag
+        if last_modified:
+            if not isinstance(last_modified, str):
+                last_modified = http_date(last_modified)
+            response.headers['Last-Modified'] = last_modified
@@ -1,9 +1,16 @@
-import boto3
 import os
 from flask import current_app
 
+from svc.utils.lazy import lazy_import
+from svc.utils.storage_clients import get_s3_client
+
+s3_transfer = lazy_import("boto3.s3.transfer")
+
 UPLOAD_TYPE_KEY = "UPLOAD_TYPE"
 S3_BUCKET_KEY = "S3_BUCKET_NAME"
+MULTIPART_THRESHOLD_KEY = "S3_MULTIPART_THRESHOLD"
+MULTIPART_CHUNK_SIZE_KEY = "S3_MULTIPART_CHUNK_SIZE"
+MULTIPART_CONCURRENCY_KEY = "S3_MULTIPART_CONCURRENCY"
 LOCAL_UPLOAD = "lcl"
 S3_UPLOAD = "s3"
 
@@ -24,6 +31,14 @@ class BaseFileWriter:
     def save(self, file_obj, file_name):
         raise NotImplementedError("`save` method should be implemented in derived classes")
 
+    def get_upload_form(self, file_name, content_type, max_size, expires_in):
+        """
+        Returns the url and form fields letting a client upload the file directly to storage
+        :param max_size: the largest accepted file size in bytes
+        :param expires_in: seconds the form stays valid
+        """
+        raise NotImplementedError("Direct uploads are only supported by s3 storage")
+
 
 class LocalFileWriter(BaseFileWriter):
     def save(self, file_obj, file_name):
@@ -36,12 +51,49 @@ class S3FileWriter(BaseFileWriter):
     def __init__(self, config):
         super().__init__(config)
         self._bucket_name = config.get(S3_BUCKET_KEY)
-        self._s3_client = boto3.client('s3')
+        self._multipart_threshold = config.get(MULTIPART_THRESHOLD_KEY, 8 * 1024 * 1024)
+        self._s3_client = get_s3_client(config)
 
     def save(self, file_obj, file_name):
-        self._s3_client.put_object(
-            Body=file_obj,
+        if _get_size(file_obj.stream) < self._multipart_threshold:
+            self._s3_client.put_object(
+                Body=file_obj,
+                Bucket=self._bucket_name,
+                Key=file_name,
+                ContentType=file_obj.content_type
+            )
+            return
+        # large files are streamed in parts uploaded concurrently instead of one long request
+        file_obj.stream.seek(0)
+        self._s3_client.upload_fileobj(
+            file_obj.stream,
+            self._bucket_name,
+            file_name,
+            ExtraArgs={"ContentType": file_obj.content_type},
+            Config=self._get_transfer_config(),
+        )
+
+    def get_upload_form(self, file_name, content_type, max_size, expires_in):
+        # a presigned POST policy, unlike a presigned PUT url, lets s3 enforce the content type and size
+        return self._s3_client.generate_presigned_post(
             Bucket=self._bucket_name,
             Key=file_name,
-            ContentType=file_obj.content_type
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_size]],
+            ExpiresIn=expires_in,
         )
+
+    def _get_transfer_config(self):
+        return s3_transfer.TransferConfig(
+            multipart_threshold=self._multipart_threshold,
+            multipart_chunksize=self._config.get(MULTIPART_CHUNK_SIZE_KEY, 8 * 1024 * 1024),
+            max_concurrency=self._config.get(MULTIPART_CONCURRENCY_KEY, 4),
+        )
+
+
+def _get_size(stream):
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
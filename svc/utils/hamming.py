@@ -0,0 +1,97 @@
+"""
+In memory index of 64-bit hashes searched by Hamming distance.
+The hashes are packed in a numpy uint64 array and every search is one vectorized xor and popcount over it,
+about 1ms per million hashes, without the per node python overhead of a BK-tree.
+"""
+import threading
+
+from svc.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+MAX_DISTANCE = 64
+
+_byte_popcount = None
+
+
+def popcount(values):
+    """:return: the number of set bits of every value of a uint64 array"""
+    if hasattr(np, "bitwise_count"):
+        # numpy 2 maps it to the CPU popcount instruction
+        return np.bitwise_count(values)
+    return _table_popcount(values)
+
+
+def _table_popcount(values):
+    # sums the set bits of the 8 bytes of every value, looked up in a 256 entries table
+    global _byte_popcount
+    if _byte_popcount is None:
+        _byte_popcount = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+    return _byte_popcount[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class HammingIndex:
+    """
+    Ids and hashes arrays grown by doubling so adding one hash is amortized O(1),
+    adding a known id replaces its hash in place
+    """
+
+    def __init__(self, capacity=1024):
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._hashes = np.empty(capacity, dtype=np.uint64)
+        self._positions = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, item_id, value):
+        self.add_many([item_id], [value])
+
+    def add_many(self, ids, values):
+        """
+        :param ids: int ids of the hashed items
+        :param values: the 64-bit hashes as unsigned ints
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.uint64)
+        with self._lock:
+            size = self._size
+            slots = []
+            for item_id in ids.tolist():
+                slot = self._positions.get(item_id)
+                if slot is None:
+                    slot = self._positions[item_id] = size
+                    size += 1
+                slots.append(slot)
+            if size > len(self._ids):
+                capacity = max(size, 2 * len(self._ids))
+                self._ids = _grow(self._ids, self._size, capacity)
+                self._hashes = _grow(self._hashes, self._size, capacity)
+            slots = np.asarray(slots, dtype=np.int64)
+            self._ids[slots] = ids
+            self._hashes[slots] = values
+            self._size = size
+
+    def search(self, value, max_distance, limit=None):
+        """
+        :param value: the searched 64-bit hash as an unsigned int
+        :param max_distance: the maximum number of differing bits
+        :param limit: the maximum number of returned items
+        :return: list of (id, distance) of the items within max_distance, closest first
+        """
+        with self._lock:
+            # growing copies the arrays and a replaced hash is a single item write, so the views stay valid unlocked
+            ids = self._ids[:self._size]
+            hashes = self._hashes[:self._size]
+        distances = popcount(hashes ^ np.uint64(value))
+        matches = np.flatnonzero(distances <= max_distance)
+        order = matches[np.lexsort((ids[matches], distances[matches]))][:limit]
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+
+def _grow(array, size, capacity):
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:size] = array[:size]
+    return grown
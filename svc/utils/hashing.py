@@ -0,0 +1,49 @@
+import hashlib
+
+from flask import Request
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def get_content_hash(image_obj):
+    """
+    Returns the sha256 hex digest of the uploaded file, computed while the upload was streamed in when possible
+    :param image_obj: the uploaded file (type:werkzeug.datastructures.FileStorage)
+    """
+    stream = image_obj.stream
+    content_hash = getattr(stream, "content_hash", None)
+    if content_hash:
+        return content_hash
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class HashingStream:
+    """Wraps the stream werkzeug spools an uploaded file to and hashes the bytes as they are written"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._digest = hashlib.sha256()
+
+    @property
+    def content_hash(self):
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._stream.write(data)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class HashingRequest(Request):
+    def _get_file_stream(self, *args, **kwargs):
+        return HashingStream(super()._get_file_stream(*args, **kwargs))
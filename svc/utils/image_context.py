@@ -0,0 +1,186 @@
+import threading
+import time
+from io import BytesIO
+
+from svc.utils.intermediates import get_provider
+from svc.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+DEFAULT_STRIP_ROWS = 256
+
+
+class ImageContext:
+    """
+    Holds one decoded upload shared by all processing tasks.
+    The image is decoded on first access and every derived view is computed at most once.
+    """
+
+    def __init__(self, stream, strip_rows=DEFAULT_STRIP_ROWS, max_decode_scale=1):
+        """
+        :param stream: the uploaded image stream
+        :param strip_rows: default strip height for iter_strips
+        :param max_decode_scale: the image may be decoded at down to 1/max_decode_scale of its size when the format
+        supports reduced decoding (JPEG draft mode), 1 always decodes the full image
+        """
+        self._stream = stream
+        self._strip_rows = strip_rows
+        self._max_decode_scale = max_decode_scale
+        self._original_size = None
+        self.decode_seconds = None
+        self._cache = {}
+        self._image_factory = self._decode
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_array(cls, array, mode, original_size, strip_rows=DEFAULT_STRIP_ROWS, palette=None, intermediates=None):
+        """
+        Builds a context over already decoded pixels, i.e. a shared memory view in a worker process
+        :param intermediates: dict of intermediates already computed for these pixels
+        """
+        context = cls(None, strip_rows)
+        context._original_size = original_size
+        context._cache["array"] = array
+        context._image_factory = lambda: _image_from_array(array, mode, palette)
+        for name, value in (intermediates or {}).items():
+            context._cache["intermediate:" + name] = value
+        return context
+
+    @classmethod
+    def wrap(cls, img_obj):
+        """
+        Returns img_obj if it is already a context, otherwise builds a context over its stream
+        so processors can still be called directly with a raw file object.
+        """
+        if isinstance(img_obj, cls):
+            return img_obj
+        return cls(img_obj)
+
+    @property
+    def image(self):
+        return self._cached("image", self._image_factory)
+
+    @property
+    def strip_rows(self):
+        return self._strip_rows
+
+    @property
+    def is_decoded(self):
+        with self._lock:
+            return "image" in self._cache
+
+    @property
+    def original_size(self):
+        self.image
+        return self._original_size
+
+    @property
+    def decode_scale(self):
+        """The ratio between the decoded and the original image width, 1.0 for a full decode"""
+        return self.image.width / self.original_size[0]
+
+    @property
+    def array(self):
+        return self._cached("array", lambda: np.asarray(self.image))
+
+    @property
+    def grayscale(self):
+        return self._cached("grayscale", lambda: np.asarray(self.image.convert("L")))
+
+    @property
+    def float32(self):
+        return self._cached("float32", lambda: self.array.astype(np.float32))
+
+    @property
+    def channels(self):
+        return self._cached("channels", self._split_channels)
+
+    def intermediate(self, name, provider=None):
+        """
+        Returns a named intermediate result shared by the tasks (see svc.utils.intermediates),
+        computing it on first use if the scheduler didn't compute it already
+        :param provider: the provider to compute it with, defaults to the registered one
+        """
+        return self._cached("intermediate:" + name, lambda: (provider or get_provider(name)).compute(self))
+
+    def has_intermediate(self, name):
+        with self._lock:
+            return "intermediate:" + name in self._cache
+
+    def get_intermediates(self):
+        """:return: dict of the intermediates computed so far"""
+        with self._lock:
+            return {
+                key[len("intermediate:"):]: value for key, value in self._cache.items() if key.startswith("intermediate:")
+            }
+
+    def iter_strips(self, rows=None):
+        """
+        Yields the pixels as arrays of horizontal strips, so reductions can be accumulated strip by strip
+        without materializing the full array (or a float copy of it).
+        If another task already materialized the full array the strips are views over it.
+        :param rows: the strip height, defaults to the context strip_rows
+        """
+        rows = rows or self._strip_rows
+        with self._lock:
+            array = self._cache.get("array")
+        if array is not None:
+            for top in range(0, array.shape[0], rows):
+                yield array[top:top + rows]
+            return
+        image = self.image
+        for top in range(0, image.height, rows):
+            yield np.asarray(image.crop((0, top, image.width, min(top + rows, image.height))))
+
+    def stream(self):
+        """Returns a fresh stream over the raw upload bytes, for tasks that decode the image themselves"""
+        return BytesIO(self._cached("raw", self._read_raw))
+
+    def _cached(self, key, factory):
+        # every key has its own lock so independent views can be computed concurrently, each only once
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._cache:
+                    return self._cache[key]
+            value = factory()
+            with self._lock:
+                self._cache[key] = value
+            return value
+
+    def _read_raw(self):
+        self._stream.seek(0)
+        return self._stream.read()
+
+    def _decode(self):
+        started = time.perf_counter()
+        image = Image.open(self.stream())
+        self._original_size = image.size
+        if self._max_decode_scale > 1:
+            # a no-op for formats without reduced decoding, JPEG picks the largest DCT scale within the limit
+            size = (max(1, image.width // self._max_decode_scale), max(1, image.height // self._max_decode_scale))
+            image.draft(image.mode, size)
+        image.load()
+        self.decode_seconds = time.perf_counter() - started
+        return image
+
+    def _split_channels(self):
+        bands = self.image.getbands()
+        return {band: np.asarray(channel) for band, channel in zip(bands, self.image.split())}
+
+
+def _image_from_array(array, mode, palette):
+    if mode == "1":
+        image = Image.fromarray(array)
+    else:
+        # frombuffer maps the pixels without a copy for the modes PIL stores as is (L, RGBA, I, F...)
+        height, width = array.shape[:2]
+        image = Image.frombuffer(mode, (width, height), np.ascontiguousarray(array), "raw", mode, 0, 1)
+    if palette:
+        image.putpalette(palette)
+    return image
@@ -0,0 +1,75 @@
+"""
+Identifies uploads from their first bytes and their header only, so invalid, misnamed or oversized images
+(decompression bombs) are rejected before they are stored or decoded.
+"""
+import warnings
+from collections import namedtuple
+
+from svc.utils.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+# the format of the first bytes, the longest signatures first
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"BM", "bmp"),
+]
+SNIFF_SIZE = 12
+# extensions and mime subtypes of the same format
+FORMAT_ALIASES = {"jpg": "jpeg", "pjpeg": "jpeg", "tif": "tiff", "x-png": "png", "x-ms-bmp": "bmp"}
+
+ImageHeader = namedtuple("ImageHeader", ["format", "width", "height", "mode"])
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def normalize_format(name):
+    """:return: the format name of an extension or mime subtype, i.e. jpg -> jpeg"""
+    name = (name or "").lower()
+    return FORMAT_ALIASES.get(name, name)
+
+
+def sniff_format(head):
+    """
+    :param head: the first SNIFF_SIZE bytes of a file
+    :return: the format name or None if the bytes match no known image format
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, image_format in _SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def read_header(stream):
+    """
+    Reads the format, dimensions and mode of an image without decoding its pixels, the stream is rewound
+    :raise InvalidImage: if the bytes are not a known image format or the header can't be parsed
+    """
+    stream.seek(0)
+    try:
+        image_format = sniff_format(stream.read(SNIFF_SIZE))
+        if image_format is None:
+            raise InvalidImage("The uploaded file is not a supported image")
+        stream.seek(0)
+        try:
+            with warnings.catch_warnings():
+                # the size limits are checked by the caller, PIL only warns below its own hard limit
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                image = Image.open(stream)
+                width, height = image.size
+                return ImageHeader(image_format, width, height, image.mode)
+        except Image.DecompressionBombError as e:
+            raise InvalidImage(str(e))
+        except Exception as e:
+            raise InvalidImage("The uploaded {} image header is invalid: {}".format(image_format, e))
+    finally:
+        stream.seek(0)
@@ -0,0 +1,77 @@
+"""
+Intermediate results shared by the processing tasks.
+A task declares the intermediates it consumes in a REQUIRES tuple and reads them with context.intermediate(name),
+each one is computed once per image. Tasks can contribute new intermediates with a PROVIDES list of Provider.
+"""
+from svc.utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# band modes whose histogram index is the pixel value
+EIGHT_BIT_MODES = {"L", "P", "LA", "PA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr", "LAB", "HSV"}
+SIXTEEN_BIT_MODES = {"I;16", "I;16L", "I;16B", "I;16N"}
+
+_providers = {}
+
+
+class Provider:
+    def __init__(self, name, function, requires=()):
+        self.name = name
+        self.requires = tuple(requires)
+        self._function = function
+
+    def compute(self, context):
+        return self._function(context)
+
+
+def provider(name, requires=()):
+    """Registers the decorated function(context) as the provider of an intermediate"""
+    def decorator(function):
+        register(Provider(name, function, requires))
+        return function
+    return decorator
+
+
+def register(intermediate_provider):
+    _providers[intermediate_provider.name] = intermediate_provider
+
+
+def get_provider(name, providers=None):
+    """:param providers: optional dict of name to Provider looked up before the registered ones"""
+    if providers and name in providers:
+        return providers[name]
+    if name not in _providers:
+        raise KeyError("Unknown intermediate {}".format(name))
+    return _providers[name]
+
+
+def has_provider(name, providers=None):
+    return bool(providers and name in providers) or name in _providers
+
+
+@provider("grayscale")
+def grayscale(context):
+    return context.grayscale
+
+
+@provider("histogram")
+def histogram(context):
+    """
+    Per band pixel counts indexed by value, 256 bins for 8-bit modes and 65536 for 16-bit ones
+    :return: dict of band name to counts array, or None for modes without an integer histogram (I, F)
+    """
+    image = context.image
+    if image.mode in EIGHT_BIT_MODES:
+        counts = np.asarray(image.histogram(), dtype=np.int64)
+        return {band: counts[i * 256:(i + 1) * 256] for i, band in enumerate(image.getbands())}
+    if image.mode in SIXTEEN_BIT_MODES:
+        return {image.getbands()[0]: np.bincount(context.array.ravel(), minlength=65536)}
+    return None
+
+
+@provider("channel_sums", requires=("histogram",))
+def channel_sums(context):
+    counts = context.intermediate("histogram")
+    if counts is None:
+        return {band: float(channel.sum(dtype=np.float64)) for band, channel in context.channels.items()}
+    return {band: float(np.dot(values, np.arange(len(values)))) for band, values in counts.items()}
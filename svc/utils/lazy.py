@@ -0,0 +1,24 @@
+"""
+Deferred imports of the heavy dependencies (numpy, PIL, boto3, botocore).
+The service entry point is imported on every cold start, modules only pay for these imports on first use.
+"""
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stands for a module which is imported on the first attribute access"""
+
+    def __getattr__(self, attribute):
+        # only called for missing attributes, after the import the module attributes are copied in the proxy
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def lazy_import(name):
+    """
+    Returns a proxy importing the module on first use
+    :param name: the full module name, i.e. `PIL.Image`
+    """
+    return LazyModule(name)
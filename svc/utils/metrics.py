@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+STAGE_SECONDS = "img_process_stage_seconds"
+REQUEST_SECONDS = "img_process_request_seconds"
+REQUESTS_TOTAL = "img_process_requests_total"
+PROCESSOR_SECONDS = "img_process_processor_seconds"
+PROCESSOR_ERRORS_TOTAL = "img_process_processor_errors_total"
+HUNG_TASKS = "img_process_hung_tasks"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self._buckets = buckets
+        self._values = {}
+
+    def observe(self, labels, value):
+        counts, total = self._values.get(labels, ([0] * (len(self._buckets) + 1), 0.0))
+        counts[bisect_left(self._buckets, value)] += 1
+        self._values[labels] = (counts, total + value)
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + (("le", str(bound)),), cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """Process wide metrics rendered in the prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, description, **labels):
+        with self._lock:
+            self._get(Counter, name, description).inc(_to_labels(labels))
+
+    def add(self, name, description, amount, **labels):
+        """Adds a positive or negative amount to a gauge"""
+        with self._lock:
+            self._get(Gauge, name, description).inc(_to_labels(labels), amount)
+
+    def observe(self, name, description, value, **labels):
+        with self._lock:
+            self._get(Histogram, name, description).observe(_to_labels(labels), value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append("# HELP {} {}".format(metric.name, metric.description))
+                lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+                for name, labels, value in metric.samples():
+                    lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def _get(self, metric_class, name, description):
+        if name not in self._metrics:
+            self._metrics[name] = metric_class(name, description)
+        return self._metrics[name]
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def timed(stage):
+    """Times a stage of the current request, see record_stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_stage(stage, seconds):
+    """
+    Adds the stage duration to the stages histogram and, inside a request, to the request Server-Timing header
+    """
+    registry.observe(STAGE_SECONDS, "Duration of each stage of the requests", seconds,
+                     endpoint=_get_endpoint(), stage=stage)
+    if has_request_context():
+        g.setdefault("timings", []).append((stage, seconds))
+
+
+def record_processor(name, seconds, error=None):
+    registry.observe(PROCESSOR_SECONDS, "Duration of each processing task", seconds, processor=name)
+    if error is not None:
+        record_processor_error(name, error)
+
+
+def record_processor_error(name, error):
+    registry.inc(PROCESSOR_ERRORS_TOTAL, "Processing tasks failures", processor=name, error=error)
+
+
+def record_hung_tasks(pool, amount):
+    registry.add(HUNG_TASKS, "Timed out tasks still occupying a worker thread", amount, pool=pool)
+
+
+def record_request(endpoint, status, seconds):
+    registry.observe(REQUEST_SECONDS, "Duration of the requests", seconds, endpoint=endpoint)
+    registry.inc(REQUESTS_TOTAL, "Handled requests", endpoint=endpoint, status=str(status))
+
+
+def get_server_timing():
+    """:return: the Server-Timing header value of the stages timed in the current request"""
+    timings = g.get("timings", [])
+    return ", ".join(
+        "{};dur={:.2f}".format(re.sub(r"[^A-Za-z0-9_.-]", "_", stage), seconds * 1000) for stage, seconds in timings
+    )
+
+
+def _get_endpoint():
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "background"
+
+
+def _to_labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, _escape(value)) for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,269 @@
+"""
+Runs the context tasks on warm worker processes, so CPU bound processors aren't serialized by the GIL.
+The upload is decoded once in the request process and its pixels are copied in a shared memory block, the workers
+map the block as a numpy array instead of receiving a pickled copy of the image per task.
+"""
+import importlib
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from types import ModuleType
+
+from svc.utils import metrics
+from svc.utils.image_context import ImageContext
+from svc.utils.lazy import lazy_import
+from svc.utils.task_executor import MAX_WORKERS_KEY, ThreadTaskExecutor, get_remaining_time
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+np = lazy_import("numpy")
+
+START_METHOD_KEY = "PROCESSING_START_METHOD"
+# intermediates smaller than this are pickled with the task instead of being shared
+SHARED_INTERMEDIATE_MIN_BYTES = 64 * 1024
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def is_supported():
+    return shared_memory is not None
+
+
+def get_process_pool(max_workers=None, start_method="spawn"):
+    """Returns a process wide pool of workers having the processors modules already imported"""
+    key = (max_workers, start_method)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or _is_broken(pool):
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=_init_worker,
+            )
+            _pools[key] = pool
+        return pool
+
+
+def warm_up(config):
+    """Starts the workers of the configured pool ahead of the first request"""
+    max_workers = config.get(MAX_WORKERS_KEY) or multiprocessing.cpu_count()
+    pool = get_process_pool(config.get(MAX_WORKERS_KEY), config.get(START_METHOD_KEY, "spawn"))
+    return [pool.submit(_ping) for i in range(max_workers)]
+
+
+class ProcessTaskExecutor(ThreadTaskExecutor):
+    """
+    Runs the tasks accepting an ImageContext on a process pool and the other tasks on the threads pool.
+    As with threads, a task exceeding its timeout is reported as an error while its worker stays busy.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._start_method = config.get(START_METHOD_KEY, "spawn")
+        self._process_pool = get_process_pool(config.get(MAX_WORKERS_KEY), self._start_method)
+
+    def run(self, tasks, get_input, started=None):
+        remote_tasks = [task for task in tasks if _is_remote(task)]
+        if not remote_tasks:
+            return super().run(tasks, get_input, started)
+        results = {}
+        errors = {}
+        tasks_started = time.monotonic()
+        started = tasks_started if started is None else started
+        try:
+            shared = SharedContext(get_input(remote_tasks[0])).__enter__()
+        except Exception as e:
+            # the pixels can't be decoded (i.e. a truncated upload), the remote tasks fail as they would on threads
+            results, errors = super().run([task for task in tasks if task not in remote_tasks], get_input, started)
+            for task in remote_tasks:
+                errors[task.NAME] = str(e)
+                metrics.record_processor_error(task.NAME, type(e).__name__)
+            return results, errors
+        try:
+            futures = []
+            for task in tasks:
+                if task in remote_tasks:
+                    future = self._process_pool.submit(_execute_remote, task.__name__, shared.descriptor)
+                    futures.append((task, (future, None)))
+                else:
+                    futures.append((task, self._submit(task, get_input)))
+            for task, (future, task_run) in futures:
+                if task_run is not None:
+                    self._wait(task, future, task_run, started, results, errors)
+                    continue
+                # the worker processes don't report when they start a task, its timeout counts from the submission
+                timeout, reason = get_remaining_time(
+                    self._get_task_timeout(task), tasks_started, self._deadline, started
+                )
+                try:
+                    value = future.result(timeout=timeout)
+                    if task in remote_tasks:
+                        value = self._record_remote(task, *value)
+                    self._collect(task, value, results)
+                except TimeoutError:
+                    future.cancel()
+                    errors[task.NAME] = reason
+                    metrics.record_processor_error(task.NAME, "Timeout")
+                except BrokenProcessPool as e:
+                    # a worker died (i.e. out of memory), the next run gets a new pool
+                    errors[task.NAME] = "Processing worker failed: {}".format(e)
+                    metrics.record_processor_error(task.NAME, "BrokenProcessPool")
+                except Exception as e:
+                    errors[task.NAME] = str(e)
+        finally:
+            shared.close()
+        return results, errors
+
+    def _record_remote(self, task, value, seconds, error_type, message):
+        self.timings[task.NAME] = seconds
+        metrics.record_processor(task.NAME, seconds, error_type)
+        if error_type is not None:
+            raise RemoteTaskError(message)
+        return value
+
+
+class RemoteTaskError(Exception):
+    pass
+
+
+class SharedContext:
+    """
+    Copies the decoded pixels of a context and its large array intermediates in shared memory blocks,
+    the blocks are unlinked when the context manager exits
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self._blocks = []
+        self.descriptor = None
+
+    def __enter__(self):
+        try:
+            context = self._context
+            image = context.image
+            intermediates = {}
+            for name, value in context.get_intermediates().items():
+                if isinstance(value, np.ndarray) and value.nbytes >= SHARED_INTERMEDIATE_MIN_BYTES:
+                    intermediates[name] = ("shared", self._share(value))
+                else:
+                    intermediates[name] = ("value", value)
+            self.descriptor = {
+                "pixels": self._share(context.array),
+                "mode": image.mode,
+                "palette": image.getpalette() if image.mode in ("P", "PA") else None,
+                "original_size": context.original_size,
+                "strip_rows": context.strip_rows,
+                "intermediates": intermediates,
+            }
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # the workers keep their own mapping, unlinking only removes the name
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def _share(self, array):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._blocks.append(block)
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        return block.name, array.shape, array.dtype.str
+
+
+def attach_context(descriptor, blocks):
+    """
+    Builds an ImageContext over the shared blocks of a SharedContext descriptor
+    :param blocks: list the attached blocks are appended to, they must be closed once the context is released
+    """
+    intermediates = {}
+    for name, (kind, value) in descriptor["intermediates"].items():
+        intermediates[name] = _attach_array(value, blocks) if kind == "shared" else value
+    return ImageContext.from_array(
+        _attach_array(descriptor["pixels"], blocks),
+        descriptor["mode"],
+        descriptor["original_size"],
+        strip_rows=descriptor["strip_rows"],
+        palette=descriptor["palette"],
+        intermediates=intermediates,
+    )
+
+
+def _is_remote(task):
+    # plain callables and tasks reading the raw upload can't be imported by name in a worker
+    return isinstance(task, ModuleType) and getattr(task, "ACCEPTS_CONTEXT", False)
+
+
+def _is_broken(pool):
+    return getattr(pool, "_broken", False)
+
+
+def _init_worker():
+    # the workers pay the imports once instead of per task
+    for name in ("numpy", "PIL.Image", "svc.processors"):
+        importlib.import_module(name)
+
+
+def _ping():
+    return True
+
+
+def _execute_remote(module_name, descriptor):
+    """Runs in a worker: executes one task over the shared pixels, returns (value, seconds, error type, message)"""
+    task = importlib.import_module(module_name)
+    blocks = []
+    try:
+        context = attach_context(descriptor, blocks)
+        started = time.perf_counter()
+        try:
+            value = task.execute(context)
+            error_type = message = None
+        except Exception as e:
+            value = None
+            error_type, message = type(e).__name__, str(e)
+        seconds = time.perf_counter() - started
+        # results must not keep views over the blocks which are closed below
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+        del context
+        return value, seconds, error_type, message
+    finally:
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # a leftover view still exports the buffer, the mapping is released with it
+                pass
+
+
+def _attach_array(shared, blocks):
+    name, shape, dtype = shared
+    block = _attach_block(name)
+    blocks.append(block)
+    return np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _attach_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 registers attached blocks to the resource tracker which would unlink them on worker exit
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
@@ -0,0 +1,106 @@
+import threading
+
+from svc.utils.lazy import lazy_import
+
+boto3_session = lazy_import("boto3.session")
+botocore_config = lazy_import("botocore.config")
+
+MAX_POOL_CONNECTIONS_KEY = "S3_MAX_POOL_CONNECTIONS"
+MAX_RETRIES_KEY = "S3_MAX_RETRIES"
+CONNECT_TIMEOUT_KEY = "S3_CONNECT_TIMEOUT"
+READ_TIMEOUT_KEY = "S3_READ_TIMEOUT"
+POOLS_UNAVAILABLE = "unavailable"
+
+_clients = {}
+_lock = threading.Lock()
+_stats = {"created": 0, "reused": 0}
+
+
+def get_s3_client(config):
+    """
+    Returns the process wide s3 client for this configuration, creating it on first use.
+    botocore clients are thread safe so a single client and its connection pool are shared by all requests.
+    """
+    key = _get_client_key(config)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats["reused"] += 1
+            return client
+    # creating a client loads the service model (~100ms), other configurations shouldn't wait for it
+    client = _create_client(config)
+    with _lock:
+        existing = _clients.get(key)
+        if existing is not None:
+            # created concurrently by another request, the first one is kept
+            _stats["reused"] += 1
+            return existing
+        _clients[key] = client
+        _stats["created"] += 1
+        return client
+
+
+def get_stats():
+    """
+    :return: counters of created and reused clients and the connection pools usage of every client
+    """
+    with _lock:
+        clients = list(_clients.items())
+        stats = dict(_stats)
+    stats["clients"] = [
+        {"max_pool_connections": key[0], "pools": _get_pools_usage(client)} for key, client in clients
+    ]
+    return stats
+
+
+def reset():
+    with _lock:
+        _clients.clear()
+        _stats.update({"created": 0, "reused": 0})
+
+
+def _get_client_key(config):
+    return (
+        config.get(MAX_POOL_CONNECTIONS_KEY, 10),
+        config.get(MAX_RETRIES_KEY, 3),
+        config.get(CONNECT_TIMEOUT_KEY, 5),
+        config.get(READ_TIMEOUT_KEY, 30),
+    )
+
+
+def _create_client(config):
+    max_pool_connections, max_retries, connect_timeout, read_timeout = _get_client_key(config)
+    client_config = botocore_config.Config(
+        max_pool_connections=max_pool_connections,
+        retries={"max_attempts": max_retries},
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+    )
+    # the default boto3 session is not safe to create clients from concurrently
+    return boto3_session.Session().client('s3', config=client_config)
+
+
+def _get_pools_usage(client):
+    """
+    :return: list of the urllib3 pools of a client with their connections,
+    or POOLS_UNAVAILABLE when botocore internals don't expose them anymore
+    """
+    # botocore has no public api for its connection pools, every private attribute is looked up defensively
+    manager = getattr(getattr(getattr(client, "_endpoint", None), "http_session", None), "_manager", None)
+    pools = getattr(manager, "pools", None)
+    if pools is None or not hasattr(pools, "keys"):
+        return POOLS_UNAVAILABLE
+    usage = []
+    try:
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            usage.append({
+                "host": getattr(key, "key_host", str(key)),
+                "connections": pool.num_connections,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+            })
+    except (AttributeError, TypeError):
+        return POOLS_UNAVAILABLE
+    return usage
@@ -0,0 +1,212 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+
+from svc.utils import metrics
+
+EXECUTOR_TYPE_KEY = "PROCESSING_EXECUTOR"
+MAX_WORKERS_KEY = "PROCESSING_MAX_WORKERS"
+TASK_TIMEOUT_KEY = "PROCESSING_TASK_TIMEOUT"
+DEADLINE_KEY = "PROCESSING_DEADLINE"
+SYNC_EXECUTOR = "sync"
+THREAD_EXECUTOR = "thread"
+PROCESS_EXECUTOR = "process"
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_task_executor(config):
+    executor_type = config.get(EXECUTOR_TYPE_KEY, SYNC_EXECUTOR)
+    if executor_type == SYNC_EXECUTOR:
+        return SyncTaskExecutor(config)
+    elif executor_type == THREAD_EXECUTOR:
+        return ThreadTaskExecutor(config)
+    elif executor_type == PROCESS_EXECUTOR:
+        # imported on use, the module depends on this one
+        from svc.utils import process_executor
+        if process_executor.is_supported():
+            return process_executor.ProcessTaskExecutor(config)
+        current_app.logger.warning("process PROCESSING_EXECUTOR needs python 3.8+ shared memory, using threads")
+        return ThreadTaskExecutor(config)
+    current_app.logger.warning("sync, thread and process only supported for PROCESSING_EXECUTOR configuration")
+    return SyncTaskExecutor(config)
+
+
+def start_process_pool(config):
+    """Starts the worker processes ahead of the first request when the process executor is configured"""
+    if config.get(EXECUTOR_TYPE_KEY) != PROCESS_EXECUTOR:
+        return None
+    from svc.utils import process_executor
+    if not process_executor.is_supported():
+        return None
+    return process_executor.warm_up(config)
+
+
+class BaseTaskExecutor:
+    def __init__(self, config):
+        self._config = config
+        self._deadline = config.get(DEADLINE_KEY)
+        # the duration of every finished task keyed by its NAME
+        self.timings = {}
+
+    def run(self, tasks, get_input, started=None):
+        """
+        Executes the tasks and collects their results
+        :param tasks: processors modules (having NAME and execute)
+        :param get_input: callable returning the argument passed to a task's execute
+        :param started: time.monotonic() the request deadline is counted from, defaults to now
+        :return: tuple of (results, errors) dicts keyed by task NAME
+        """
+        raise NotImplementedError("`run` method should be implemented in derived classes")
+
+    def _get_task_timeout(self, task):
+        return getattr(task, "TIMEOUT", None) or self._config.get(TASK_TIMEOUT_KEY)
+
+    def _execute(self, task, get_input, task_run=None):
+        started = time.perf_counter()
+        error = None
+        if task_run is not None:
+            task_run.start()
+        try:
+            return task.execute(get_input(task))
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.timings[task.NAME] = seconds
+            metrics.record_processor(task.NAME, seconds, error)
+            if task_run is not None:
+                task_run.finish()
+
+    @staticmethod
+    def _collect(task, value, results):
+        # the execution may be done through a queue, so the results may not be immediate
+        if value:
+            results[task.NAME] = value
+
+
+class SyncTaskExecutor(BaseTaskExecutor):
+    """Runs the tasks one after another on the calling thread, skipping what is left once the deadline passes"""
+
+    def run(self, tasks, get_input, started=None):
+        results = {}
+        errors = {}
+        started = time.monotonic() if started is None else started
+        for task in tasks:
+            if self._deadline is not None and time.monotonic() - started >= self._deadline:
+                errors[task.NAME] = "Request deadline of {}s exceeded".format(self._deadline)
+                metrics.record_processor_error(task.NAME, "Timeout")
+                continue
+            try:
+                self._collect(task, self._execute(task, get_input), results)
+            except Exception as e:
+                errors[task.NAME] = str(e)
+        return results, errors
+
+
+class ThreadTaskExecutor(BaseTaskExecutor):
+    """
+    Runs the tasks concurrently on a process wide thread pool.
+    A task's timeout counts from the moment a worker starts it, the queued tasks only wait for the request deadline.
+    A task exceeding its timeout is reported as an error, its worker thread stays busy until the task returns and is
+    counted meanwhile by the hung tasks gauge (see svc.utils.metrics).
+    """
+    POOL_NAME = "processor"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._pool = get_thread_pool(self.POOL_NAME, config.get(MAX_WORKERS_KEY))
+
+    def run(self, tasks, get_input, started=None):
+        results = {}
+        errors = {}
+        started = time.monotonic() if started is None else started
+        submitted = [(task, self._submit(task, get_input)) for task in tasks]
+        for task, (future, task_run) in submitted:
+            self._wait(task, future, task_run, started, results, errors)
+        return results, errors
+
+    def _submit(self, task, get_input):
+        task_run = _TaskRun(self.POOL_NAME)
+        return self._pool.submit(self._execute, task, get_input, task_run), task_run
+
+    def _wait(self, task, future, task_run, started, results, errors):
+        remaining, reason = get_remaining_time(None, None, self._deadline, started)
+        try:
+            if not task_run.wait_started(remaining):
+                raise TimeoutError()
+            remaining, reason = get_remaining_time(
+                self._get_task_timeout(task), task_run.started, self._deadline, started
+            )
+            self._collect(task, future.result(timeout=remaining), results)
+        except TimeoutError:
+            future.cancel()
+            task_run.abandon()
+            errors[task.NAME] = reason
+            metrics.record_processor_error(task.NAME, "Timeout")
+        except Exception as e:
+            errors[task.NAME] = str(e)
+
+
+class _TaskRun:
+    """When a worker started a submitted task, and whether the task still occupies the worker after timing out"""
+
+    def __init__(self, pool_name):
+        self.started = None
+        self._pool_name = pool_name
+        self._started_event = threading.Event()
+        self._lock = threading.Lock()
+        self._finished = False
+        self._hung = False
+
+    def start(self):
+        self.started = time.monotonic()
+        self._started_event.set()
+
+    def wait_started(self, timeout):
+        """:return: False if the task is still queued after timeout seconds"""
+        return self._started_event.wait(timeout)
+
+    def finish(self):
+        with self._lock:
+            self._finished = True
+            if self._hung:
+                metrics.record_hung_tasks(self._pool_name, -1)
+
+    def abandon(self):
+        """Called once the task timed out, a cancelled task never starts and a finished one freed its worker"""
+        with self._lock:
+            if self.started is not None and not self._finished:
+                self._hung = True
+                metrics.record_hung_tasks(self._pool_name, 1)
+
+
+def get_remaining_time(timeout, timeout_started, deadline, deadline_started, timeout_reason="Task timed out after {}s"):
+    """
+    :param timeout: optional seconds allowed since timeout_started
+    :param deadline: optional seconds allowed since deadline_started, the request deadline
+    :return: tuple of (seconds left or None without limit, error message of the closest limit)
+    """
+    now = time.monotonic()
+    limits = []
+    if timeout is not None:
+        limits.append((timeout - (now - timeout_started), timeout_reason.format(timeout)))
+    if deadline is not None:
+        limits.append((deadline - (now - deadline_started), "Request deadline of {}s exceeded".format(deadline)))
+    if not limits:
+        return None, None
+    remaining, reason = min(limits, key=lambda limit: limit[0])
+    return max(remaining, 0), reason
+
+
+def get_thread_pool(name, max_workers):
+    """Returns a process wide thread pool, separate pools are kept per name so nested submissions can't deadlock"""
+    key = (name, max_workers)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _pools[key]
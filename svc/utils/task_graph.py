@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+from svc.utils import intermediates
+from svc.utils.task_executor import get_remaining_time
+
+
+class TaskGraph:
+    """
+    Schedules the intermediates required by the tasks (their REQUIRES), see svc.utils.intermediates.
+    Intermediates are computed level by level, the ones of a level don't depend on each other and run concurrently.
+    """
+
+    def __init__(self, tasks):
+        self._tasks = tasks
+        # the providers contributed by the tasks overlay the registered ones for this graph only
+        self._providers = {
+            intermediate_provider.name: intermediate_provider
+            for task in tasks for intermediate_provider in getattr(task, "PROVIDES", ())
+        }
+        # the duration of every intermediate computed in time keyed by its name, the timed out ones are left out
+        self._timings = {}
+        self._timed_out = set()
+        self._timings_lock = threading.Lock()
+
+    @property
+    def timings(self):
+        """:return: a copy of the intermediates durations, the timed out ones may still be running"""
+        with self._timings_lock:
+            return dict(self._timings)
+
+    def prepare(self, context, pool=None, timeout=None, deadline=None, started=None):
+        """
+        Computes every intermediate required by the tasks and stores it in the context
+        :param context: the shared ImageContext
+        :param pool: optional concurrent.futures executor, the intermediates are computed in order without it
+        :param timeout: optional seconds allowed to every intermediate, as PROCESSING_TASK_TIMEOUT to the tasks
+        :param deadline: optional seconds allowed since `started` (time.monotonic(), defaults to now) to the request,
+        without a pool a running intermediate can't be waited for less, the remaining ones are skipped
+        :return: dict of task NAME to error message for the tasks whose intermediates couldn't be computed
+        """
+        limits = (timeout, deadline, time.monotonic() if started is None else started)
+        requirements, errors = self._resolve_tasks()
+        failed = {}
+        for level in self._get_levels(set().union(*requirements.values())):
+            runnable = []
+            for name in level:
+                failed_requirement = next((r for r in self._get_provider(name).requires if r in failed), None)
+                if failed_requirement is not None:
+                    failed[name] = failed[failed_requirement]
+                else:
+                    runnable.append(name)
+            failed.update(self._compute_level(context, runnable, pool, limits))
+
+        for task in self._tasks:
+            if task.NAME in errors:
+                continue
+            failed_requirement = next((name for name in sorted(requirements[task.NAME]) if name in failed), None)
+            if failed_requirement is not None:
+                errors[task.NAME] = "Intermediate {} failed: {}".format(failed_requirement, failed[failed_requirement])
+        return errors
+
+    def _resolve_tasks(self):
+        requirements = {}
+        errors = {}
+        for task in self._tasks:
+            try:
+                requirements[task.NAME] = self._get_closure(getattr(task, "REQUIRES", ()), ())
+            except (KeyError, ValueError) as e:
+                requirements[task.NAME] = set()
+                errors[task.NAME] = str(e.args[0])
+        return requirements, errors
+
+    def _get_closure(self, names, path):
+        closure = set()
+        for name in names:
+            if name in path:
+                raise ValueError("Cyclic intermediates {}".format(" -> ".join(path + (name,))))
+            closure.add(name)
+            closure |= self._get_closure(self._get_provider(name).requires, path + (name,))
+        return closure
+
+    def _get_provider(self, name):
+        return intermediates.get_provider(name, self._providers)
+
+    def _get_levels(self, names):
+        depths = {}
+
+        def depth(name):
+            if name not in depths:
+                requires = self._get_provider(name).requires
+                depths[name] = 1 + max((depth(r) for r in requires), default=-1)
+            return depths[name]
+
+        levels = {}
+        for name in names:
+            levels.setdefault(depth(name), []).append(name)
+        return [sorted(levels[level]) for level in sorted(levels)]
+
+    def _compute_level(self, context, names, pool, limits):
+        timeout, deadline, started = limits
+        if pool is None or (len(names) < 2 and timeout is None and deadline is None):
+            failed = {}
+            for name in names:
+                remaining, reason = get_remaining_time(None, None, deadline, started)
+                if remaining == 0:
+                    failed[name] = reason
+                    continue
+                name, error = self._compute(context, name)
+                if error is not None:
+                    failed[name] = error
+            return failed
+        level_started = time.monotonic()
+        futures = [(name, pool.submit(self._compute, context, name)) for name in names]
+        failed = {}
+        for name, future in futures:
+            remaining, reason = get_remaining_time(
+                timeout, level_started, deadline, started, "Intermediate timed out after {}s"
+            )
+            try:
+                name, error = future.result(timeout=remaining)
+            except TimeoutError:
+                # as with the tasks, the worker stays busy until the intermediate returns
+                future.cancel()
+                error = reason
+                with self._timings_lock:
+                    self._timed_out.add(name)
+            if error is not None:
+                failed[name] = error
+        return failed
+
+    def _compute(self, context, name):
+        started = time.perf_counter()
+        try:
+            context.intermediate(name, self._get_provider(name))
+            return name, None
+        except Exception as e:
+            return name, str(e)
+        finally:
+            with self._timings_lock:
+                if name not in self._timed_out:
+                    self._timings[name] = time.perf_counter() - started
@@ -0,0 +1,103 @@
+"""
+Processing of the images uploaded directly to storage with the presigned forms of `POST /images/uploads`.
+In AWS the s3 ObjectCreated notifications of the bucket invoke handle_s3_event, locally (or without notifications)
+an IngestPoller checks the waiting uploads instead.
+"""
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import unquote_plus
+
+from svc.controllers.images import ImagesController, UPLOAD_URL_EXPIRES_KEY
+from svc.models import entities
+from svc.utils.file_reader import get_file_reader
+
+POLLING_KEY = "INGEST_POLLING"
+POLL_INTERVAL_KEY = "INGEST_POLL_INTERVAL"
+POLL_BATCH_SIZE = 100
+
+_app = None
+
+
+def handle_s3_event(event, context):
+    """Lambda handler of the s3 ObjectCreated notifications"""
+    app = _get_app()
+    ingested = 0
+    for record in event.get("Records", []):
+        # notifications url encode the keys
+        ingested += ingest(app, unquote_plus(record["s3"]["object"]["key"]))
+    return {"ingested": ingested}
+
+
+def ingest(app, image_name):
+    """
+    Processes a directly uploaded image and records its results
+    :return: True if the image was waiting to be ingested
+    """
+    with app.app_context():
+        return ImagesController(app.config, "").ingest_uploaded_image(image_name) is not None
+
+
+def start_poller(app):
+    """Starts polling the waiting uploads when INGEST_POLLING is enabled"""
+    if not app.config.get(POLLING_KEY):
+        return None
+    poller = IngestPoller(app)
+    poller.start()
+    return poller
+
+
+class IngestPoller:
+    """Stand-in for the storage notifications, ingests the waiting uploads whose object exists"""
+
+    def __init__(self, app):
+        self._app = app
+        self._config = app.config
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ingest-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self._app.logger.error(e)
+            self._stop_event.wait(self._config.get(POLL_INTERVAL_KEY, 2))
+
+    def run_once(self):
+        """
+        Ingests the uploads whose object landed and fails the ones whose upload form expired
+        :return: the number of ingested images
+        """
+        ingested = 0
+        with self._app.app_context():
+            # ingesting ends the session of the nested app context, keep plain values
+            uploads = [
+                (upload.id, upload.path, upload.uploaded_at) for upload in entities.Images.get_uploads(POLL_BATCH_SIZE)
+            ]
+            reader = get_file_reader(self._config)
+            expired = datetime.utcnow() - timedelta(seconds=self._config.get(UPLOAD_URL_EXPIRES_KEY, 900))
+            for upload_id, image_name, uploaded_at in uploads:
+                if reader.exists(image_name):
+                    ingested += ingest(self._app, image_name)
+                elif uploaded_at < expired:
+                    entities.Images.complete_job(
+                        upload_id, {"errors": {"upload": "The upload form expired"}}, status=entities.FAILED
+                    )
+        return ingested
+
+
+def _get_app():
+    global _app
+    if _app is None:
+        from svc import cmdline
+        _app = cmdline.get_app()
+    return _app
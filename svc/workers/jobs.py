@@ -0,0 +1,73 @@
+import threading
+
+from svc.controllers.images import ImagesController, ASYNC_MODE, PROCESSING_MODE_KEY
+from svc.models import entities, similarity
+
+WORKERS_KEY = "JOB_WORKERS"
+POLL_INTERVAL_KEY = "JOB_POLL_INTERVAL"
+LEASE_SECONDS_KEY = "JOB_LEASE_SECONDS"
+
+
+def start_workers(app):
+    """Starts the local job workers when the app runs in async processing mode"""
+    if app.config.get(PROCESSING_MODE_KEY) != ASYNC_MODE:
+        return None
+    pool = JobWorkerPool(app)
+    pool.start()
+    return pool
+
+
+class JobWorkerPool:
+    """
+    Drains pending images jobs from the database.
+    The queue is the images table itself, so pending jobs survive restarts and can be shared by many processes.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._config = app.config
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self._config.get(WORKERS_KEY, 1)):
+            thread = threading.Thread(target=self._run, name="job-worker-{}".format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self.run_once():
+                self._stop_event.wait(self._config.get(POLL_INTERVAL_KEY, 1))
+
+    def run_once(self):
+        """
+        Claims and processes a single job
+        :return: True if a job was processed, False if the queue was empty
+        """
+        with self._app.app_context():
+            try:
+                job = entities.Images.claim_next_job(self._config.get(LEASE_SECONDS_KEY, 300))
+            except Exception as e:
+                self._app.logger.error(e)
+                return False
+            if job is None:
+                return False
+            self._process(job)
+            return True
+
+    def _process(self, job):
+        controller = ImagesController(self._config, "")
+        try:
+            result = controller.process_stored_image(job.path)
+        except Exception as e:
+            self._app.logger.error(e)
+            entities.Images.complete_job(job.id, {"errors": {"job": str(e)}}, status=entities.FAILED)
+            return
+        entities.Images.complete_job(job.id, result)
+        similarity.add_result(self._app, job.id, result)
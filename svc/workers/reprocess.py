@@ -0,0 +1,216 @@
+"""
+Backfills the results of the processors added to REGISTERED_TASKS, or whose VERSION was bumped, after images were
+processed: `python -m svc.cmdline reprocess`.
+The images are read from storage by a pool of workers, only the missing or outdated processors run, and the updated
+results are written in batches. After each batch the id of the last written image is saved in a checkpoint file,
+an interrupted run started again with the same options resumes after it.
+"""
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from svc import processors
+from svc.controllers.images import ImagesController
+from svc.models import entities, similarity
+
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CHECKPOINT = "reprocess_checkpoint.json"
+
+
+class CheckpointMismatch(Exception):
+    pass
+
+
+def get_outdated_tasks(result, tasks):
+    """
+    :param result: the stored result of an image
+    :return: the tasks whose result is missing, failed or was produced by an older VERSION
+    """
+    result = result or {}
+    versions = get_versions(result)
+    outdated = []
+    for task in tasks:
+        # results saved before versions were recorded come from the first version
+        recorded = versions.get(task.NAME, processors.DEFAULT_VERSION if task.NAME in result else None)
+        if recorded is None or recorded < processors.get_version(task):
+            outdated.append(task)
+    return outdated
+
+
+def get_versions(result):
+    """:return: dict of task NAME to the VERSION that produced its stored result"""
+    # results saved before meta kept the versions and the decode scale at the top level
+    return result.get("meta", {}).get("versions", result.get("versions", {}))
+
+
+def merge_results(result, update, tasks):
+    """
+    :param update: the result of running `tasks` again
+    :return: the stored result with the outputs, errors and versions of `tasks` replaced, in the meta layout
+    """
+    names = {task.NAME for task in tasks}
+    result = result or {}
+    merged = {
+        name: value for name, value in result.items()
+        if name not in names and name not in ("errors", "meta", "versions", "decode_scale")
+    }
+    merged.update({name: value for name, value in update.items() if name not in ("errors", "meta")})
+    errors = {name: value for name, value in result.get("errors", {}).items() if name not in names}
+    errors.update(update.get("errors", {}))
+    versions = {name: value for name, value in get_versions(result).items() if name not in names}
+    versions.update(update.get("meta", {}).get("versions", {}))
+    meta = {"versions": versions}
+    stored_scale = result.get("meta", {}).get("decode_scale", result.get("decode_scale"))
+    decode_scale = update.get("meta", {}).get("decode_scale", stored_scale)
+    if decode_scale is not None:
+        meta["decode_scale"] = decode_scale
+    merged.update(errors=errors, meta=meta)
+    return merged
+
+
+class Reprocessor:
+    """Runs the outdated processors of the stored images, see the module docstring"""
+
+    def __init__(self, app, tasks=None, filters=(), uploaded_after=None, uploaded_before=None, path_pattern=None,
+                 workers=DEFAULT_WORKERS, prefetch=None, batch_size=DEFAULT_BATCH_SIZE,
+                 checkpoint_path=DEFAULT_CHECKPOINT, log=None):
+        """
+        :param tasks: processors modules to bring up to date, defaults to all the registered ones
+        :param filters: list of (result name, operator, value) as in Images.search
+        :param path_pattern: optional sql LIKE pattern of the image names
+        :param prefetch: the maximum number of images read or processed ahead of the writes, defaults to 2 * workers
+        :param checkpoint_path: json file of the progress, None disables checkpointing
+        :param log: callable receiving progress messages
+        """
+        self._app = app
+        self._tasks = processors.REGISTERED_TASKS if tasks is None else tasks
+        self._filters = list(filters)
+        self._uploaded_after = uploaded_after
+        self._uploaded_before = uploaded_before
+        self._path_pattern = path_pattern
+        self._workers = workers
+        self._prefetch = prefetch or 2 * workers
+        self._batch_size = batch_size
+        self._checkpoint_path = checkpoint_path
+        self._log = log or app.logger.info
+        self.stats = {"last_id": 0, "scanned": 0, "updated": 0, "failed": 0, "skipped": 0}
+
+    def run(self, restart=False, dry_run=False):
+        """
+        :param restart: ignore the checkpoint of a previous run
+        :param dry_run: only count the images having outdated processors
+        :return: the run stats
+        """
+        if not restart and not dry_run:
+            self._load_checkpoint()
+        started = time.monotonic()
+        self._completed_id = None
+        with self._app.app_context(), ThreadPoolExecutor(self._workers, thread_name_prefix="reprocess") as pool:
+            pending = deque()
+            rows = []
+            for image_id, path, result in self._iter_images():
+                tasks = get_outdated_tasks(result, self._tasks)
+                future = pool.submit(self._process, path, tasks) if tasks and not dry_run else None
+                pending.append((image_id, result, tasks, future))
+                # bounded prefetch, the oldest image is written first so the checkpoint only moves forward
+                while len(pending) > self._prefetch or (pending and pending[0][3] is None):
+                    self._complete(pending.popleft(), rows)
+                if len(rows) >= self._batch_size:
+                    self._write(rows, dry_run)
+            while pending:
+                self._complete(pending.popleft(), rows)
+            self._write(rows, dry_run)
+        if not dry_run:
+            self._remove_checkpoint()
+        self._log("scanned {scanned} images in {seconds:.1f}s: {updated} {action}, {failed} failed, "
+                  "{skipped} up to date".format(
+                      seconds=time.monotonic() - started, action="to update" if dry_run else "updated", **self.stats
+                  ))
+        return self.stats
+
+    def _iter_images(self):
+        last_id = self.stats["last_id"]
+        while True:
+            # plain values, the session is committed by every batch write
+            images = [
+                (image.id, image.path, image.result) for image in entities.Images.get_processed_after(
+                    last_id, self._batch_size, self._filters, self._uploaded_after, self._uploaded_before,
+                    self._path_pattern,
+                )
+            ]
+            if not images:
+                return
+            yield from images
+            last_id = images[-1][0]
+
+    def _process(self, path, tasks):
+        with self._app.app_context():
+            return ImagesController(self._app.config, "").process_stored_image(path, tasks)
+
+    def _complete(self, item, rows):
+        image_id, result, tasks, future = item
+        self.stats["scanned"] += 1
+        if not tasks:
+            self.stats["skipped"] += 1
+        elif future is None:
+            # dry run
+            self.stats["updated"] += 1
+        else:
+            try:
+                rows.append({"id": image_id, "result": merge_results(result, future.result(), tasks)})
+                self.stats["updated"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                self._log("image {} failed: {}".format(image_id, e))
+        self._completed_id = image_id
+
+    def _write(self, rows, dry_run):
+        if dry_run:
+            rows.clear()
+            return
+        entities.Images.update_results(rows)
+        for row in rows:
+            similarity.add_result(self._app, row["id"], row["result"])
+        rows.clear()
+        # every image up to the last completed one is written or didn't need an update
+        if self._completed_id is not None:
+            self.stats["last_id"] = self._completed_id
+        self._save_checkpoint()
+        self._log("written up to image {last_id}: {updated} updated, {failed} failed".format(**self.stats))
+
+    def _get_options(self):
+        return {
+            "tasks": sorted(task.NAME for task in self._tasks),
+            "filters": [list(image_filter) for image_filter in self._filters],
+            "uploaded_after": self._uploaded_after.isoformat() if self._uploaded_after else None,
+            "uploaded_before": self._uploaded_before.isoformat() if self._uploaded_before else None,
+            "path_pattern": self._path_pattern,
+        }
+
+    def _load_checkpoint(self):
+        if not self._checkpoint_path or not os.path.exists(self._checkpoint_path):
+            return
+        with open(self._checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint["options"] != self._get_options():
+            raise CheckpointMismatch(
+                "{} was written by a run with other options, remove it or restart".format(self._checkpoint_path)
+            )
+        self.stats.update(checkpoint["stats"])
+        self._log("resuming after image {}".format(self.stats["last_id"]))
+
+    def _save_checkpoint(self):
+        if not self._checkpoint_path:
+            return
+        # written aside then renamed, an interruption never leaves a truncated checkpoint
+        temporary_path = self._checkpoint_path + ".tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump({"options": self._get_options(), "stats": self.stats}, checkpoint_file)
+        os.replace(temporary_path, self._checkpoint_path)
+
+    def _remove_checkpoint(self):
+        if self._checkpoint_path and os.path.exists(self._checkpoint_path):
+            os.remove(self._checkpoint_path)
@@ -1,13 +1,23 @@
+import hashlib
+import threading
 from datetime import datetime
 import unittest
+import zipfile
+from concurrent.futures import TimeoutError
 from io import BytesIO
 from unittest.mock import Mock, patch
 
+from flask import Flask
+from PIL import Image as PILImage
+
 from svc.models.entities import Images
 
-from werkzeug.exceptions import BadRequest
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import BadRequest, NotFound, ServiceUnavailable
 
 from svc.controllers.images import ImagesController
+from svc.utils.image_context import ImageContext
+from svc.utils.intermediates import Provider
 from svc.utils.file_reader import BaseFileReader
 from svc.utils.file_writer import BaseFileWriter
 
@@ -24,6 +34,25 @@ class TestImagesController(unittest.TestCase):
         self.controller.view_image(self.image_name)
         self.controller.reader.get_response.assert_called_once_with(self.image_name)
 
+    def test_view_image_returns_stored_derivative(self):
+        self.controller.reader.read.return_value = b"derivative"
+        with Flask(__name__).test_request_context():
+            response = self.controller.view_image("stored.png", {"width": "10", "format": "png"})
+            self.assertEqual(response.get_data(), b"derivative")
+            self.assertEqual(response.mimetype, "image/png")
+        self.controller.reader.read.assert_called_once_with("stored.png__10x_contain_q85.png")
+        self.controller.writer.save.assert_not_called()
+
+    def test_view_image_generates_and_saves_missing_derivative(self):
+        original = BytesIO()
+        PILImage.new("RGB", (20, 20)).save(original, format="png")
+        self.controller.reader.read.side_effect = [NotFound(), original.getvalue()]
+        with Flask(__name__).test_request_context():
+            response = self.controller.view_image("generated.png", {"width": "10", "format": "png"})
+            self.assertEqual(PILImage.open(BytesIO(response.get_data())).size, (10, 10))
+        self.controller.writer.save.assert_called_once()
+        self.assertEqual(self.controller.writer.save.call_args[0][1], "generated.png__10x_contain_q85.png")
+
     def test_post_images_raises_bad_request_error_if_file_is_empty(self):
         self._assert_raise_bad_request(None)
 
@@ -41,6 +70,40 @@ class TestImagesController(unittest.TestCase):
         self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"]})
         self._assert_raise_bad_request(file_obj)
 
+    def test_post_images_rejects_files_which_are_not_images(self):
+        file_obj = FileObjDouble("image.png", "image/png")
+        file_obj.stream = BytesIO(b"<html></html>")
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"]})
+        self._assert_raise_bad_request(file_obj)
+        self.controller.writer.save.assert_not_called()
+
+    def test_post_images_rejects_misnamed_images(self):
+        stream = BytesIO()
+        PILImage.new("RGB", (2, 2)).save(stream, format="jpeg")
+        file_obj = FileObjDouble("image.png", "image/png")
+        file_obj.stream = stream
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png", "jpeg"]})
+        with self.assertRaises(BadRequest) as context:
+            self.controller.post_image(file_obj)
+        self.assertEqual(context.exception.details, "The uploaded file is a jpeg image but was sent as image/png")
+
+    def test_post_images_rejects_images_over_the_size_limits_from_their_header(self):
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "MAX_IMAGE_PIXELS": 100})
+        file_obj = FileObjDouble("image.png", "image/png")
+        file_obj.stream = BytesIO(get_png((20, 10)))
+        self._assert_raise_bad_request(file_obj)
+        self.controller._config.update({"MAX_IMAGE_PIXELS": None, "MAX_IMAGE_DIMENSION": 16})
+        self._assert_raise_bad_request(file_obj)
+        self.controller.writer.save.assert_not_called()
+
+    def test_create_upload_validates_without_content(self):
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"]})
+        self.controller.writer.get_upload_form.return_value = {}
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.create_job.return_value.id = 1
+            entities_mock.Images.create_job.return_value.status = "uploading"
+            self.assertEqual(self.controller.create_upload("a.png", "image/png")["upload"], {})
+
     @patch("svc.controllers.images.processors")
     def test_post_images_returns_valid_results(self, mock_processors):
         mock_processors.REGISTERED_TASKS = []
@@ -51,6 +114,194 @@ class TestImagesController(unittest.TestCase):
             self.controller.writer.save.assert_called_once()
             entities_mock.Images.save_results.assert_called_once()
 
+    @patch("svc.controllers.images.processors")
+    def test_post_images_reuses_results_of_duplicate_upload(self, mock_processors):
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "DEDUPLICATE_UPLOADS": True})
+        file_obj = FileObjDouble("image.png", "images/png")
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.find_by_hash.return_value = Images(path="old_image.png", result={"task": 1})
+            result = self.controller.post_image(file_obj)
+            self.controller.writer.save.assert_not_called()
+            entities_mock.Images.save_results.assert_not_called()
+            self.assertEqual(result["image"], "old_image.png")
+            self.assertEqual(result["result"], {"task": 1})
+            self.assertTrue(result["cached"])
+
+    @patch("svc.controllers.images.processors")
+    def test_post_images_saves_content_hash_of_new_upload(self, mock_processors):
+        mock_processors.REGISTERED_TASKS = []
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "DEDUPLICATE_UPLOADS": True})
+        file_obj = FileObjDouble("image.png", "images/png")
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.find_by_hash.return_value = None
+            result = self.controller.post_image(file_obj)
+            self.controller.writer.save.assert_called_once()
+            content_hash = entities_mock.Images.save_results.call_args[0][2]
+            self.assertEqual(content_hash, hashlib.sha256(file_obj.stream.getvalue()).hexdigest())
+            self.assertFalse(result["cached"])
+
+    def test_post_images_stores_image_while_processing(self):
+        processing_started = threading.Event()
+        self.controller.writer.save.side_effect = lambda image_obj, name: self.assertTrue(processing_started.wait(5))
+        task = ContextTaskDouble("task")
+        task.execute = lambda context: processing_started.set()
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"]})
+        with patch("svc.controllers.images.processors") as processors, \
+                patch("svc.controllers.images.entities") as entities_mock:
+            processors.REGISTERED_TASKS = [task]
+            self.controller.post_image(FileObjDouble("test.png", "image/png"))
+            entities_mock.Images.save_results.assert_called_once()
+
+    @patch("svc.controllers.images.processors")
+    def test_post_images_fails_without_saving_results_if_storage_fails(self, mock_processors):
+        mock_processors.REGISTERED_TASKS = []
+        self.controller.writer.save.side_effect = IOError("disk full")
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"]})
+        with Flask(__name__).app_context(), patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.find_by_hash.return_value = None
+            with self.assertRaises(ServiceUnavailable) as context:
+                self.controller.post_image(FileObjDouble("test.png", "image/png"))
+            self.assertEqual(context.exception.details, "disk full")
+            entities_mock.Images.save_results.assert_not_called()
+
+    def test_save_results_waits_for_group_commit_when_enabled(self):
+        self.controller._config.update({"RESULTS_GROUP_COMMIT": True})
+        with Flask(__name__).app_context(), \
+                patch("svc.controllers.images.group_commit.get_writer") as get_writer_mock, \
+                patch("svc.controllers.images.entities") as entities_mock:
+            self.controller._save_results("a.png", {"value": 1}, "hash")
+            get_writer_mock.return_value.save.assert_called_once_with(
+                {"path": "a.png", "result": {"value": 1}, "content_hash": "hash"}
+            )
+            entities_mock.Images.save_results.assert_not_called()
+
+    def test_save_results_returns_service_unavailable_when_the_commit_times_out(self):
+        self.controller._config.update({"RESULTS_GROUP_COMMIT": True, "RESULTS_GROUP_COMMIT_ACK_TIMEOUT": 10})
+        with Flask(__name__).app_context(), \
+                patch("svc.controllers.images.group_commit.get_writer") as get_writer_mock:
+            get_writer_mock.return_value.save.side_effect = TimeoutError()
+            with self.assertRaises(ServiceUnavailable) as context:
+                self.controller._save_results("a.png", {"value": 1}, "hash")
+            self.assertEqual(context.exception.details, "Not committed after 10s, they may still be saved")
+
+    def test_save_results_saves_directly_when_no_group_commit_writer_is_started(self):
+        self.controller._config.update({"RESULTS_GROUP_COMMIT": True})
+        with Flask(__name__).app_context(), patch("svc.controllers.images.entities") as entities_mock:
+            self.controller._save_results("a.png", {"value": 1}, "hash")
+            entities_mock.Images.save_results.assert_called_once_with("a.png", {"value": 1}, "hash")
+
+    @patch("svc.controllers.images.processors")
+    def test_post_batch_saves_all_results_in_one_bulk_insert(self, mock_processors):
+        mock_processors.REGISTERED_TASKS = []
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "BATCH_MAX_WORKERS": 2})
+        file_objs = [FileObjDouble("a.png", "images/png"), FileObjDouble("b.png", "images/png")]
+        file_objs[1].stream = BytesIO(get_png(color=255))
+        with patch("svc.controllers.images.entities") as entities_mock:
+            results = self.controller.post_batch(file_objs)
+            entities_mock.Images.save_many.assert_called_once()
+            self.assertEqual(len(entities_mock.Images.save_many.call_args[0][0]), 2)
+            self.assertEqual(self.controller.writer.save.call_count, 2)
+            self.assertEqual([result["cached"] for result in results], [False, False])
+
+    @patch("svc.controllers.images.processors")
+    def test_post_batch_reports_errors_per_file(self, mock_processors):
+        mock_processors.REGISTERED_TASKS = []
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "BATCH_MAX_WORKERS": 2})
+        file_objs = [FileObjDouble("a.png", "images/png"), FileObjDouble("b.gif", "images/gif")]
+        with patch("svc.controllers.images.entities"):
+            results = self.controller.post_batch(file_objs)
+            self.assertIn("result", results[0])
+            self.assertEqual(results[1]["image"], "b.gif")
+            self.assertIn("error", results[1])
+
+    @patch("svc.controllers.images.processors")
+    def test_post_batch_processes_identical_files_once(self, mock_processors):
+        mock_processors.REGISTERED_TASKS = []
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "BATCH_MAX_WORKERS": 2})
+        file_objs = [FileObjDouble("a.png", "images/png"), FileObjDouble("b.png", "images/png")]
+        with patch("svc.controllers.images.entities") as entities_mock:
+            results = self.controller.post_batch(file_objs)
+            self.controller.writer.save.assert_called_once()
+            self.assertEqual(len(entities_mock.Images.save_many.call_args[0][0]), 1)
+            self.assertEqual(results[1]["image"], results[0]["image"])
+            self.assertTrue(results[1]["cached"])
+
+    @patch("svc.controllers.images.processors")
+    def test_post_batch_reports_storage_failures_without_app_context(self, mock_processors):
+        mock_processors.REGISTERED_TASKS = []
+        self.controller.writer.save.side_effect = IOError("disk full")
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"], "BATCH_MAX_WORKERS": 2})
+        file_objs = [FileObjDouble("a.png", "images/png"), FileObjDouble("b.png", "images/png")]
+        file_objs[1].stream = BytesIO(get_png(color=255))
+        with patch("svc.controllers.images.entities") as entities_mock:
+            results = self.controller.post_batch(file_objs)
+            self.assertEqual(entities_mock.Images.save_many.call_args[0][0], [])
+        for result in results:
+            self.assertEqual(result["error"], "The image could not be stored")
+            self.assertEqual(result["details"], "disk full")
+
+    def test_post_batch_raises_bad_request_if_too_many_files(self):
+        self.controller._config.update({"BATCH_MAX_FILES": 1})
+        with self.assertRaises(BadRequest):
+            self.controller.post_batch([FileObjDouble("a.png"), FileObjDouble("b.png")])
+
+    def test_post_batch_stops_reading_the_archive_past_the_max_files(self):
+        self.controller._config.update({"BATCH_MAX_FILES": 2})
+        read = []
+
+        def iter_archive_double(archive_obj, max_file_size, max_total_size):
+            for name in ("a.png", "b.png", "c.png", "d.png", "e.png"):
+                read.append(name)
+                yield FileObjDouble(name)
+
+        with patch("svc.controllers.images.iter_archive", iter_archive_double):
+            with self.assertRaises(BadRequest):
+                self.controller.post_batch([], FileObjDouble("images.zip"))
+        self.assertEqual(read, ["a.png", "b.png", "c.png"])
+
+    def test_post_batch_raises_bad_request_if_archive_files_are_too_large(self):
+        self.controller._config.update({"MAX_CONTENT_LENGTH": 100})
+        archive_obj = FileObjDouble("images.zip")
+        archive_obj.stream = BytesIO()
+        with zipfile.ZipFile(archive_obj.stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("bomb.png", b"\0" * 10000)
+        with self.assertRaises(BadRequest) as context:
+            self.controller.post_batch([], archive_obj)
+        self.assertIn("larger than 100 bytes", context.exception.details)
+
+    def test_is_async_when_processing_mode_is_async(self):
+        self.assertFalse(self.controller.is_async())
+        self.controller._config.update({"PROCESSING_MODE": "async"})
+        self.assertTrue(self.controller.is_async())
+
+    def test_submit_image_creates_pending_job_without_processing(self):
+        self.controller._config.update({"ALLOWED_IMAGES_EXTENSIONS": ["png"]})
+        file_obj = FileObjDouble("image.png", "images/png")
+        with patch("svc.controllers.images.entities") as entities_mock, \
+                patch.object(self.controller, "_process_image") as mock_process:
+            entities_mock.Images.create_job.return_value = Images(id=7, path="x_image.png", status="pending")
+            result = self.controller.submit_image(file_obj)
+            self.controller.writer.save.assert_called_once()
+            mock_process.assert_not_called()
+            self.assertEqual(result["job_id"], 7)
+            self.assertEqual(result["status"], "pending")
+            self.assertEqual(result["status_url"], "http://localhost/jobs/7")
+
+    def test_get_job_raises_not_found_if_job_does_not_exist(self):
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.get_job.return_value = None
+            with self.assertRaises(NotFound):
+                self.controller.get_job(1)
+
+    def test_process_stored_image_reads_image_from_storage(self):
+        self.controller.reader.read.return_value = b"content"
+        with patch.object(self.controller, "_process_image") as mock_process:
+            self.controller.process_stored_image("image.png")
+            self.controller.reader.read.assert_called_once_with("image.png")
+            image_obj = mock_process.call_args[0][0]
+            self.assertEqual(image_obj.filename, "image.png")
+            self.assertEqual(image_obj.stream.read(), b"content")
+
     def test_get_history_returns_empty_list_if_no_results(self):
         with patch("svc.controllers.images.entities") as entities_mock:
             entities_mock.Images.get_history.return_value = []
@@ -64,6 +315,50 @@ class TestImagesController(unittest.TestCase):
             result = self.controller.get_history(1, 20)
             self.assertEqual(len(result), 10)
 
+    def test_get_history_page_returns_next_cursor_if_more_results(self):
+        results = [Images(id=i, path="test.png", result={}, uploaded_at=datetime(2020, 1, 1)) for i in range(3)]
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.get_history_after.return_value = results
+            page = self.controller.get_history_page("", 2)
+            entities_mock.Images.get_history_after.assert_called_once_with(None, 3)
+            self.assertEqual(len(page["items"]), 2)
+            self.assertIsNotNone(page["next"])
+
+            self.controller.get_history_page(page["next"], 2)
+            entities_mock.Images.get_history_after.assert_called_with((datetime(2020, 1, 1), 1), 3)
+
+    def test_get_history_page_returns_no_cursor_on_last_page(self):
+        results = [Images(id=1, path="test.png", result={}, uploaded_at=datetime.utcnow())]
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.get_history_after.return_value = results
+            page = self.controller.get_history_page(None, 2)
+            self.assertIsNone(page["next"])
+
+    def test_get_history_page_raises_bad_request_if_cursor_is_invalid(self):
+        with self.assertRaises(BadRequest):
+            self.controller.get_history_page("invalid", 2)
+
+    def test_search_history_parses_filters_and_dates(self):
+        with patch("svc.controllers.images.entities") as entities_mock:
+            entities_mock.Images.search.return_value = []
+            self.controller.search_history(
+                ["Average Pixel Value>=100", "Stats.channels.R.mean < -1.5e2"], "-Average Pixel Value",
+                "2020-01-01T02:00:00+02:00", None, "2", "10"
+            )
+            entities_mock.Images.search.assert_called_once_with(
+                [("Average Pixel Value", ">=", 100.0), ("Stats.channels.R.mean", "<", -150.0)],
+                "-Average Pixel Value", datetime(2020, 1, 1), None, 2, 10
+            )
+
+    def test_search_history_raises_bad_request_if_filter_is_invalid(self):
+        for filters in (["Average Pixel Value"], ["value>abc"], ["v>1"] * 6):
+            with self.assertRaises(BadRequest):
+                self.controller.search_history(filters)
+
+    def test_search_history_raises_bad_request_if_date_is_invalid(self):
+        with self.assertRaises(BadRequest):
+            self.controller.search_history([], uploaded_after="yesterday")
+
     def test_process_images_returns_valid_results(self):
         task1 = TaskDouble("task1", raises_exception=False)
         task2 = TaskDouble("task2", raises_exception=True)
@@ -72,10 +367,72 @@ class TestImagesController(unittest.TestCase):
             results = self.controller._process_image(FileObjDouble("test.png"))
             expected = {
                 "task1": {"value": 10},
-                "errors": {"task2": "Unknown Error"}
+                "errors": {"task2": "Unknown Error"},
+                "meta": {"versions": {"task1": 1}},
             }
             self.assertDictEqual(results, expected)
 
+    def test_process_images_passes_shared_context_to_context_tasks(self):
+        task1 = ContextTaskDouble("task1")
+        task2 = ContextTaskDouble("task2")
+        with patch("svc.controllers.images.processors") as processors:
+            processors.REGISTERED_TASKS = [task1, task2]
+            self.controller._process_image(FileObjDouble("test.png"))
+            self.assertIsInstance(task1.received, ImageContext)
+            self.assertIs(task1.received, task2.received)
+
+    def test_process_images_passes_raw_upload_to_old_style_tasks(self):
+        task = ContextTaskDouble("task")
+        task.ACCEPTS_CONTEXT = False
+        file_obj = FileObjDouble("test.png")
+        with patch("svc.controllers.images.processors") as processors:
+            processors.REGISTERED_TASKS = [task]
+            self.controller._process_image(file_obj)
+            self.assertIsInstance(task.received, FileStorage)
+            self.assertEqual(task.received.filename, "test.png")
+
+    def test_process_images_uses_smallest_decode_scale_accepted_by_tasks(self):
+        task1 = ContextTaskDouble("task1")
+        task1.MAX_DECODE_SCALE = 8
+        task2 = ContextTaskDouble("task2")
+        task2.MAX_DECODE_SCALE = 2
+        self.controller._config.update({"PROCESSING_DRAFT_DECODE": True})
+        self.assertEqual(self.controller._get_decode_scale([task1, task2]), 2)
+        self.assertEqual(self.controller._get_decode_scale([task1, ContextTaskDouble("task3")]), 1)
+        self.controller._config.update({"PROCESSING_DRAFT_DECODE": False})
+        self.assertEqual(self.controller._get_decode_scale([task1]), 1)
+
+    def test_process_images_reports_reduced_decode_scale(self):
+        stream = BytesIO()
+        PILImage.new('RGB', (800, 600)).save(stream, format='jpeg')
+        file_obj = FileObjDouble("test.jpg")
+        file_obj.stream = stream
+        task = ContextTaskDouble("task")
+        task.MAX_DECODE_SCALE = 4
+        task.execute = lambda context: context.image.width
+        self.controller._config.update({"PROCESSING_DRAFT_DECODE": True})
+        with patch("svc.controllers.images.processors") as processors:
+            processors.REGISTERED_TASKS = [task]
+            results = self.controller._process_image(file_obj)
+            self.assertDictEqual(results, {
+                "task": 200, "errors": {}, "meta": {"versions": {"task": 1}, "decode_scale": 0.25}
+            })
+
+    def test_process_images_reports_failed_intermediate_for_dependent_tasks(self):
+        task1 = ContextTaskDouble("task1")
+        task1.REQUIRES = ("failing",)
+        task1.PROVIDES = [Provider("failing", Mock(side_effect=ValueError("broken")))]
+        task2 = ContextTaskDouble("task2")
+        with patch("svc.controllers.images.processors") as processors:
+            processors.REGISTERED_TASKS = [task1, task2]
+            results = self.controller._process_image(FileObjDouble("test.png"))
+            self.assertIsNone(task1.received)
+            self.assertDictEqual(results, {
+                "task2": {"value": 10},
+                "errors": {"task1": "Intermediate failing failed: broken"},
+                "meta": {"versions": {"task2": 1}},
+            })
+
     def _assert_raise_bad_request(self, file_obj):
         with self.assertRaises(BadRequest):
             self.controller.post_image(file_obj)
@@ -98,7 +455,13 @@ class FileObjDouble:
     def __init__(self, name, mimetype=None):
         self.filename = name
         self.mimetype = mimetype
-        self.stream = BytesIO()
+        self.stream = BytesIO(get_png())
+
+
+def get_png(size=(2, 2), color=0):
+    stream = BytesIO()
+    PILImage.new("L", size, color).save(stream, format="png")
+    return stream.getvalue()
 
 
 class TaskDouble:
@@ -110,3 +473,15 @@ class TaskDouble:
         if self.raises_exception:
             raise Exception("Unknown Error")
         return {"value": 10}
+
+
+class ContextTaskDouble:
+    ACCEPTS_CONTEXT = True
+
+    def __init__(self, name):
+        self.NAME = name
+        self.received = None
+
+    def execute(self, image_obj):
+        self.received = image_obj
+        return {"value": 10}
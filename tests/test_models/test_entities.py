@@ -0,0 +1,169 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from svc.app import create_app, init_db
+from svc.models import entities
+from svc.models.entities import db, Images, ImageResults, get_numeric_outputs
+
+
+class TestImageResults(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "lcl",
+        })
+        init_db(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.drop_all()
+        self.context.pop()
+
+    def test_get_numeric_outputs_flattens_nested_numbers(self):
+        result = {
+            "Average Pixel Value": 10,
+            "Stats": {"channels": {"R": {"mean": 1.5, "min": None}}, "mode": "RGB", "flag": True},
+            "errors": {"other": 1},
+            "meta": {"versions": {"Average Pixel Value": 1}, "decode_scale": 0.25},
+        }
+        self.assertDictEqual(get_numeric_outputs(result), {"Average Pixel Value": 10.0, "Stats.channels.R.mean": 1.5})
+
+    def test_save_results_indexes_numeric_outputs(self):
+        Images.save_results("a.png", {"Average Pixel Value": 10, "errors": {}})
+        rows = [(row.name, row.value) for row in ImageResults.query.all()]
+        self.assertEqual(rows, [("Average Pixel Value", 10.0)])
+
+    def test_save_many_indexes_every_image(self):
+        Images.save_many([
+            {"path": "a.png", "result": {"value": 1}, "content_hash": None},
+            {"path": "b.png", "result": {"value": 2}, "content_hash": None},
+        ])
+        self.assertEqual(self._search([("value", ">", 1)]), ["b.png"])
+
+    def test_save_many_inserts_the_images_in_one_statement(self):
+        statements = []
+
+        def count_inserts(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("INSERT INTO images"):
+                statements.append(executemany)
+
+        event.listen(db.engine, "before_cursor_execute", count_inserts)
+        try:
+            image_ids = Images.save_many([
+                {"path": "a.png" if i % 2 else "{}.png".format(i), "result": {"value": i}, "content_hash": None}
+                for i in range(50)
+            ])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_inserts)
+        self.assertEqual(statements, [True])
+        saved = Images.get_many(image_ids)
+        self.assertEqual([saved[image_id].result["value"] for image_id in image_ids], list(range(50)))
+
+    def test_save_many_ignores_the_same_path_inserted_concurrently(self):
+        bulk_insert_mappings = db.session.bulk_insert_mappings
+
+        def insert_concurrently(mapper, rows):
+            if mapper is Images:
+                # committed by another request between the bulk insert and the ids lookup
+                db.session.execute(Images.__table__.insert().values(path="a.png", result={"value": -1}))
+            bulk_insert_mappings(mapper, rows)
+
+        with patch.object(db.session, "bulk_insert_mappings", side_effect=insert_concurrently):
+            image_ids = Images.save_many([
+                {"path": "a.png", "result": {"value": 1}, "content_hash": None},
+                {"path": "a.png", "result": {"value": 2}, "content_hash": None},
+            ])
+        saved = Images.get_many(image_ids)
+        self.assertEqual([saved[image_id].result["value"] for image_id in image_ids], [1, 2])
+
+    def test_complete_job_replaces_indexed_outputs(self):
+        job = Images.create_job("a.png")
+        Images.complete_job(job.id, {"value": 5})
+        Images.complete_job(job.id, {"value": 7})
+        self.assertEqual([row.value for row in ImageResults.query.all()], [7.0])
+
+    def test_search_filters_and_sorts_on_results(self):
+        for i, value in enumerate([30, 10, 20]):
+            Images.save_results("{}.png".format(i), {"value": value, "other": i})
+        self.assertEqual(self._search([("value", ">=", 20)], sort="value"), ["2.png", "0.png"])
+        self.assertEqual(self._search([("value", "<", 30), ("other", "=", 1)]), ["1.png"])
+        self.assertEqual(self._search([], sort="-value"), ["0.png", "2.png", "1.png"])
+
+    def test_search_filters_on_upload_time(self):
+        Images.save_results("old.png", {"value": 1})
+        Images.query.update({Images.uploaded_at: datetime(2020, 1, 1)})
+        Images.save_results("new.png", {"value": 1})
+        self.assertEqual(self._search([], uploaded_after=datetime(2021, 1, 1)), ["new.png"])
+        self.assertEqual(self._search([], uploaded_before=datetime(2021, 1, 1)), ["old.png"])
+
+    def test_search_uses_results_index(self):
+        plan = self._explain(Images._search_query([("value", ">", 1), ("other", "<", 5)], None, None, None, 1, 20))
+        self.assertIn("USING COVERING INDEX ix_image_results_name_value (name=? AND value>?)", plan)
+        # sorted on a filtered result, the index is read in order instead of sorting the matching rows
+        plan = self._explain(Images._search_query([("value", ">", 1)], "-value", None, None, 1, 20))
+        self.assertIn("ix_image_results_name_value", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_backfill_indexes_results_saved_without_index(self):
+        db.session.bulk_insert_mappings(Images, [{"path": "a.png", "result": {"value": 3}, "status": entities.DONE}])
+        db.session.commit()
+        self.assertEqual(ImageResults.backfill(), 1)
+        self.assertEqual(self._search([("value", "=", 3)]), ["a.png"])
+        self.assertEqual(ImageResults.backfill(), 0)
+
+    @staticmethod
+    def _explain(query):
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        parameters = [compiled.params[name] for name in compiled.positiontup]
+        rows = db.session.connection().execute("EXPLAIN QUERY PLAN " + str(compiled), *parameters)
+        return " ".join(str(row) for row in rows)
+
+    @staticmethod
+    def _search(filters, **kwargs):
+        return [image.path for image in Images.search(filters, **kwargs)]
+
+
+class TestAddMissingColumns(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "lcl",
+        })
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.drop_all()
+        self.context.pop()
+
+    def test_init_db_adds_columns_and_indexes_of_existing_tables(self):
+        db.session.execute("CREATE TABLE images (id INTEGER PRIMARY KEY, path VARCHAR(128) NOT NULL, result JSON, "
+                           "uploaded_at DATETIME NOT NULL, status VARCHAR(16) NOT NULL, claimed_at DATETIME, "
+                           "content_hash VARCHAR(64))")
+        db.session.execute("INSERT INTO images (path, result, uploaded_at, status) "
+                           "VALUES ('a.png', '{}', '2020-01-01 00:00:00', 'done')")
+        db.session.commit()
+        init_db(self.app)
+        self.assertIsNone(Images.find_by_path("a.png").perceptual_hash)
+        self.assertEqual(entities.add_missing_columns(), [])
+        indexes = [row[1] for row in db.session.execute("PRAGMA index_list(images)")]
+        self.assertIn("ix_images_perceptual_hash", indexes)
+        self.assertIn("ix_images_path", indexes)
+
+    def test_init_db_upgrades_the_baseline_schema(self):
+        db.session.execute("CREATE TABLE images (id INTEGER PRIMARY KEY, path VARCHAR(128) NOT NULL, result JSON, "
+                           "uploaded_at DATETIME NOT NULL)")
+        db.session.execute("INSERT INTO images (path, result, uploaded_at) "
+                           "VALUES ('a.png', '{\"Average Pixel Value\": 10}', '2020-01-01 00:00:00')")
+        db.session.commit()
+        init_db(self.app)
+        image = Images.find_by_path("a.png")
+        self.assertEqual(image.status, entities.DONE)
+        self.assertEqual(ImageResults.query.filter_by(image_id=image.id).one().value, 10.0)
+        self.assertEqual(entities.add_missing_columns(), [])
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from svc.app import create_app, init_db
+from svc.models import group_commit
+from svc.models.entities import db, Images
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(self.directory, "test.db"),
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "lcl",
+            "RESULTS_GROUP_COMMIT": True,
+            "RESULTS_GROUP_COMMIT_MAX_ROWS": 50,
+            "RESULTS_GROUP_COMMIT_MAX_DELAY": 0.2,
+            "SQLITE_PRAGMAS": {"journal_mode": "WAL", "busy_timeout": 5000},
+        })
+        init_db(self.app)
+        self.writer = group_commit.get_writer(self.app)
+
+    def tearDown(self):
+        self.writer.stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine().dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_start_writer_does_nothing_if_disabled(self):
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://", "SQLALCHEMY_TRACK_MODIFICATIONS": False})
+        self.assertIsNone(group_commit.get_writer(app))
+
+    def test_concurrent_rows_are_committed_in_groups(self):
+        rows = [{"path": "{}.png".format(i), "result": {"value": i}, "content_hash": None} for i in range(20)]
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            image_ids = list(pool.map(self.writer.save, rows))
+        self.assertEqual(sum(self.writer.group_sizes), 20)
+        self.assertLess(len(self.writer.group_sizes), 20)
+        with self.app.app_context():
+            self.assertEqual(Images.query.count(), 20)
+            self.assertEqual(len(Images.search([("value", ">=", 10)])), 10)
+            self.assertEqual([Images.query.get(image_id).path for image_id in image_ids], [row["path"] for row in rows])
+
+    def test_invalid_row_only_fails_its_own_request(self):
+        futures = [
+            self.writer.submit({"path": "a.png", "result": {}, "content_hash": None}),
+            self.writer.submit({"path": None, "result": {}, "content_hash": None}),
+        ]
+        self.assertTrue(futures[0].result(5))
+        with self.assertRaises(Exception):
+            futures[1].result(5)
+        with self.app.app_context():
+            self.assertEqual([image.path for image in Images.query.all()], ["a.png"])
+
+    def test_save_times_out_but_the_row_is_still_committed(self):
+        self.writer._ack_timeout = 0.01
+        with self.assertRaises(TimeoutError):
+            self.writer.save({"path": "a.png", "result": {}, "content_hash": None})
+        self.writer.stop()
+        with self.app.app_context():
+            self.assertEqual([image.path for image in Images.query.all()], ["a.png"])
+
+    def test_sqlite_pragmas_are_applied(self):
+        with self.app.app_context():
+            self.assertEqual(db.session.execute("PRAGMA journal_mode").scalar(), "wal")
+            self.assertEqual(db.session.execute("PRAGMA busy_timeout").scalar(), 5000)
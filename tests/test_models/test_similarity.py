@@ -0,0 +1,123 @@
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.s3_standin import S3StandIn
+from svc.app import create_app, init_db
+from svc.models import similarity
+from svc.models.entities import db, Images
+
+
+def get_upload(seed, size=(160, 120), image_format="png"):
+    width, height = size
+    x = np.linspace(0, 255, width)[None, :]
+    y = np.linspace(0, 255, height)[:, None]
+    phase = np.random.RandomState(seed).uniform(0, 6, 2)
+    pixels = 127 + 100 * np.sin(x / 40 + phase[0]) * np.cos(y / 30 + phase[1])
+    stream = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(stream, image_format)
+    stream.seek(0)
+    return stream
+
+
+class TestSimilarImages(unittest.TestCase):
+    def setUp(self):
+        self.s3 = S3StandIn()
+        self.patches = [
+            patch("svc.utils.file_reader.get_s3_client", return_value=self.s3),
+            patch("svc.utils.file_writer.get_s3_client", return_value=self.s3),
+        ]
+        for p in self.patches:
+            p.start()
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "s3",
+            "S3_BUCKET_NAME": "bucket",
+            "ALLOWED_IMAGES_EXTENSIONS": ["png", "jpeg"],
+        })
+        init_db(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+        for p in self.patches:
+            p.stop()
+
+    def test_similar_returns_near_duplicates_closest_first(self):
+        original = self._upload(get_upload(0), "a.png")
+        copy = self._upload(get_upload(0, (320, 240), "jpeg"), "b.jpg")
+        self._upload(get_upload(7), "c.png")
+        response = self.client.get("/images/{}/similar?distance=6".format(original))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([image["image_name"] for image in response.get_json()], [copy])
+        self.assertLessEqual(response.get_json()[0]["distance"], 6)
+
+    def test_index_is_loaded_on_first_search_then_updated_by_uploads(self):
+        first = self._upload(get_upload(0), "a.png")
+        index = similarity.get_index(self.app)
+        self.assertFalse(index.is_loaded)
+        self.assertEqual(self.client.get("/images/{}/similar".format(first)).get_json(), [])
+        self.assertTrue(index.is_loaded)
+        second = self._upload(get_upload(0, (320, 240)), "b.png")
+        names = [image["image_name"] for image in self.client.get("/images/{}/similar".format(first)).get_json()]
+        self.assertEqual(names, [second])
+
+    def test_search_reads_the_images_saved_by_other_processes_after_the_refresh_interval(self):
+        first = self._upload(get_upload(0), "a.png")
+        index = similarity.get_index(self.app)
+        self.assertEqual(self.client.get("/images/{}/similar".format(first)).get_json(), [])
+        with self.app.app_context():
+            first_hash = Images.find_by_path(first).perceptual_hash
+            # saved without going through this app index, as another worker or the ingest would
+            Images.save_results("other.png", {"Perceptual Hash": first_hash})
+        self.assertEqual(self.client.get("/images/{}/similar".format(first)).get_json(), [])
+        index._refresh_interval = 0
+        names = [image["image_name"] for image in self.client.get("/images/{}/similar".format(first)).get_json()]
+        self.assertEqual(names, ["other.png"])
+
+    def test_search_reads_the_hashes_updated_by_other_processes_after_the_refresh_interval(self):
+        with self.app.app_context():
+            image_id = Images.save_results("old.png", {"Average Pixel Value": 1})
+            index = similarity.get_index(self.app)
+            self.assertEqual(index.search(0xFF, 0), [])
+            # backfilled by the reprocess command of another process
+            Images.update_results([{"id": image_id, "result": {"Perceptual Hash": "00000000000000ff"}}])
+            index._refresh_interval = 0
+            self.assertEqual(index.search(0xFF, 0), [(image_id, 0)])
+            Images.complete_job(image_id, {"Perceptual Hash": "0000000000000000"})
+            self.assertEqual(index.search(0xFF, 0), [])
+            self.assertEqual(index.search(0, 0), [(image_id, 0)])
+
+    def test_changed_hashes_replace_the_previous_one(self):
+        with self.app.app_context():
+            image_id = Images.save_results("a.png", {"Perceptual Hash": "00000000000000ff"})
+            index = similarity.get_index(self.app)
+            self.assertEqual(index.search(0xFF, 0), [(image_id, 0)])
+            similarity.add_result(self.app, image_id, {"Perceptual Hash": "0000000000000000"})
+            self.assertEqual(index.search(0xFF, 0), [])
+            self.assertEqual(index.search(0, 0), [(image_id, 0)])
+
+    def test_hash_column_is_saved(self):
+        name = self._upload(get_upload(0), "a.png")
+        with self.app.app_context():
+            image = Images.find_by_path(name)
+            self.assertEqual(image.perceptual_hash, image.result["Perceptual Hash"])
+
+    def test_invalid_distance_returns_bad_request(self):
+        name = self._upload(get_upload(0), "a.png")
+        for distance in ("x", "65", "-1"):
+            response = self.client.get("/images/{}/similar?distance={}".format(name, distance))
+            self.assertEqual(response.status_code, 400)
+
+    def test_unknown_image_returns_not_found(self):
+        self.assertEqual(self.client.get("/images/missing.png/similar").status_code, 404)
+
+    def _upload(self, stream, filename):
+        response = self.client.post("/images", data={"image": (stream, filename)})
+        self.assertEqual(response.status_code, 200, response.get_data())
+        return response.get_json()["image"]
@@ -1,9 +1,11 @@
 import unittest
 from io import BytesIO
 
+import numpy as np
 from PIL import Image
 
 from svc.processors import average_pixel
+from svc.utils.image_context import ImageContext
 
 
 class TestAveragePixel(unittest.TestCase):
@@ -12,6 +14,21 @@ class TestAveragePixel(unittest.TestCase):
         value = average_pixel.execute(obj)
         self.assertEqual(value, 0.6375)
 
+    def test_execute_strip_by_strip_matches_full_array_mean(self):
+        rng = np.random.RandomState(0)
+        for mode, shape in [("RGB", (97, 61, 3)), ("L", (97, 61)), ("RGBA", (97, 61, 4))]:
+            im = Image.fromarray(rng.randint(0, 256, shape).astype(np.uint8), mode)
+            expected = np.mean(np.asarray(im))
+            for strip_rows in (1, 7, 256):
+                obj = BytesIO()
+                im.save(obj, format='png')
+                value = average_pixel.execute(ImageContext(obj, strip_rows=strip_rows))
+                self.assertAlmostEqual(value, expected, places=9)
+
+    def test_execute_uses_materialized_array(self):
+        context = ImageContext(self._create_image(), strip_rows=3)
+        self.assertEqual(average_pixel.execute(context), np.mean(context.array))
+
     def _create_image(self):
         obj = BytesIO()
         im = Image.new('RGB', (20, 20))
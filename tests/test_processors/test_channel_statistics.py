@@ -0,0 +1,70 @@
+import unittest
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from svc.processors import channel_statistics
+from svc.utils.image_context import ImageContext
+
+
+class TestChannelStatistics(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_execute_matches_numpy_statistics_of_8_bit_channels(self):
+        for mode, shape in [("RGB", (37, 23, 3)), ("RGBA", (37, 23, 4)), ("L", (37, 23))]:
+            im = Image.fromarray(self.rng.randint(0, 256, shape).astype(np.uint8), mode)
+            result = channel_statistics.execute(self._save(im, "png"))
+            self.assertEqual(result["mode"], mode)
+            self.assertEqual(sorted(result["channels"]), sorted(im.getbands()))
+            for band, values in zip(im.getbands(), im.split()):
+                self._assert_statistics(result["channels"][band], np.asarray(values))
+
+    def test_execute_handles_16_bit_images(self):
+        values = self.rng.randint(0, 65536, (17, 11)).astype(np.uint16)
+        result = channel_statistics.execute(self._save(Image.fromarray(values), "tiff"))
+        statistics = next(iter(result["channels"].values()))
+        self._assert_statistics(statistics, values)
+        self.assertEqual(result["luminance"], {"mean": statistics["mean"]})
+
+    def test_execute_maps_palette_images_to_their_colors(self):
+        rgb = Image.fromarray(self.rng.randint(0, 256, (19, 13, 3)).astype(np.uint8), "RGB")
+        im = rgb.convert("P", palette=Image.ADAPTIVE, colors=16)
+        result = channel_statistics.execute(self._save(im, "png"))
+        colors = np.asarray(im.convert("RGB"))
+        self.assertEqual(sorted(result["channels"]), ["B", "G", "R"])
+        for i, band in enumerate("RGB"):
+            self._assert_statistics(result["channels"][band], colors[:, :, i])
+
+    def test_execute_gets_luminance_from_channel_means(self):
+        im = Image.new("RGB", (4, 4), (100, 50, 200))
+        result = channel_statistics.execute(self._save(im, "png"))
+        self.assertAlmostEqual(result["luminance"]["mean"], 0.299 * 100 + 0.587 * 50 + 0.114 * 200, places=3)
+
+    def test_execute_falls_back_to_arrays_for_float_images(self):
+        values = self.rng.rand(9, 7).astype(np.float32)
+        result = channel_statistics.execute(self._save(Image.fromarray(values), "tiff"))
+        self._assert_statistics(result["channels"]["F"], values)
+
+    def test_execute_reuses_shared_histogram(self):
+        context = ImageContext(self._save(Image.new("L", (3, 3), 7), "png"))
+        histogram = context.intermediate("histogram")
+        channel_statistics.execute(context)
+        self.assertIs(context.intermediate("histogram"), histogram)
+
+    def _assert_statistics(self, statistics, values):
+        values = values.astype(np.float64).ravel()
+        self.assertAlmostEqual(statistics["mean"], values.mean(), places=3)
+        self.assertAlmostEqual(statistics["std"], values.std(), places=2)
+        self.assertEqual(statistics["min"], values.min())
+        self.assertEqual(statistics["max"], values.max())
+        for percentile in channel_statistics.PERCENTILES:
+            expected = np.sort(values)[int(percentile / 100 * (values.size - 1))]
+            self.assertEqual(statistics["percentiles"][str(percentile)], expected)
+
+    @staticmethod
+    def _save(im, image_format):
+        stream = BytesIO()
+        im.save(stream, format=image_format)
+        return stream
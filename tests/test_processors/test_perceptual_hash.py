@@ -0,0 +1,58 @@
+import unittest
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from svc.processors import perceptual_hash
+from svc.utils.image_context import ImageContext
+
+
+def get_photo(size=(320, 240), seed=0):
+    width, height = size
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width)[None, :, None]
+    y = np.linspace(0, 255, height)[:, None, None]
+    phase = rng.uniform(0, 6, 3)
+    pixels = 127 + 100 * np.sin(x / 40 + phase) * np.cos(y / 30 + phase[::-1])
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def get_hash(image, image_format="png", **kwargs):
+    stream = BytesIO()
+    image.save(stream, image_format, **kwargs)
+    stream.seek(0)
+    return perceptual_hash.execute(ImageContext(stream))
+
+
+def get_distance(first, second):
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+class TestPerceptualHash(unittest.TestCase):
+    def test_hash_has_64_bits(self):
+        value = get_hash(get_photo())
+        self.assertRegex(value, "^[0-9a-f]{16}$")
+
+    def test_gradient_sets_every_bit_where_left_pixel_is_brighter(self):
+        decreasing = Image.fromarray(np.tile(np.arange(255, -1, -1, dtype=np.uint8), (64, 1)))
+        self.assertEqual(get_hash(decreasing), "ffffffffffffffff")
+        self.assertEqual(get_hash(decreasing.transpose(Image.FLIP_LEFT_RIGHT)), "0000000000000000")
+
+    def test_resized_and_recompressed_copies_are_close(self):
+        original = get_hash(get_photo())
+        self.assertLessEqual(get_distance(original, get_hash(get_photo().resize((160, 120)))), 4)
+        self.assertLessEqual(get_distance(original, get_hash(get_photo().convert("RGB"), "jpeg", quality=40)), 4)
+
+    def test_different_images_are_far(self):
+        self.assertGreater(get_distance(get_hash(get_photo(seed=0)), get_hash(get_photo(seed=1))), 10)
+
+    def test_16_bit_images_are_not_clipped(self):
+        pixels = np.tile(np.arange(4000, 0, -40, dtype=np.uint16), (32, 1))
+        self.assertEqual(get_hash(Image.fromarray(pixels)), "ffffffffffffffff")
+
+    def test_get_hash_of_results(self):
+        self.assertEqual(perceptual_hash.get_hash({perceptual_hash.NAME: "00000000000000ff"}), 255)
+        self.assertIsNone(perceptual_hash.get_hash({perceptual_hash.NAME: "zz"}))
+        self.assertIsNone(perceptual_hash.get_hash({}))
+        self.assertIsNone(perceptual_hash.get_hash(None))
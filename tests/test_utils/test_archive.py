@@ -0,0 +1,54 @@
+import tarfile
+import unittest
+import zipfile
+from io import BytesIO
+
+from werkzeug.datastructures import FileStorage
+
+from svc.utils.archive import ArchiveTooLarge, iter_archive
+
+
+class TestIterArchive(unittest.TestCase):
+    def test_yields_zip_files(self):
+        stream = BytesIO()
+        with zipfile.ZipFile(stream, "w") as archive:
+            archive.writestr("images/a.png", b"a")
+            archive.writestr("images/", b"")
+        files = list(iter_archive(FileStorage(stream=stream, filename="images.zip")))
+        self.assertEqual([f.filename for f in files], ["a.png"])
+        self.assertEqual(files[0].mimetype, "image/png")
+        self.assertEqual(files[0].read(), b"a")
+
+    def test_yields_compressed_tar_files(self):
+        stream = BytesIO()
+        with tarfile.open(fileobj=stream, mode="w:gz") as archive:
+            info = tarfile.TarInfo("b.jpg")
+            info.size = 1
+            archive.addfile(info, BytesIO(b"b"))
+        files = list(iter_archive(FileStorage(stream=stream, filename="images.tar.gz")))
+        self.assertEqual([f.filename for f in files], ["b.jpg"])
+        self.assertEqual(files[0].mimetype, "image/jpeg")
+
+    def test_raises_tar_error_for_invalid_archive(self):
+        with self.assertRaises(tarfile.TarError):
+            list(iter_archive(FileStorage(stream=BytesIO(b"junk"), filename="images.zip")))
+
+    def test_raises_archive_too_large_for_large_files(self):
+        stream = BytesIO()
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("bomb.png", b"\0" * 10000)
+        with self.assertRaises(ArchiveTooLarge):
+            list(iter_archive(FileStorage(stream=stream, filename="images.zip"), max_file_size=1000))
+
+    def test_raises_archive_too_large_when_all_files_exceed_the_total_size(self):
+        stream = BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as archive:
+            for name in ("a.png", "b.png", "c.png"):
+                info = tarfile.TarInfo(name)
+                info.size = 400
+                archive.addfile(info, BytesIO(b"\0" * 400))
+        files = iter_archive(FileStorage(stream=stream, filename="images.tar"), max_file_size=500, max_total_size=1000)
+        self.assertEqual(next(files).filename, "a.png")
+        self.assertEqual(next(files).filename, "b.png")
+        with self.assertRaises(ArchiveTooLarge):
+            next(files)
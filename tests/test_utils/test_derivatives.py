@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+from io import BytesIO
+
+from PIL import Image
+from werkzeug.exceptions import BadRequest
+
+from svc.utils.derivatives import DerivativeCache, DerivativeSpec
+
+
+class TestDerivativeSpec(unittest.TestCase):
+    def test_returns_none_without_derivative_options(self):
+        self.assertIsNone(DerivativeSpec.from_options({}, {}))
+
+    def test_parses_options(self):
+        spec = DerivativeSpec.from_options({"width": "10", "height": "20", "fit": "cover", "format": "png"}, {})
+        self.assertEqual((spec.width, spec.height, spec.fit, spec.format), (10, 20, "cover", "PNG"))
+        self.assertEqual(spec.get_name("image.jpg"), "image.jpg__10x20_cover_q85.png")
+
+    def test_raises_bad_request_for_invalid_options(self):
+        invalid_options = [
+            {"width": "abc"},
+            {"width": "0"},
+            {"width": "5000"},
+            {"quality": "100"},
+            {"fit": "stretch"},
+            {"format": "gif"},
+            {"width": "10", "fit": "cover"},
+        ]
+        for options in invalid_options:
+            with self.assertRaises(BadRequest):
+                DerivativeSpec.from_options(options, {})
+
+    def test_contain_keeps_aspect_ratio_without_upscaling(self):
+        self.assertEqual(self._render(DerivativeSpec(width=50)).size, (50, 25))
+        self.assertEqual(self._render(DerivativeSpec(width=50, height=10)).size, (20, 10))
+        self.assertEqual(self._render(DerivativeSpec(width=500)).size, (100, 50))
+
+    def test_cover_and_fill_return_exact_size(self):
+        self.assertEqual(self._render(DerivativeSpec(30, 30, "cover")).size, (30, 30))
+        self.assertEqual(self._render(DerivativeSpec(30, 30, "fill", image_format="png")).size, (30, 30))
+
+    def test_renders_requested_format(self):
+        self.assertEqual(self._render(DerivativeSpec(width=10, image_format="webp")).format, "WEBP")
+
+    def _render(self, spec):
+        original = BytesIO()
+        Image.new("RGBA", (100, 50), (1, 2, 3, 4)).save(original, format="png")
+        return Image.open(BytesIO(spec.render(original.getvalue())))
+
+
+class TestDerivativeCache(unittest.TestCase):
+    def test_returns_cached_value(self):
+        cache = DerivativeCache(100)
+        self.assertEqual(cache.get_or_create("a", lambda: b"value"), b"value")
+        self.assertEqual(cache.get_or_create("a", self._fail), b"value")
+
+    def test_evicts_least_recently_used_items(self):
+        cache = DerivativeCache(10)
+        cache.get_or_create("a", lambda: b"aaaa")
+        cache.get_or_create("b", lambda: b"bbbb")
+        cache.get_or_create("a", self._fail)
+        cache.get_or_create("c", lambda: b"cccc")
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.get_or_create("a", self._fail), b"aaaa")
+        self.assertEqual(cache.get_or_create("b", lambda: b"new"), b"new")
+
+    def test_does_not_cache_values_larger_than_cache(self):
+        cache = DerivativeCache(2)
+        cache.get_or_create("a", lambda: b"aaaa")
+        self.assertEqual(cache.size, 0)
+
+    def test_concurrent_requests_generate_value_once(self):
+        cache = DerivativeCache(100)
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.05)
+            return b"value"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("a", factory)))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"value"] * 5)
+
+    def test_failed_generation_is_retried(self):
+        cache = DerivativeCache(100)
+        with self.assertRaises(IOError):
+            cache.get_or_create("a", self._fail)
+        self.assertEqual(cache.get_or_create("a", lambda: b"value"), b"value")
+
+    @staticmethod
+    def _fail():
+        raise IOError("should not be called")
@@ -1,10 +1,13 @@
+import os
+import tempfile
 import unittest
-from io import StringIO
+from datetime import datetime
+from io import BytesIO
 from unittest.mock import patch
 
-from boto3.resources.base import ServiceResource
+from botocore.client import BaseClient
 from botocore.exceptions import ClientError
-from flask import Response
+from flask import Flask, Response
 from werkzeug.exceptions import NotFound
 
 from svc.utils.file_reader import LocalFileReader, S3FileReader, get_file_reader
@@ -49,45 +52,123 @@ class TestLocalFileReader(unittest.TestCase):
     @patch("svc.utils.file_reader.send_from_directory")
     def test_get_response_calls_send_from_directory_with_correct_parameters(self, mock_send):
         self.reader.get_response(self.file_name)
-        mock_send.assert_called_once_with("/upload/path", "filename")
+        mock_send.assert_called_once_with("/upload/path", "filename", conditional=True, cache_timeout=0)
+
+    def test_read_returns_file_contents(self):
+        with tempfile.TemporaryDirectory() as upload_path:
+            with open(os.path.join(upload_path, self.file_name), "wb") as f:
+                f.write(b"contents")
+            reader = LocalFileReader({"UPLOAD_PATH": upload_path})
+            self.assertEqual(reader.read(self.file_name), b"contents")
+
+    def test_get_response_supports_ranges_and_conditional_requests(self):
+        app = Flask(__name__)
+        with tempfile.TemporaryDirectory() as upload_path:
+            with open(os.path.join(upload_path, self.file_name), "wb") as f:
+                f.write(b"contents")
+            reader = LocalFileReader({"UPLOAD_PATH": upload_path, "VIEW_CACHE_MAX_AGE": 60})
+            with app.test_request_context(headers={"Range": "bytes=0-2"}):
+                res = reader.get_response(self.file_name)
+                self.assertEqual(res.status_code, 206)
+                self.assertEqual(res.cache_control.max_age, 60)
+                etag = res.headers["ETag"]
+                res.close()
+            with app.test_request_context(headers={"If-None-Match": etag}):
+                res = reader.get_response(self.file_name)
+                self.assertEqual(res.status_code, 304)
+                res.close()
 
 
 class TestS3FileReader(unittest.TestCase):
     def setUp(self):
         self.config = {
-            "S3_BUCKET_NAME": "test_bucket"
+            "S3_BUCKET_NAME": "test_bucket",
+            "VIEW_CACHE_MAX_AGE": 60,
         }
         self.file_name = "filename"
         self.reader = S3FileReaderSpy(self.config)
+        self.app = Flask(__name__)
 
     def test_initialized_with_correct_attributes(self):
         reader = S3FileReader(self.config)
         self.assertEqual(reader._config, self.config)
         self.assertEqual(reader._bucket_name, "test_bucket")
-        self.assertIsInstance(reader._s3_client, ServiceResource)
+        self.assertIsInstance(reader._s3_client, BaseClient)
 
-    @patch("svc.utils.file_reader.current_app")
-    def test_get_response_raises_not_found_exception_if_file_not_found(self, mock_app):
-        self.reader.raise_client_error = True
-        with self.assertRaises(NotFound):
+    def test_get_response_raises_not_found_exception_if_file_not_found(self):
+        self.reader.error = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        with self.app.test_request_context(), self.assertRaises(NotFound):
             self.reader.get_response(self.file_name)
 
-    @patch("svc.utils.file_reader.make_response")
-    def test_returns_correct_flask_response_if_file_found(self, make_response_mock):
-        make_response_mock.return_value = Response("contents")
-        res = self.reader.get_response(self.file_name)
-        self.assertEqual(res.response, [b"contents"])
-        self.assertEqual(res.headers['Content-Type'], "text/plain")
-        self.assertIsInstance(res, Response)
-        make_response_mock.assert_called_once_with("contents")
+    def test_returns_correct_flask_response_if_file_found(self):
+        with self.app.test_request_context():
+            res = self.reader.get_response(self.file_name)
+            self.assertIsInstance(res, Response)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(b"".join(res.response), b"contents")
+            self.assertEqual(res.headers['Content-Type'], "text/plain")
+            self.assertEqual(res.headers['ETag'], '"etag"')
+            self.assertEqual(res.headers['Cache-Control'], "public, max-age=60")
+            self.assertEqual(res.headers['Last-Modified'], "Wed, 01 Jan 2020 00:00:00 GMT")
+
+    def test_streams_body_in_chunks(self):
+        self.reader._chunk_size = 3
+        with self.app.test_request_context():
+            res = self.reader.get_response(self.file_name)
+            self.assertEqual(list(res.response), [b"con", b"ten", b"ts"])
+
+    def test_passes_range_and_conditional_headers_to_s3(self):
+        headers = {
+            "Range": "bytes=0-1",
+            "If-None-Match": '"etag"',
+            "If-Modified-Since": "Wed, 01 Jan 2020 00:00:00 GMT",
+        }
+        self.reader.content_range = "bytes 0-1/8"
+        with self.app.test_request_context(headers=headers):
+            res = self.reader.get_response(self.file_name)
+            self.assertEqual(res.status_code, 206)
+            self.assertEqual(res.headers['Content-Range'], "bytes 0-1/8")
+        self.assertEqual(self.reader.params["Range"], "bytes=0-1")
+        self.assertEqual(self.reader.params["IfNoneMatch"], '"etag"')
+        self.assertEqual(self.reader.params["IfModifiedSince"], datetime(2020, 1, 1))
+
+    def test_returns_not_modified_if_client_copy_is_valid(self):
+        self.reader.error = ClientError({
+            "Error": {"Code": "304"},
+            "ResponseMetadata": {"HTTPHeaders": {"etag": '"etag"'}}
+        }, "GetObject")
+        with self.app.test_request_context(headers={"If-None-Match": '"etag"'}):
+            res = self.reader.get_response(self.file_name)
+            self.assertEqual(res.status_code, 304)
+            self.assertEqual(res.headers['ETag'], '"etag"')
+
+    def test_returns_range_not_satisfiable_for_invalid_range(self):
+        self.reader.error = ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        with self.app.test_request_context(headers={"Range": "bytes=100-200"}):
+            self.assertEqual(self.reader.get_response(self.file_name).status_code, 416)
+
+    def test_read_returns_object_body(self):
+        self.assertEqual(self.reader.read(self.file_name), b"contents")
 
 
 class S3FileReaderSpy(S3FileReader):
     def __init__(self, config):
         super().__init__(config)
-        self.raise_client_error = False
-
-    def _get_file(self, file_name):
-        if self.raise_client_error:
-            raise ClientError({}, "")
-        return StringIO("contents"), 'text/plain'
+        self.error = None
+        self.content_range = None
+        self.params = None
+
+    def _get_file(self, file_name, **params):
+        self.params = params
+        if self.error:
+            raise self.error
+        obj = {
+            "Body": BytesIO(b"contents"),
+            "ContentType": "text/plain",
+            "ContentLength": 8,
+            "ETag": '"etag"',
+            "LastModified": datetime(2020, 1, 1),
+        }
+        if self.content_range:
+            obj["ContentRange"] = self.content_range
+        return obj
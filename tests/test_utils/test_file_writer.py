@@ -1,5 +1,6 @@
 import os
 import unittest
+from io import BytesIO
 from unittest.mock import patch, Mock
 
 from botocore.client import BaseClient
@@ -57,10 +58,13 @@ class TestS3FileWriter(unittest.TestCase):
         self.assertEqual(self.writer._bucket_name, "test_bucket")
         self.assertIsInstance(self.writer._s3_client, BaseClient)
 
-    @patch("svc.utils.file_writer.boto3")
-    def test_save_calls_put_object_with_correct_parameters(self, mock_boto3):
+    def test_uses_shared_s3_client(self):
+        self.assertIs(S3FileWriter(self.config)._s3_client, self.writer._s3_client)
+
+    @patch("svc.utils.file_writer.get_s3_client")
+    def test_save_calls_put_object_with_correct_parameters(self, mock_get_client):
         mock_client = Mock(self.writer._s3_client)
-        mock_boto3.client.return_value = mock_client
+        mock_get_client.return_value = mock_client
         writer = S3FileWriter(self.config)
         self.file_obj = FileObjDouble(self.file_name, "images/png")
         writer.save(self.file_obj, self.file_name)
@@ -71,12 +75,29 @@ class TestS3FileWriter(unittest.TestCase):
             ContentType=self.file_obj.content_type
         )
 
+    @patch("svc.utils.file_writer.get_s3_client")
+    def test_save_uploads_large_files_in_concurrent_parts(self, mock_get_client):
+        mock_client = Mock(self.writer._s3_client)
+        mock_get_client.return_value = mock_client
+        writer = S3FileWriter({**self.config, "S3_MULTIPART_THRESHOLD": 10, "S3_MULTIPART_CONCURRENCY": 3})
+        self.file_obj = FileObjDouble(self.file_name, "images/png", b"x" * 20)
+        self.file_obj.stream.seek(5)
+        writer.save(self.file_obj, self.file_name)
+        mock_client.put_object.assert_not_called()
+        args, kwargs = mock_client.upload_fileobj.call_args
+        self.assertEqual(args, (self.file_obj.stream, "test_bucket", self.file_name))
+        self.assertEqual(self.file_obj.stream.tell(), 0)
+        self.assertEqual(kwargs["ExtraArgs"], {"ContentType": "images/png"})
+        self.assertEqual(kwargs["Config"].multipart_threshold, 10)
+        self.assertEqual(kwargs["Config"].max_concurrency, 3)
+
 
 class FileObjDouble:
-    def __init__(self, filename="", content_type=""):
+    def __init__(self, filename="", content_type="", content=b""):
         self.filename = filename
         self.path = ""
         self.content_type = content_type
+        self.stream = BytesIO(content)
 
     def save(self, path):
         self.path = path
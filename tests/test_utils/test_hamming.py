@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from svc.utils import hamming
+from svc.utils.hamming import HammingIndex, popcount
+
+
+class TestPopcount(unittest.TestCase):
+    def test_popcount_and_byte_table_fallback(self):
+        values = np.random.RandomState(0).randint(0, 2 ** 63, 1000, dtype=np.int64).astype(np.uint64)
+        values[0] = np.uint64(2 ** 64 - 1)
+        expected = [bin(value).count("1") for value in values.tolist()]
+        self.assertEqual(popcount(values).tolist(), expected)
+        self.assertEqual(hamming._table_popcount(values).tolist(), expected)
+
+
+class TestHammingIndex(unittest.TestCase):
+    def test_search_returns_close_items_closest_first(self):
+        index = HammingIndex()
+        index.add_many([1, 2, 3, 4], [0b0000, 0b0111, 0b0001, 2 ** 64 - 1])
+        self.assertEqual(index.search(0, 3), [(1, 0), (3, 1), (2, 3)])
+        self.assertEqual(index.search(0, 1), [(1, 0), (3, 1)])
+        self.assertEqual(index.search(2 ** 64 - 1, 0), [(4, 0)])
+        self.assertEqual(index.search(0, 64, limit=2), [(1, 0), (3, 1)])
+
+    def test_add_grows_the_arrays(self):
+        index = HammingIndex(capacity=2)
+        for item_id in range(100):
+            index.add(item_id, item_id)
+        self.assertEqual(len(index), 100)
+        self.assertEqual(index.search(99, 0), [(99, 0)])
+
+    def test_items_added_twice_are_returned_once(self):
+        index = HammingIndex()
+        index.add_many([1, 1], [5, 5])
+        self.assertEqual(index.search(5, 0), [(1, 0)])
+
+    def test_adding_a_known_id_replaces_its_hash(self):
+        index = HammingIndex(capacity=1)
+        index.add_many([1, 2], [0, 3])
+        index.add(1, 0xFF)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search(0, 64), [(2, 2), (1, 8)])
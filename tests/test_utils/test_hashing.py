@@ -0,0 +1,24 @@
+import hashlib
+import unittest
+from io import BytesIO
+
+from werkzeug.datastructures import FileStorage
+
+from svc.utils.hashing import HashingStream, get_content_hash
+
+
+class TestGetContentHash(unittest.TestCase):
+    def test_computes_hash_of_stream_and_rewinds_it(self):
+        image_obj = FileStorage(stream=BytesIO(b"contents"), filename="image.png")
+        content_hash = get_content_hash(image_obj)
+        self.assertEqual(content_hash, hashlib.sha256(b"contents").hexdigest())
+        self.assertEqual(image_obj.stream.tell(), 0)
+
+    def test_uses_hash_computed_while_streaming(self):
+        stream = HashingStream(BytesIO())
+        stream.write(b"con")
+        stream.write(b"tents")
+        stream.seek(0)
+        image_obj = FileStorage(stream=stream, filename="image.png")
+        self.assertEqual(get_content_hash(image_obj), hashlib.sha256(b"contents").hexdigest())
+        self.assertEqual(image_obj.read(), b"contents")
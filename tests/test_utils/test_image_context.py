@@ -0,0 +1,68 @@
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+from svc.utils.image_context import ImageContext
+
+
+class TestImageContext(unittest.TestCase):
+    def setUp(self):
+        self.stream = BytesIO()
+        im = Image.new('RGB', (4, 2), (10, 20, 30))
+        im.save(self.stream, format='png')
+        self.context = ImageContext(self.stream)
+
+    def test_image_is_decoded_only_once(self):
+        with patch("svc.utils.image_context.Image.open", wraps=Image.open) as mock_open:
+            self.context.image
+            self.context.array
+            self.context.grayscale
+            mock_open.assert_called_once()
+
+    def test_array_has_image_shape(self):
+        self.assertEqual(self.context.array.shape, (2, 4, 3))
+
+    def test_derived_views_are_cached(self):
+        self.assertIs(self.context.float32, self.context.float32)
+        self.assertEqual(self.context.float32.dtype, np.float32)
+        self.assertEqual(self.context.grayscale.shape, (2, 4))
+
+    def test_channels_are_split_by_band(self):
+        channels = self.context.channels
+        self.assertEqual(sorted(channels), ["B", "G", "R"])
+        self.assertTrue((channels["G"] == 20).all())
+
+    def test_iter_strips_yields_image_rows(self):
+        strips = list(ImageContext(self.stream, strip_rows=1).iter_strips())
+        self.assertEqual([strip.shape for strip in strips], [(1, 4, 3), (1, 4, 3)])
+        self.assertTrue((np.concatenate(strips) == self.context.array).all())
+
+    def test_iter_strips_are_views_of_materialized_array(self):
+        array = self.context.array
+        strips = list(self.context.iter_strips(rows=1))
+        self.assertTrue(np.shares_memory(strips[0], array))
+
+    def test_jpeg_is_decoded_at_reduced_scale(self):
+        stream = BytesIO()
+        Image.new('RGB', (800, 600), (10, 20, 30)).save(stream, format='jpeg')
+        context = ImageContext(stream, max_decode_scale=4)
+        self.assertEqual(context.image.size, (200, 150))
+        self.assertEqual(context.original_size, (800, 600))
+        self.assertEqual(context.decode_scale, 0.25)
+
+    def test_formats_without_draft_mode_are_fully_decoded(self):
+        context = ImageContext(self.stream, max_decode_scale=4)
+        self.assertEqual(context.image.size, (4, 2))
+        self.assertEqual(context.decode_scale, 1)
+
+    def test_stream_returns_raw_upload_bytes(self):
+        self.assertEqual(self.context.stream().read(), self.stream.getvalue())
+
+    def test_wrap_returns_same_context(self):
+        self.assertIs(ImageContext.wrap(self.context), self.context)
+
+    def test_wrap_builds_context_from_stream(self):
+        self.assertIsInstance(ImageContext.wrap(self.stream), ImageContext)
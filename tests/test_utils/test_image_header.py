@@ -0,0 +1,48 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from svc.utils.image_header import InvalidImage, normalize_format, read_header, sniff_format
+
+
+def get_image(image_format, size=(30, 20), mode="RGB"):
+    stream = BytesIO()
+    Image.new(mode, size).save(stream, format=image_format)
+    stream.seek(0)
+    return stream
+
+
+class TestImageHeader(unittest.TestCase):
+    def test_sniff_format_from_magic_bytes(self):
+        for image_format in ("png", "jpeg", "tiff", "gif", "bmp", "webp"):
+            self.assertEqual(sniff_format(get_image(image_format).read(12)), image_format)
+        self.assertIsNone(sniff_format(b"<html></html>"))
+        self.assertIsNone(sniff_format(b""))
+
+    def test_read_header_returns_format_dimensions_and_mode(self):
+        header = read_header(get_image("png", (300, 200), "L"))
+        self.assertEqual(tuple(header), ("png", 300, 200, "L"))
+
+    def test_read_header_rewinds_the_stream(self):
+        stream = get_image("jpeg")
+        stream.seek(5)
+        read_header(stream)
+        self.assertEqual(stream.tell(), 0)
+
+    def test_read_header_only_needs_the_header_bytes(self):
+        content = get_image("png", (4000, 3000)).getvalue()
+        # the pixels are not decoded, a file cut after its header is enough
+        header = read_header(BytesIO(content[:64]))
+        self.assertEqual((header.width, header.height), (4000, 3000))
+
+    def test_read_header_rejects_unknown_and_broken_files(self):
+        with self.assertRaises(InvalidImage):
+            read_header(BytesIO(b"not an image"))
+        with self.assertRaises(InvalidImage):
+            read_header(BytesIO(b"\x89PNG\r\n\x1a\n" + b"\x00" * 8))
+
+    def test_normalize_format_aliases(self):
+        self.assertEqual(normalize_format("JPG"), "jpeg")
+        self.assertEqual(normalize_format("tif"), "tiff")
+        self.assertEqual(normalize_format("png"), "png")
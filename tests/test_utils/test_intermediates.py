@@ -0,0 +1,53 @@
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+from svc.utils import intermediates
+from svc.utils.image_context import ImageContext
+
+
+class TestIntermediates(unittest.TestCase):
+    def test_histogram_counts_every_band(self):
+        context = self._create_context(Image.new('RGB', (4, 2), (10, 20, 30)))
+        histogram = context.intermediate("histogram")
+        self.assertEqual(sorted(histogram), ["B", "G", "R"])
+        self.assertEqual(histogram["G"][20], 8)
+        self.assertEqual(histogram["G"].sum(), 8)
+
+    def test_histogram_of_16_bit_image_has_65536_bins(self):
+        im = Image.fromarray(np.array([[0, 1000], [1000, 65535]], dtype=np.uint16))
+        context = self._create_context(im)
+        histogram = context.intermediate("histogram")[im.getbands()[0]]
+        self.assertEqual(len(histogram), 65536)
+        self.assertEqual(histogram[1000], 2)
+
+    def test_histogram_is_none_for_float_images(self):
+        im = Image.fromarray(np.ones((2, 2), dtype=np.float32))
+        self.assertIsNone(self._create_context(im).intermediate("histogram"))
+
+    def test_channel_sums_match_pixel_sums(self):
+        rng = np.random.RandomState(0)
+        for mode, shape in [("RGB", (9, 7, 3)), ("L", (9, 7))]:
+            im = Image.fromarray(rng.randint(0, 256, shape).astype(np.uint8), mode)
+            sums = self._create_context(im).intermediate("channel_sums")
+            self.assertEqual(sum(sums.values()), np.asarray(im).sum())
+
+    def test_intermediate_is_computed_once(self):
+        context = self._create_context(Image.new('L', (2, 2)))
+        with patch.object(intermediates.get_provider("histogram"), "_function", wraps=intermediates.histogram) as mock:
+            context.intermediate("channel_sums")
+            context.intermediate("histogram")
+            mock.assert_called_once()
+
+    def test_get_provider_raises_key_error_if_unknown(self):
+        with self.assertRaises(KeyError):
+            intermediates.get_provider("unknown")
+
+    @staticmethod
+    def _create_context(im):
+        stream = BytesIO()
+        im.save(stream, format='tiff' if im.mode in ("F", "I;16") else 'png')
+        return ImageContext(stream)
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from svc.utils.lazy import lazy_import
+
+
+class TestLazyImport(unittest.TestCase):
+    def test_module_is_imported_on_first_attribute_access(self):
+        with patch.dict(sys.modules):
+            sys.modules.pop("colorsys", None)
+            module = lazy_import("colorsys")
+            self.assertNotIn("colorsys", sys.modules)
+            self.assertEqual(module.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+            self.assertIn("colorsys", sys.modules)
+
+    def test_attributes_are_copied_after_import(self):
+        module = lazy_import("json")
+        module.dumps
+        self.assertIs(module.__dict__["dumps"], sys.modules["json"].dumps)
+
+    def test_missing_attribute_raises_attribute_error(self):
+        with self.assertRaises(AttributeError):
+            lazy_import("json").missing_attribute
+
+    def test_service_entry_point_does_not_import_heavy_modules(self):
+        code = "import sys, svc.app; print([m for m in ('numpy', 'PIL.Image', 'boto3') if m in sys.modules])"
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=root, universal_newlines=True)
+        self.assertEqual(output.strip(), "[]")
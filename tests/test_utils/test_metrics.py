@@ -0,0 +1,58 @@
+import unittest
+
+from flask import Flask, g
+
+from svc.utils import metrics
+from svc.utils.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_renders_counters_by_labels(self):
+        self.registry.inc("errors_total", "Errors", processor="task", error="ValueError")
+        self.registry.inc("errors_total", "Errors", processor="task", error="ValueError")
+        rendered = self.registry.render()
+        self.assertIn("# TYPE errors_total counter", rendered)
+        self.assertIn('errors_total{error="ValueError",processor="task"} 2', rendered)
+
+    def test_renders_cumulative_histogram_buckets(self):
+        self.registry.observe("duration_seconds", "Duration", 0.003, stage="save")
+        self.registry.observe("duration_seconds", "Duration", 20, stage="save")
+        rendered = self.registry.render()
+        self.assertIn("# TYPE duration_seconds histogram", rendered)
+        self.assertIn('duration_seconds_bucket{stage="save",le="0.001"} 0', rendered)
+        self.assertIn('duration_seconds_bucket{stage="save",le="0.005"} 1', rendered)
+        self.assertIn('duration_seconds_bucket{stage="save",le="+Inf"} 2', rendered)
+        self.assertIn('duration_seconds_count{stage="save"} 2', rendered)
+        self.assertIn('duration_seconds_sum{stage="save"} 20.003', rendered)
+
+    def test_escapes_label_values(self):
+        self.registry.inc("errors_total", "Errors", processor='my "task"')
+        self.assertIn('processor="my \\"task\\""', self.registry.render())
+
+
+class TestStageTimings(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_timed_stages_are_added_to_server_timing(self):
+        with Flask(__name__).test_request_context():
+            with metrics.timed("storage"):
+                pass
+            metrics.record_stage("task.Average Pixel", 0.0015)
+            self.assertEqual(len(g.timings), 2)
+            server_timing = metrics.get_server_timing()
+            self.assertTrue(server_timing.startswith("storage;dur="))
+            self.assertIn("task.Average_Pixel;dur=1.50", server_timing)
+
+    def test_stages_outside_requests_are_only_aggregated(self):
+        metrics.record_stage("decode", 0.01)
+        self.assertIn('endpoint="background",stage="decode"', metrics.registry.render())
+
+    def test_record_processor_counts_errors(self):
+        metrics.record_processor("task", 0.01, error="ValueError")
+        rendered = metrics.registry.render()
+        self.assertIn('img_process_processor_seconds_count{processor="task"} 1', rendered)
+        self.assertIn('img_process_processor_errors_total{error="ValueError",processor="task"} 1', rendered)
@@ -0,0 +1,111 @@
+import unittest
+from io import BytesIO
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+from flask import Flask
+
+from svc.processors import average_pixel, channel_statistics
+from svc.utils import process_executor
+from svc.utils.image_context import ImageContext
+from svc.utils.process_executor import ProcessTaskExecutor, SharedContext, attach_context
+from svc.utils.task_executor import SyncTaskExecutor, ThreadTaskExecutor, get_task_executor
+
+CONFIG = {"PROCESSING_EXECUTOR": "process", "PROCESSING_MAX_WORKERS": 2}
+
+
+def get_context(mode="RGB", size=(64, 48)):
+    pixels = np.random.RandomState(0).randint(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).convert(mode)
+    stream = BytesIO()
+    image.save(stream, "PNG")
+    stream.seek(0)
+    return ImageContext(stream)
+
+
+class TestGetProcessTaskExecutor(unittest.TestCase):
+    def test_get_process_executor_when_config_is_process(self):
+        self.assertIsInstance(get_task_executor(CONFIG), ProcessTaskExecutor)
+
+    def test_falls_back_to_threads_without_shared_memory(self):
+        with Flask(__name__).app_context(), mock.patch.object(process_executor, "shared_memory", None):
+            executor = get_task_executor(CONFIG)
+        self.assertIs(type(executor), ThreadTaskExecutor)
+
+
+class TestSharedContext(unittest.TestCase):
+    def test_attached_context_maps_the_shared_pixels(self):
+        context = get_context("P")
+        context.intermediate("histogram")
+        context.grayscale
+        with SharedContext(context) as shared:
+            blocks = []
+            attached = attach_context(shared.descriptor, blocks)
+            self.assertFalse(attached.array.flags.owndata)
+            np.testing.assert_array_equal(attached.array, context.array)
+            self.assertEqual(attached.image.mode, "P")
+            self.assertEqual(attached.image.getpalette(), context.image.getpalette())
+            self.assertEqual(attached.original_size, context.original_size)
+            self.assertEqual(attached.get_intermediates().keys(), {"histogram"})
+            del attached
+            for block in blocks:
+                block.close()
+
+    def test_large_array_intermediates_are_shared(self):
+        context = get_context("L", size=(512, 256))
+        context._cache["intermediate:large"] = np.ones((256, 512), dtype=np.uint8)
+        with SharedContext(context) as shared:
+            kind, value = shared.descriptor["intermediates"]["large"]
+            self.assertEqual(kind, "shared")
+            self.assertEqual(value[1], (256, 512))
+
+    def test_blocks_are_unlinked_on_exit(self):
+        with SharedContext(get_context()) as shared:
+            name = shared.descriptor["pixels"][0]
+        with self.assertRaises(FileNotFoundError):
+            process_executor.shared_memory.SharedMemory(name=name)
+
+
+class TestProcessTaskExecutor(unittest.TestCase):
+    def test_run_matches_the_sync_results(self):
+        for mode in ("RGB", "P", "L"):
+            context = get_context(mode)
+            tasks = [average_pixel, channel_statistics]
+            expected, errors = SyncTaskExecutor({}).run(tasks, lambda task: context)
+            self.assertDictEqual(errors, {})
+            executor = ProcessTaskExecutor(CONFIG)
+            results, errors = executor.run(tasks, lambda task: get_context(mode))
+            self.assertDictEqual(errors, {})
+            self.assertDictEqual(results, expected)
+            self.assertEqual(sorted(executor.timings), sorted(task.NAME for task in tasks))
+
+    def test_run_reports_worker_errors(self):
+        empty = ImageContext.from_array(np.zeros((0, 0), dtype=np.uint8), "L", (0, 0))
+        results, errors = ProcessTaskExecutor(CONFIG).run([average_pixel], lambda task: empty)
+        self.assertDictEqual(results, {})
+        self.assertIn(average_pixel.NAME, errors)
+
+    def test_run_keeps_other_tasks_on_threads(self):
+        def task_double(img_obj):
+            return "raw"
+        task_double.NAME = "double"
+        task_double.execute = task_double
+        context = get_context()
+        results, errors = ProcessTaskExecutor(CONFIG).run(
+            [task_double, average_pixel], lambda task: context
+        )
+        self.assertDictEqual(errors, {})
+        self.assertEqual(results["double"], "raw")
+        self.assertIn(average_pixel.NAME, results)
+
+    def test_run_reports_undecodable_images_as_task_errors(self):
+        stream = BytesIO()
+        Image.new("RGB", (64, 48), (10, 20, 30)).save(stream, "PNG")
+        content = stream.getvalue()
+        truncated = ImageContext(BytesIO(content[:len(content) // 2]))
+        results, errors = ProcessTaskExecutor(CONFIG).run(
+            [average_pixel, channel_statistics], lambda task: truncated
+        )
+        self.assertDictEqual(results, {})
+        self.assertEqual(sorted(errors), sorted([average_pixel.NAME, channel_statistics.NAME]))
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from botocore.client import BaseClient
+
+from svc.utils import storage_clients
+
+
+class TestStorageClients(unittest.TestCase):
+    def setUp(self):
+        storage_clients.reset()
+
+    def tearDown(self):
+        storage_clients.reset()
+
+    def test_client_is_created_once_and_reused(self):
+        client = storage_clients.get_s3_client({})
+        self.assertIsInstance(client, BaseClient)
+        self.assertIs(storage_clients.get_s3_client({}), client)
+        stats = storage_clients.get_stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 1)
+
+    def test_client_is_configured_from_config(self):
+        config = {
+            "S3_MAX_POOL_CONNECTIONS": 25,
+            "S3_MAX_RETRIES": 2,
+            "S3_CONNECT_TIMEOUT": 1,
+            "S3_READ_TIMEOUT": 7,
+        }
+        client = storage_clients.get_s3_client(config)
+        self.assertEqual(client.meta.config.max_pool_connections, 25)
+        self.assertEqual(client.meta.config.connect_timeout, 1)
+        self.assertEqual(client.meta.config.read_timeout, 7)
+        self.assertIsNot(client, storage_clients.get_s3_client({}))
+
+    def test_stats_lists_clients_pools(self):
+        storage_clients.get_s3_client({"S3_MAX_POOL_CONNECTIONS": 5})
+        stats = storage_clients.get_stats()
+        self.assertEqual(stats["clients"], [{"max_pool_connections": 5, "pools": []}])
+
+    def test_stats_reports_the_pools_of_a_real_client(self):
+        client = storage_clients.get_s3_client({"S3_MAX_POOL_CONNECTIONS": 5})
+        # opens the pool of a host without connecting, as the first request would
+        client._endpoint.http_session._manager.connection_from_host("s3.amazonaws.com", 443, "https")
+        pools = storage_clients.get_stats()["clients"][0]["pools"]
+        self.assertEqual(pools, [{"host": "s3.amazonaws.com", "connections": 0, "idle": 5}])
+
+    def test_stats_reports_pools_unavailable_when_botocore_internals_change(self):
+        self.assertEqual(storage_clients._get_pools_usage(Mock(spec=BaseClient)), storage_clients.POOLS_UNAVAILABLE)
+        client = storage_clients.get_s3_client({})
+        client._endpoint.http_session._manager = None
+        self.assertEqual(storage_clients._get_pools_usage(client), storage_clients.POOLS_UNAVAILABLE)
+
+    def test_concurrent_creations_share_the_first_client(self):
+        def create_client(config):
+            time.sleep(0.05)
+            return Mock()
+
+        clients = []
+        with patch.object(storage_clients, "_create_client", create_client):
+            threads = [threading.Thread(target=lambda: clients.append(storage_clients.get_s3_client({})))
+                       for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertIs(clients[0], clients[1])
+        self.assertEqual(storage_clients.get_stats()["created"], 1)
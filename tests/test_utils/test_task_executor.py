@@ -0,0 +1,134 @@
+import threading
+import time
+import unittest
+
+from svc.utils import metrics
+from svc.utils.task_executor import SyncTaskExecutor, ThreadTaskExecutor, get_task_executor
+
+
+class TestGetTaskExecutor(unittest.TestCase):
+    def test_get_sync_executor_by_default(self):
+        self.assertIsInstance(get_task_executor({}), SyncTaskExecutor)
+
+    def test_get_thread_executor_when_config_is_thread(self):
+        executor = get_task_executor({"PROCESSING_EXECUTOR": "thread", "PROCESSING_MAX_WORKERS": 2})
+        self.assertIsInstance(executor, ThreadTaskExecutor)
+
+
+class TestSyncTaskExecutor(unittest.TestCase):
+    def test_run_collects_results_and_errors(self):
+        executor = SyncTaskExecutor({})
+        tasks = [TaskDouble("task1", {"value": 10}), TaskDouble("task2", error=Exception("Unknown Error"))]
+        results, errors = executor.run(tasks, lambda task: None)
+        self.assertDictEqual(results, {"task1": {"value": 10}})
+        self.assertDictEqual(errors, {"task2": "Unknown Error"})
+
+    def test_run_records_task_timings(self):
+        executor = SyncTaskExecutor({})
+        executor.run([TaskDouble("task1", 1), TaskDouble("task2", error=Exception())], lambda task: None)
+        self.assertEqual(sorted(executor.timings), ["task1", "task2"])
+
+    def test_run_skips_empty_results(self):
+        results, errors = SyncTaskExecutor({}).run([TaskDouble("task1", None)], lambda task: None)
+        self.assertDictEqual(results, {})
+        self.assertDictEqual(errors, {})
+
+    def test_run_skips_tasks_after_deadline(self):
+        executor = SyncTaskExecutor({"PROCESSING_DEADLINE": 0})
+        results, errors = executor.run([TaskDouble("task1", 1)], lambda task: None)
+        self.assertDictEqual(results, {})
+        self.assertIn("deadline", errors["task1"])
+
+
+class TestThreadTaskExecutor(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.config = {"PROCESSING_MAX_WORKERS": 4}
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_run_passes_task_input(self):
+        task = TaskDouble("task1", 1)
+        ThreadTaskExecutor(self.config).run([task], lambda t: "input")
+        self.assertEqual(task.received, "input")
+
+    def test_run_reports_timed_out_tasks_as_errors(self):
+        self.config["PROCESSING_TASK_TIMEOUT"] = 0.05
+        tasks = [TaskDouble("fast", 1), TaskDouble("slow", 2, wait_for=self.release)]
+        results, errors = ThreadTaskExecutor(self.config).run(tasks, lambda task: None)
+        self.assertDictEqual(results, {"fast": 1})
+        self.assertEqual(errors, {"slow": "Task timed out after 0.05s"})
+
+    def test_task_timeout_counts_from_the_task_start(self):
+        self.config.update({"PROCESSING_MAX_WORKERS": 1, "PROCESSING_TASK_TIMEOUT": 0.5})
+        tasks = [TaskDouble("first", 1, seconds=0.3), TaskDouble("queued", 2, seconds=0.3)]
+        results, errors = ThreadTaskExecutor(self.config).run(tasks, lambda task: None)
+        self.assertDictEqual(errors, {})
+        self.assertDictEqual(results, {"first": 1, "queued": 2})
+
+    def test_queued_tasks_are_cancelled_at_the_deadline(self):
+        self.config.update({"PROCESSING_MAX_WORKERS": 1, "PROCESSING_DEADLINE": 0.05})
+        queued_done = threading.Event()
+        tasks = [TaskDouble("slow", 1, wait_for=self.release), TaskDouble("queued", 2, done=queued_done)]
+        results, errors = ThreadTaskExecutor(self.config).run(tasks, lambda task: None)
+        self.assertEqual(errors, {
+            "slow": "Request deadline of 0.05s exceeded", "queued": "Request deadline of 0.05s exceeded"
+        })
+        self.release.set()
+        self.assertFalse(queued_done.wait(0.1))
+
+    def test_hung_tasks_are_counted_until_they_return(self):
+        metrics.registry.reset()
+        self.config["PROCESSING_TASK_TIMEOUT"] = 0.05
+        done = threading.Event()
+        task = TaskDouble("slow", 1, wait_for=self.release, done=done)
+        ThreadTaskExecutor(self.config).run([task], lambda t: None)
+        self.assertIn('img_process_hung_tasks{pool="processor"} 1', metrics.registry.render())
+        self.release.set()
+        self.assertTrue(done.wait(5))
+        time.sleep(0.05)
+        self.assertIn('img_process_hung_tasks{pool="processor"} 0', metrics.registry.render())
+
+    def test_task_timeout_attribute_overrides_config(self):
+        self.config["PROCESSING_TASK_TIMEOUT"] = 10
+        task = TaskDouble("slow", 2, wait_for=self.release)
+        task.TIMEOUT = 0.05
+        results, errors = ThreadTaskExecutor(self.config).run([task], lambda t: None)
+        self.assertEqual(errors, {"slow": "Task timed out after 0.05s"})
+
+    def test_run_reports_deadline_exceeded(self):
+        self.config["PROCESSING_DEADLINE"] = 0.05
+        tasks = [TaskDouble("slow", 2, wait_for=self.release)]
+        results, errors = ThreadTaskExecutor(self.config).run(tasks, lambda task: None)
+        self.assertEqual(errors, {"slow": "Request deadline of 0.05s exceeded"})
+
+    def test_deadline_counts_from_the_given_start(self):
+        self.config.update({"PROCESSING_DEADLINE": 1, "PROCESSING_TASK_TIMEOUT": 10})
+        tasks = [TaskDouble("slow", 2, wait_for=self.release)]
+        started = time.monotonic() - 0.95
+        results, errors = ThreadTaskExecutor(self.config).run(tasks, lambda task: None, started)
+        self.assertEqual(errors, {"slow": "Request deadline of 1s exceeded"})
+
+
+class TaskDouble:
+    def __init__(self, name, value=None, error=None, wait_for=None, seconds=None, done=None):
+        self.NAME = name
+        self.value = value
+        self.error = error
+        self.wait_for = wait_for
+        self.seconds = seconds
+        self.done = done
+        self.received = None
+
+    def execute(self, image_obj):
+        self.received = image_obj
+        if self.wait_for:
+            self.wait_for.wait(5)
+        if self.seconds:
+            time.sleep(self.seconds)
+        if self.done:
+            self.done.set()
+        if self.error:
+            raise self.error
+        return self.value
@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+from svc.utils import intermediates
+from svc.utils.intermediates import Provider, get_provider
+from svc.utils.task_graph import TaskGraph
+
+
+class TestTaskGraph(unittest.TestCase):
+    def setUp(self):
+        self.context = ContextDouble()
+
+    def test_prepare_computes_shared_intermediates_once_in_dependency_order(self):
+        base = Mock(return_value=1)
+        task1 = TaskDouble("task1", ("graph_derived",), [
+            Provider("graph_base", base),
+            Provider("graph_derived", lambda context: context.intermediate("graph_base") + 1, ("graph_base",)),
+        ])
+        task2 = TaskDouble("task2", ("graph_base",))
+        graph = TaskGraph([task1, task2])
+        self.assertEqual(graph.prepare(self.context), {})
+        base.assert_called_once()
+        self.assertEqual(self.context.computed, ["graph_base", "graph_derived"])
+        self.assertEqual(sorted(graph.timings), ["graph_base", "graph_derived"])
+
+    def test_prepare_runs_independent_intermediates_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        task = TaskDouble("task", ("graph_left", "graph_right"), [
+            Provider("graph_left", lambda context: barrier.wait()),
+            Provider("graph_right", lambda context: barrier.wait()),
+        ])
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            self.assertEqual(TaskGraph([task]).prepare(self.context, pool), {})
+
+    def test_prepare_reports_failures_to_dependent_tasks_only(self):
+        task1 = TaskDouble("task1", ("graph_child",), [
+            Provider("graph_broken", Mock(side_effect=ValueError("broken"))),
+            Provider("graph_child", Mock(), ("graph_broken",)),
+            Provider("graph_fine", Mock()),
+        ])
+        task2 = TaskDouble("task2", ("graph_fine",))
+        errors = TaskGraph([task1, task2]).prepare(self.context)
+        self.assertDictEqual(errors, {"task1": "Intermediate graph_broken failed: broken"})
+        self.assertNotIn("graph_child", self.context.computed)
+
+    def test_prepare_reports_unknown_and_cyclic_intermediates(self):
+        task1 = TaskDouble("task1", ("graph_missing",))
+        task2 = TaskDouble("task2", ("graph_a",), [
+            Provider("graph_a", Mock(), ("graph_b",)),
+            Provider("graph_b", Mock(), ("graph_a",)),
+        ])
+        errors = TaskGraph([task1, task2]).prepare(self.context)
+        self.assertEqual(errors["task1"], "Unknown intermediate graph_missing")
+        self.assertEqual(errors["task2"], "Cyclic intermediates graph_a -> graph_b -> graph_a")
+
+    def test_prepare_reports_timed_out_intermediates(self):
+        release = threading.Event()
+        task = TaskDouble("task", ("graph_slow",), [Provider("graph_slow", lambda context: release.wait(5))])
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            graph = TaskGraph([task])
+            try:
+                errors = graph.prepare(self.context, pool, timeout=0.05)
+            finally:
+                release.set()
+        self.assertEqual(errors, {"task": "Intermediate graph_slow failed: Intermediate timed out after 0.05s"})
+        self.assertNotIn("graph_slow", graph.timings)
+
+    def test_prepare_skips_intermediates_after_the_deadline(self):
+        computed = Mock()
+        task = TaskDouble("task", ("graph_late",), [Provider("graph_late", computed)])
+        errors = TaskGraph([task]).prepare(self.context, deadline=1, started=time.monotonic() - 1)
+        self.assertEqual(errors, {"task": "Intermediate graph_late failed: Request deadline of 1s exceeded"})
+        computed.assert_not_called()
+
+    def test_task_providers_are_local_to_their_graph(self):
+        overriding = TaskDouble("task1", ("histogram",), [Provider("histogram", Mock(return_value="task histogram"))])
+        self.assertEqual(TaskGraph([overriding]).prepare(self.context), {})
+        self.assertEqual(self.context.intermediate("histogram"), "task histogram")
+        self.assertIsNot(get_provider("histogram"), overriding.PROVIDES[0])
+        self.assertFalse(intermediates.has_provider("graph_base"))
+        errors = TaskGraph([TaskDouble("task2", ("graph_base",))]).prepare(ContextDouble())
+        self.assertEqual(errors["task2"], "Unknown intermediate graph_base")
+
+
+class TaskDouble:
+    def __init__(self, name, requires=(), provides=()):
+        self.NAME = name
+        self.REQUIRES = requires
+        self.PROVIDES = provides
+
+
+class ContextDouble:
+    def __init__(self):
+        self.computed = []
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def intermediate(self, name, provider=None):
+        if name not in self._values:
+            self._values[name] = (provider or get_provider(name)).compute(self)
+            with self._lock:
+                self.computed.append(name)
+        return self._values[name]
@@ -0,0 +1,119 @@
+import unittest
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from benchmarks.s3_standin import S3StandIn
+from svc.app import create_app, init_db
+from svc.models import entities
+from svc.models.entities import db, Images
+from svc.workers import ingest
+from svc.workers.ingest import IngestPoller
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.s3 = S3StandIn()
+        self.patches = [
+            patch("svc.utils.file_reader.get_s3_client", return_value=self.s3),
+            patch("svc.utils.file_writer.get_s3_client", return_value=self.s3),
+        ]
+        for p in self.patches:
+            p.start()
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "s3",
+            "S3_BUCKET_NAME": "bucket",
+            "ALLOWED_IMAGES_EXTENSIONS": ["png"],
+            "MAX_CONTENT_LENGTH": 1024 * 1024,
+            "UPLOAD_URL_EXPIRES": 60,
+        })
+        init_db(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+        for p in self.patches:
+            p.stop()
+
+    def test_create_upload_returns_presigned_form(self):
+        response = self.client.post("/images/uploads", json={"filename": "a.png", "content_type": "image/png"})
+        self.assertEqual(response.status_code, 201)
+        body = response.get_json()
+        self.assertEqual(body["status"], entities.UPLOADING)
+        self.assertEqual(body["upload"]["fields"]["key"], body["image"])
+        self.assertTrue(body["image"].startswith("uploads/"))
+        self.assertEqual(body["upload"]["fields"]["Content-Type"], "image/png")
+
+    def test_create_upload_rejects_invalid_files(self):
+        response = self.client.post("/images/uploads", json={"filename": "a.gif", "content_type": "image/gif"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_s3_event_processes_uploaded_image_once(self):
+        image_name = self._upload()
+        event = {"Records": [{"s3": {"object": {"key": image_name}}}] * 2}
+        with patch("svc.workers.ingest._get_app", return_value=self.app):
+            self.assertEqual(ingest.handle_s3_event(event, None), {"ingested": 1})
+        job = self._get_job(image_name)
+        self.assertEqual(job["status"], entities.DONE)
+        self.assertIn("Average Pixel Value", job["results"])
+        with self.app.app_context():
+            self.assertIsNotNone(Images.query.filter(Images.path == image_name).one().content_hash)
+
+    def test_direct_uploads_are_viewed_and_resized_outside_their_prefix(self):
+        image_name = self._upload()
+        with patch("svc.workers.ingest._get_app", return_value=self.app):
+            ingest.handle_s3_event({"Records": [{"s3": {"object": {"key": image_name}}}]}, None)
+        self.assertEqual(self.client.get("/images/view/{}".format(image_name)).status_code, 200)
+        response = self.client.get("/images/view/{}?width=4&format=png".format(image_name))
+        self.assertEqual(response.status_code, 200)
+        derivatives = [key for bucket, key in self.s3._objects if key != image_name]
+        self.assertEqual(derivatives, [image_name.replace("/", "_") + "__4x_contain_q85.png"])
+        self.assertEqual(self.client.get("/images/{}/similar".format(image_name)).status_code, 200)
+
+    def test_s3_event_fails_uploads_which_are_not_images(self):
+        image_name = self._create_upload()
+        self.s3.put_object(Bucket="bucket", Key=image_name, Body=b"not an image", ContentType="image/png")
+        with patch("svc.workers.ingest._get_app", return_value=self.app):
+            ingest.handle_s3_event({"Records": [{"s3": {"object": {"key": image_name}}}]}, None)
+        job = self._get_job(image_name)
+        self.assertEqual(job["status"], entities.FAILED)
+        self.assertEqual(job["results"], {"errors": {"validation": "The uploaded file is not a supported image"}})
+
+    def test_s3_event_ignores_unknown_objects(self):
+        with patch("svc.workers.ingest._get_app", return_value=self.app):
+            event = {"Records": [{"s3": {"object": {"key": "other+file.png"}}}]}
+            self.assertEqual(ingest.handle_s3_event(event, None), {"ingested": 0})
+
+    def test_poller_ingests_landed_uploads_and_fails_expired_ones(self):
+        landed = self._upload()
+        waiting = self._create_upload()
+        expired = self._create_upload()
+        with self.app.app_context():
+            Images.query.filter(Images.path == expired).update({Images.uploaded_at: datetime.utcnow() - timedelta(hours=1)})
+            db.session.commit()
+        self.assertEqual(IngestPoller(self.app).run_once(), 1)
+        self.assertEqual(self._get_job(landed)["status"], entities.DONE)
+        self.assertEqual(self._get_job(waiting)["status"], entities.UPLOADING)
+        self.assertEqual(self._get_job(expired)["status"], entities.FAILED)
+
+    def _create_upload(self):
+        response = self.client.post("/images/uploads", json={"filename": "a.png", "content_type": "image/png"})
+        body = response.get_json()
+        self._jobs = getattr(self, "_jobs", {})
+        self._jobs[body["image"]] = body["job_id"]
+        return body["image"]
+
+    def _upload(self):
+        image_name = self._create_upload()
+        stream = BytesIO()
+        Image.new("RGB", (8, 8), (10, 20, 30)).save(stream, format="png")
+        self.s3.put_object(Bucket="bucket", Key=image_name, Body=stream.getvalue(), ContentType="image/png")
+        return image_name
+
+    def _get_job(self, image_name):
+        return self.client.get("/images/jobs/{}".format(self._jobs[image_name])).get_json()
@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+from svc.app import create_app, init_db
+from svc.models import entities
+from svc.models.entities import db, Images
+from svc.workers.jobs import JobWorkerPool, start_workers
+
+
+class TestJobWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "lcl",
+        })
+        init_db(self.app)
+        self.pool = JobWorkerPool(self.app)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+
+    def test_start_workers_does_nothing_in_sync_mode(self):
+        self.assertIsNone(start_workers(self.app))
+
+    def test_run_once_returns_false_if_queue_is_empty(self):
+        self.assertFalse(self.pool.run_once())
+
+    @patch("svc.workers.jobs.ImagesController.process_stored_image")
+    def test_run_once_saves_job_result(self, mock_process):
+        mock_process.return_value = {"task": 1, "errors": {}}
+        job_id = self._create_job("image.png")
+        self.assertTrue(self.pool.run_once())
+        mock_process.assert_called_once_with("image.png")
+        job = self._get_job(job_id)
+        self.assertEqual(job.status, entities.DONE)
+        self.assertEqual(job.result, {"task": 1, "errors": {}})
+
+    @patch("svc.workers.jobs.ImagesController.process_stored_image")
+    def test_run_once_marks_job_failed_on_error(self, mock_process):
+        mock_process.side_effect = IOError("missing file")
+        job_id = self._create_job("image.png")
+        self.pool.run_once()
+        job = self._get_job(job_id)
+        self.assertEqual(job.status, entities.FAILED)
+        self.assertEqual(job.result, {"errors": {"job": "missing file"}})
+
+    def test_claimed_job_is_not_claimed_again_before_lease_expires(self):
+        self._create_job("image.png")
+        with self.app.app_context():
+            self.assertIsNotNone(Images.claim_next_job(300))
+            self.assertIsNone(Images.claim_next_job(300))
+            self.assertIsNotNone(Images.claim_next_job(-1))
+
+    def _create_job(self, path):
+        with self.app.app_context():
+            return Images.create_job(path).id
+
+    def _get_job(self, job_id):
+        with self.app.app_context():
+            job = Images.get_job(job_id)
+            db.session.expunge(job)
+            return job
@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from PIL import Image
+
+from benchmarks.s3_standin import S3StandIn
+from svc.app import create_app, init_db
+from svc.models.entities import db, Images, ImageResults
+from svc.workers.reprocess import CheckpointMismatch, Reprocessor, get_outdated_tasks, merge_results
+
+
+def get_task(name, value=1, version=1):
+    def execute(img_obj):
+        task.calls += 1
+        return value
+    task = SimpleNamespace(NAME=name, VERSION=version, execute=execute, calls=0)
+    return task
+
+
+class TestOutdatedTasks(unittest.TestCase):
+    def test_missing_failed_and_older_results_are_outdated(self):
+        current, bumped, added, failed = get_task("current"), get_task("bumped", version=2), get_task("added"), \
+            get_task("failed")
+        result = {
+            "current": 1, "bumped": 1, "errors": {"failed": "broken"}, "meta": {"versions": {"current": 1, "bumped": 1}}
+        }
+        self.assertEqual(get_outdated_tasks(result, [current, bumped, added, failed]), [bumped, added, failed])
+
+    def test_results_without_versions_come_from_the_first_version(self):
+        self.assertEqual(get_outdated_tasks({"task": 1}, [get_task("task")]), [])
+        self.assertEqual(len(get_outdated_tasks({"task": 1}, [get_task("task", version=2)])), 1)
+
+    def test_results_with_top_level_versions_are_still_read(self):
+        self.assertEqual(get_outdated_tasks({"task": 1, "versions": {"task": 2}}, [get_task("task", version=2)]), [])
+
+    def test_merge_replaces_only_the_rerun_tasks(self):
+        result = {
+            "kept": 1, "rerun": 1, "errors": {"rerun": "broken", "other": "x"},
+            "meta": {"versions": {"kept": 1}, "decode_scale": 0.5},
+        }
+        update = {"rerun": 2, "errors": {}, "meta": {"versions": {"rerun": 2}}}
+        self.assertEqual(merge_results(result, update, [get_task("rerun")]), {
+            "kept": 1, "rerun": 2, "errors": {"other": "x"},
+            "meta": {"versions": {"kept": 1, "rerun": 2}, "decode_scale": 0.5},
+        })
+
+    def test_merge_moves_top_level_versions_and_decode_scale_to_meta(self):
+        result = {"kept": 1, "errors": {}, "versions": {"kept": 1}, "decode_scale": 0.25}
+        update = {"rerun": 2, "errors": {}, "meta": {"versions": {"rerun": 1}}}
+        self.assertEqual(merge_results(result, update, [get_task("rerun")]), {
+            "kept": 1, "rerun": 2, "errors": {}, "meta": {"versions": {"kept": 1, "rerun": 1}, "decode_scale": 0.25},
+        })
+
+
+class TestReprocessor(unittest.TestCase):
+    def setUp(self):
+        self.s3 = S3StandIn()
+        self.patcher = patch("svc.utils.file_reader.get_s3_client", return_value=self.s3)
+        self.patcher.start()
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "UPLOAD_TYPE": "s3",
+            "S3_BUCKET_NAME": "bucket",
+        })
+        init_db(self.app)
+        directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(directory, "checkpoint.json")
+        self.logs = []
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+        self.patcher.stop()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def test_run_adds_missing_results_and_indexes_them(self):
+        self._add_images(5, {"old": 1, "errors": {}})
+        task = get_task("new", value=42)
+        stats = self._get_reprocessor([task], batch_size=2).run()
+        self.assertEqual((stats["updated"], stats["skipped"], stats["failed"]), (5, 0, 0))
+        with self.app.app_context():
+            for image in Images.query:
+                self.assertEqual(image.result["new"], 42)
+                self.assertEqual(image.result["old"], 1)
+                self.assertEqual(image.result["meta"], {"versions": {"new": 1}})
+            self.assertEqual(ImageResults.query.filter_by(name="new").count(), 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_run_skips_up_to_date_images(self):
+        self._add_images(3, {"task": 1, "errors": {}})
+        task = get_task("task")
+        stats = self._get_reprocessor([task]).run()
+        self.assertEqual((stats["scanned"], stats["skipped"]), (3, 3))
+        self.assertEqual(task.calls, 0)
+
+    def test_run_filters_images(self):
+        self._add_images(4, {"errors": {}}, prefix="a_")
+        self._add_images(2, {"errors": {}}, prefix="b_")
+        task = get_task("task")
+        stats = self._get_reprocessor([task], path_pattern="b\\_%").run()
+        self.assertEqual(stats["updated"], 2)
+        self.assertEqual(task.calls, 2)
+
+    def test_run_resumes_after_the_checkpoint(self):
+        ids = self._add_images(4, {"errors": {}})
+        task = get_task("task")
+        with open(self.checkpoint, "w") as checkpoint_file:
+            options = self._get_reprocessor([task])._get_options()
+            json.dump({"options": options, "stats": {"last_id": ids[1], "scanned": 2, "updated": 2}}, checkpoint_file)
+        stats = self._get_reprocessor([task]).run()
+        self.assertEqual(task.calls, 2)
+        self.assertEqual((stats["scanned"], stats["updated"]), (4, 4))
+
+    def test_run_refuses_checkpoint_of_other_options(self):
+        self._add_images(1, {"errors": {}})
+        self._get_reprocessor([get_task("task")])._save_checkpoint()
+        with self.assertRaises(CheckpointMismatch):
+            self._get_reprocessor([get_task("other")]).run()
+
+    def test_interrupted_run_keeps_written_batches(self):
+        self._add_images(4, {"errors": {}})
+        reprocessor = self._get_reprocessor([get_task("task")], batch_size=2, workers=1, prefetch=1)
+        write = Images.update_results
+        calls = []
+
+        def interrupted_write(rows):
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise KeyboardInterrupt()
+            write(rows)
+        with patch.object(Images, "update_results", side_effect=interrupted_write):
+            with self.assertRaises(KeyboardInterrupt):
+                reprocessor.run()
+        with open(self.checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)["stats"]["updated"], 2)
+        stats = self._get_reprocessor([get_task("task")]).run()
+        self.assertEqual(stats["updated"], 4)
+
+    def test_failed_images_are_counted_and_left_unchanged(self):
+        ids = self._add_images(1, {"errors": {}}, prefix="missing_", store=False) + self._add_images(1, {"errors": {}})
+        stats = self._get_reprocessor([get_task("task")]).run()
+        self.assertEqual((stats["updated"], stats["failed"]), (1, 1))
+        with self.app.app_context():
+            self.assertNotIn("task", Images.query.get(ids[0]).result)
+
+    def test_dry_run_only_counts(self):
+        self._add_images(2, {"errors": {}})
+        task = get_task("task")
+        stats = self._get_reprocessor([task]).run(dry_run=True)
+        self.assertEqual(stats["updated"], 2)
+        self.assertEqual(task.calls, 0)
+
+    def _get_reprocessor(self, tasks, **kwargs):
+        return Reprocessor(self.app, tasks, checkpoint_path=self.checkpoint, log=self.logs.append, **kwargs)
+
+    def _add_images(self, count, result, prefix="image_", store=True):
+        stream = BytesIO()
+        Image.new("L", (4, 4)).save(stream, "PNG")
+        ids = []
+        with self.app.app_context():
+            for i in range(count):
+                name = "{}{}.png".format(prefix, i)
+                if store:
+                    self.s3.put_object(Bucket="bucket", Key=name, Body=stream.getvalue())
+                image = Images(path=name, result=result)
+                db.session.add(image)
+                db.session.commit()
+                ids.append(image.id)
+        return ids